@@ -0,0 +1,17 @@
+from rest_framework.filters import SearchFilter
+
+from categories.models import Category
+from categories.serializers import CategorySerializer
+from categories.views import CategoryListView
+from config.utils.async_api import ApiResponse, async_api_view
+
+
+@async_api_view(authenticated=False, throttle_classes=CategoryListView.throttle_classes)
+async def category_list(request):
+    # ?search= like CategoryListView
+    terms = SearchFilter().get_search_terms(request)
+    queryset = Category.objects.all()
+    for term in terms:
+        queryset = queryset.filter(name__icontains=term)
+    categories = [category async for category in queryset]
+    return ApiResponse(CategorySerializer(categories, many=True).data)
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.5 on 2026-10-18 11:52
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categories', '0003_alter_categoryimage_image'),
+    ]
+
+    # The auto-created through table only has the (category_id, product_id)
+    # unique constraint. Going from products to their categories (prefetch,
+    # facets) needs the reverse order.
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX category_products_product_category_idx '
+                'ON categories_category_products (product_id, category_id);',
+            reverse_sql='DROP INDEX IF EXISTS category_products_product_category_idx;',
+        ),
+    ]
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from categories.models import Category, CategoryImage
 from products.serializers import ProductSerializer
+from config.utils.dynamic_fields import DynamicFieldsMixin
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -17,7 +18,7 @@ class CategoryImageSerializer(serializers.ModelSerializer):
 
 
 
-class CategoryDetailSerializer(serializers.ModelSerializer):
+class CategoryDetailSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     products = ProductSerializer(many=True, read_only=True)
     images = CategoryImageSerializer(many=True, read_only=True)
 
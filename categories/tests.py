@@ -1,3 +1,57 @@
 from django.test import TestCase
+from django.urls import reverse
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from rest_framework import status
+from config.utils.query_budget import QueryBudgetMixin
+from categories.models import Category, CategoryImage
+from products.models import Product, ProductTag
 
-# Create your tests here.
+User = get_user_model()
+
+
+class CategoryDetailQueryBudgetTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='categoryuser',
+            email='category@example.com',
+            password='password123',
+        )
+        self.client.force_authenticate(self.user)
+
+        self.category = Category.objects.create(name='games')
+        CategoryImage.objects.bulk_create([
+            CategoryImage(category=self.category, image='categories/me_when.png')
+        ])
+        self.tag = ProductTag.objects.create(name='rpg')
+
+    def add_products(self, count):
+        products = Product.objects.bulk_create([
+            Product(name=f'product {index}', description='description', price=10)
+            for index in range(count)
+        ])
+        for product in products:
+            product.tags.add(self.tag)
+        self.category.products.add(*products)
+
+    def test_category_detail(self):
+        url = reverse('category-detail', args=[self.category.id])
+
+        for count in [1, 10, 30]:
+            self.add_products(count)
+            with self.subTest(products=count):
+                # validators, category, products, tags, images
+                response = self.assertQueryBudget(5, self.client.get, url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(response.data['images']), 1)
+                self.assertEqual(response.data['products'][0]['tags'][0]['name'], 'rpg')
+
+    def test_category_detail_sparse_fields(self):
+        self.add_products(10)
+        url = reverse('category-detail', args=[self.category.id])
+
+        # validators, category, products - no tags or images queries
+        response = self.assertQueryBudget(3, self.client.get, url, {'fields': 'id,products.id,products.name'})
+        self.assertEqual(set(response.data), {'id', 'products'})
+        self.assertEqual(set(response.data['products'][0]), {'id', 'name'})
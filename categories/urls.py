@@ -1,5 +1,6 @@
 from django.urls import path, include
 from .views import  CategoryImageViewSet, CategoryListView
+from . import async_views
 
 from rest_framework_nested import routers
 from rest_framework.routers import SimpleRouter, DefaultRouter
@@ -20,6 +21,7 @@ categories_router.register('images', CategoryImageViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('', include(categories_router.urls)),
+    path('async/categories/', async_views.category_list, name='async-category-list'),
 ]
 
 
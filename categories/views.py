@@ -1,15 +1,41 @@
 from rest_framework.mixins import CreateModelMixin, ListModelMixin, UpdateModelMixin, RetrieveModelMixin, DestroyModelMixin
 from rest_framework.viewsets import GenericViewSet
 from rest_framework.filters import SearchFilter
+from django.db.models import Count, Max
 from categories.models import Category, CategoryImage
+from config.utils.conditional import ConditionalGetMixin
+from products.querysets import shape_queryset
 from .serializers import CategoryDetailSerializer, CategoryImageSerializer, CategorySerializer
 
-class CategoryListView(ListModelMixin, RetrieveModelMixin, GenericViewSet):
+class CategoryListView(ConditionalGetMixin, ListModelMixin, RetrieveModelMixin, GenericViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     filter_backends = [SearchFilter]
     search_fields = ['name']
 
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return CategoryDetailSerializer
+        return self.serializer_class
+
+    def get_queryset(self):
+        queryset = self.queryset.all()
+        if self.action == 'retrieve':
+            queryset = shape_queryset(queryset, self.get_serializer())
+        return queryset
+
+    def get_validator_aggregates(self):
+        aggregates = super().get_validator_aggregates()
+        if self.action == 'retrieve':
+            aggregates.update({
+                'products_updated_at': Max('products__updated_at'),
+                'product_count': Count('products', distinct=True),
+                'tags_updated_at': Max('products__tags__updated_at'),
+                'images_updated_at': Max('images__updated_at'),
+                'image_count': Count('images', distinct=True),
+            })
+        return aggregates
+
     
 
 # class CategoryDetailView(RetrieveModelMixin, GenericViewSet):
@@ -1,5 +1,11 @@
 import os
-from celery import Celery, shared_task
+
+from config.utils.green import patch
+
+# `celery worker -P gevent` has patched the process by now; psycopg2 still needs it
+patch()
+
+from celery import Celery, shared_task  # noqa: E402
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
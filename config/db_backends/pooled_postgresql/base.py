@@ -0,0 +1,51 @@
+"""
+The postgresql backend with connections from config.utils.db_pool.
+
+Django opens a connection per thread, and per greenlet under gevent, and
+closes it when the request or Celery task ends (CONN_MAX_AGE=0). Here
+opening takes one from the process pool and closing gives it back, so a
+request skips the connection setup and thousands of greenlets share
+DATABASES[alias]['POOL']['MAX_SIZE'] Postgres connections.
+"""
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+
+from config.utils.db_pool import close_pools, get_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    connection_pool = None
+
+    def get_connection_pool(self, conn_params):
+        options = self.settings_dict.get('POOL', {})
+        # tests point the alias at another database
+        key = (self.alias, *(conn_params.get(name) for name in ('host', 'port', 'dbname', 'user')))
+        connect = super().get_new_connection
+        return get_pool(
+            key, lambda: connect(conn_params),
+            name=self.alias,
+            min_size=options.get('MIN_SIZE', 0),
+            max_size=options.get('MAX_SIZE', 20),
+            timeout=options.get('TIMEOUT', 10),
+            max_lifetime=options.get('MAX_LIFETIME'),
+            max_idle=options.get('MAX_IDLE'),
+            pre_ping_after=options.get('PRE_PING_AFTER'),
+        )
+
+    def get_new_connection(self, conn_params):
+        if self.alias == NO_DB_ALIAS:
+            return super().get_new_connection(conn_params)
+        self.connection_pool = self.get_connection_pool(conn_params)
+        return self.connection_pool.getconn()
+
+    def _close(self):
+        if self.connection is None or self.connection_pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.connection_pool.putconn(self.connection)
+        # closed inside atomic() Django keeps the attribute, but the pool owns it now
+        self.connection = None
+
+    def close_pool(self):
+        # creating, cloning and dropping the test database need it unused
+        close_pools(self.alias)
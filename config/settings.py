@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 
     "users",
     "products",
@@ -54,6 +55,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "config.utils.metrics.MetricsMiddleware",
+    "config.utils.db_pool.PoolExhaustedMiddleware",
+    "config.utils.query_count.QueryCountMiddleware",
+    "config.utils.query_inspector.QueryInspectorMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.security.SecurityMiddleware",
@@ -61,12 +66,17 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "config.utils.db_router.ReplicaRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "config.utils.profiler.ProfilerMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
 
+# tests get Redis databases of their own, see config.utils.test_runner
+TEST_RUNNER = "config.utils.test_runner.TestRunner"
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -91,16 +101,48 @@ WSGI_APPLICATION = "config.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "config.db_backends.pooled_postgresql",
         "NAME": os.environ.get("POSTGRES_DB"),
         "USER": os.environ.get("POSTGRES_USER"),
         "PASSWORD": os.environ.get("POSTGRES_PASSWORD"),
         "HOST": "db",
-        "PORT": "5432"
-
+        "PORT": "5432",
+        # per-process pool, see config.utils.db_pool. Under gevent every greenlet
+        # holds a connection, so MAX_SIZE is what bounds them there
+        "POOL": {
+            "MIN_SIZE": int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+            "MAX_SIZE": int(os.getenv("DB_POOL_MAX_SIZE", 20)),
+            # seconds to wait for a free connection before answering 503
+            "TIMEOUT": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+            "MAX_LIFETIME": float(os.getenv("DB_POOL_MAX_LIFETIME", 1800)),
+            "MAX_IDLE": float(os.getenv("DB_POOL_MAX_IDLE", 300)),
+            # connections idle this long are checked with SELECT 1 before use
+            "PRE_PING_AFTER": float(os.getenv("DB_POOL_PRE_PING_AFTER", 1)),
+        },
     }
 }
 
+# read replicas as "host[:port],host[:port]", see config.utils.db_router; tests
+# mirror them onto default
+REPLICA_DATABASES = []
+for index, replica in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')), 1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or '5432',
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['config.utils.db_router.ReplicaRouter']
+
+# a user who wrote reads from the primary for this long
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+# replicas further behind than this many seconds are skipped, checked this often per process
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 2))
+REPLICA_LAG_CHECK_INTERVAL = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -156,7 +198,8 @@ REST_FRAMEWORK = {
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
         'user': '1000/day',
-        'likes': '30/minute'
+        'likes': '30/minute',
+        'autocomplete': '120/minute'
     },
     
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -164,19 +207,69 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
 
         ),
+    # prices are DecimalFields, keep rendering them as JSON numbers
+    'COERCE_DECIMAL_TO_STRING': False,
 }
 
 
 CACHES = {
     'default': {
         'BACKEND': 'django_redis.cache.RedisCache',
-        'LOCATION': 'redis://redis:6379/1',  # Use the appropriate Redis server URL
+        'LOCATION': os.getenv('CACHE_REDIS_URL', 'redis://redis:6379/1'),  # Use the appropriate Redis server URL
         'OPTIONS': {
             'CLIENT_CLASS': 'django_redis.client.DefaultClient',
         }
     }
 }
 
+# per-endpoint switches for config.utils.response_cache.CachedResponseMixin
+RESPONSE_CACHE_ENDPOINTS = {
+    'product.list': True,
+    'product.retrieve': True,
+    'product.facets': True,
+    'product.async_list': True,
+    'product.async_retrieve': True,
+}
+RESPONSE_CACHE_TIMEOUT = 60 * 5
+RESPONSE_CACHE_TIMEOUTS = {
+    'product.facets': 60,
+}
+
+# lower bounds of the /products/facets/ price histogram buckets, in BASE_CURRENCY
+PRODUCT_FACET_PRICE_BUCKETS = [0, 50, 100, 250, 500, 1000]
+
+# /metrics requires "Authorization: Bearer <METRICS_TOKEN>"; without a token
+# it is only served when DEBUG is on
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# config.utils.query_inspector: log queries slower than SLOW_QUERY_MS, EXPLAIN a
+# sample of them, and flag a request running one query shape N_PLUS_ONE_THRESHOLD times
+QUERY_INSPECTOR_ENABLED = os.getenv('QUERY_INSPECTOR_ENABLED', '1') == '1'
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 200))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.05))
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 10))
+QUERY_INSPECTOR_STACK_DEPTH = 8
+
+# config.utils.profiler: where profiles of X-Profile requests are written, the
+# stack sampling interval in seconds and how long profile_token tokens are valid
+PROFILER_DIR = os.getenv('PROFILER_DIR', BASE_DIR / 'profiles')
+PROFILER_SAMPLE_INTERVAL = 0.001
+PROFILER_TOKEN_MAX_AGE = 60 * 60
+
+# X-Query-Count on every response, for benchmark_api against a separately started server
+QUERY_COUNT_HEADER = os.getenv('QUERY_COUNT_HEADER') == '1'
+
+# most products POST/PATCH/DELETE /products/bulk/ accepts per request
+PRODUCT_BULK_MAX_ITEMS = 500
+
+# rows per server-side cursor fetch for /products/export/
+PRODUCT_EXPORT_CHUNK_SIZE = 2000
+
+# Product.price_in_base is in this currency, FxRate rows convert to it
+BASE_CURRENCY = 'gel'
+FX_RATES_CACHE_TIMEOUT = 60 * 60
+PRICE_RECOMPUTE_BATCH_SIZE = 10000
+
 SWAGGER_SETTINGS = {
     'USE_SESSSION_AUTH':False,
     'SECURITY_DEFINITIONS': {
@@ -209,6 +302,23 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
 
+# carts kept in Redis and written to Postgres behind, see products.cart_store
+CART_STORE_ENABLED = os.getenv('CART_STORE_ENABLED') == '1'
+# unflushed carts exist only there: a Redis of their own, with maxmemory-policy
+# noeviction and persistence on, never the cache database
+CART_STORE_REDIS_URL = os.getenv('CART_STORE_REDIS_URL', 'redis://cart-redis:6379/0')
+CART_STORE_TTL = int(os.getenv('CART_STORE_TTL', 60 * 60 * 24))
+CART_STORE_ID_BLOCK = int(os.getenv('CART_STORE_ID_BLOCK', 100))
+CART_STORE_FLUSH_BATCH_SIZE = int(os.getenv('CART_STORE_FLUSH_BATCH_SIZE', 500))
+CART_STORE_FLUSH_INTERVAL = float(os.getenv('CART_STORE_FLUSH_INTERVAL', 5))
+
+CELERY_BEAT_SCHEDULE = {
+    'flush-carts': {
+        'task': 'products.tasks.flush_carts',
+        'schedule': CART_STORE_FLUSH_INTERVAL,
+    },
+}
+
 
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
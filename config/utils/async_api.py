@@ -0,0 +1,159 @@
+"""
+Helpers for the async read endpoints (see products.async_views).
+
+DRF views are sync only, so these are plain Django async views: JWT
+authentication with an awaited user lookup, the sync views' throttles,
+JSON rendered with DRF's encoder so bodies match the sync endpoints, and
+the response cache read and written through the async cache API.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import JsonResponse
+from rest_framework.exceptions import Throttled
+from rest_framework.request import Request
+from rest_framework.settings import api_settings as drf_settings
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from config.utils.db_router import primary_reads
+from config.utils.response_cache import (
+    acount_response_cache, aget_generations, response_cache_enabled, response_cache_key, response_cache_timeout,
+)
+
+
+class ApiResponse(JsonResponse):
+    def __init__(self, data, **kwargs):
+        super().__init__(data, encoder=JSONEncoder, safe=False, **kwargs)
+        self.data = data
+
+
+def error(status, detail, **kwargs):
+    return ApiResponse({'detail': detail}, status=status, **kwargs)
+
+
+async def authenticate(request):
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+    if not raw_token:
+        return None
+    try:
+        token = authentication.get_validated_token(raw_token)
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, KeyError):
+        return None
+    User = get_user_model()
+    try:
+        user = await User.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+    except User.DoesNotExist:
+        return None
+    return user if user.is_active else None
+
+
+def throttled(request, throttle_classes):
+    """
+    APIView.check_throttles: a Throttled with the longest wait when any
+    throttle refuses, else None. The history lives in the same cache keys as
+    the sync endpoints', so both count against one quota.
+    """
+    throttles = [throttle() for throttle in throttle_classes]
+    waits = [throttle.wait() for throttle in throttles if not throttle.allow_request(request, None)]
+    if not waits:
+        return None
+    durations = [wait for wait in waits if wait is not None]
+    return Throttled(max(durations, default=None))
+
+
+def async_api_view(authenticated=True, throttle_classes=None):
+    """
+    GET/HEAD only. The view gets a DRF Request, so serializers that read
+    query_params or the user work unchanged. throttle_classes defaults to
+    DEFAULT_THROTTLE_CLASSES; pass the sync view's to share its limits.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return error(405, f'Method "{request.method}" not allowed.', headers={'Allow': 'GET, HEAD'})
+            user = await authenticate(request)
+            if authenticated and user is None:
+                return error(401, 'Authentication credentials were not provided.', headers={'WWW-Authenticate': 'Bearer realm="api"'})
+            api_request = Request(request, authenticators=())
+            if user is not None:
+                api_request.user = user
+            # DRF throttles read and write their history through the sync cache API
+            exception = await sync_to_async(throttled)(
+                api_request, drf_settings.DEFAULT_THROTTLE_CLASSES if throttle_classes is None else throttle_classes,
+            )
+            if exception is not None:
+                headers = {'Retry-After': str(exception.wait)} if exception.wait is not None else {}
+                return error(exception.status_code, str(exception.detail), headers=headers)
+            return await view(api_request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def acached_response(endpoint, request, generation_keys, build):
+    """
+    CachedResponseMixin.cached_response for async views: `build` is a
+    coroutine function returning an ApiResponse.
+    """
+    if not response_cache_enabled(endpoint):
+        return await build()
+
+    key = response_cache_key(endpoint, request, await aget_generations(generation_keys), 'application/json')
+    data = await cache.aget(key)
+    if data is not None:
+        await acount_response_cache(endpoint, 'hits')
+        return ApiResponse(data, headers={'X-Cache': 'HIT'})
+
+    await acount_response_cache(endpoint, 'misses')
+    with primary_reads():
+        response = await build()
+    if response.status_code == 200:
+        await cache.aset(key, response.data, response_cache_timeout(endpoint))
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+async def apaginate(request, queryset, pagination_class, serialize):
+    """
+    The PageNumberPagination body ({count, next, previous, results}) for
+    ?page= / ?page_size=, with results from serialize(objects), or None when
+    the page does not exist.
+    """
+    paginator = pagination_class()
+    # DRF's page size rules: bad or non-positive values fall back to page_size
+    page_size = paginator.get_page_size(request)
+    page = request.query_params.get(paginator.page_query_param) or 1
+
+    count = await queryset.acount()
+    pages = max(1, -(-count // page_size))
+    if page in paginator.last_page_strings:
+        number = pages
+    else:
+        try:
+            number = int(page)
+        except ValueError:
+            return None
+    if not 1 <= number <= pages:
+        return None
+    offset = (number - 1) * page_size
+    items = [item async for item in queryset[offset:offset + page_size]]
+
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, paginator.page_query_param, number + 1) if number < pages else None
+    if number <= 1:
+        previous_url = None
+    elif number == 2:
+        previous_url = remove_query_param(url, paginator.page_query_param)
+    else:
+        previous_url = replace_query_param(url, paginator.page_query_param, number - 1)
+    return {'count': count, 'next': next_url, 'previous': previous_url, 'results': serialize(items)}
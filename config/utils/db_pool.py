@@ -0,0 +1,274 @@
+"""
+Per-process Postgres connection pool, see config.db_backends.pooled_postgresql.
+
+Checking out takes the most recently returned idle connection, pinging it
+first when it sat idle PRE_PING_AFTER seconds or more, or opens a new one
+while fewer than MAX_SIZE exist; otherwise the caller waits up to TIMEOUT
+seconds and gets PoolTimeout, which PoolExhaustedMiddleware answers with a
+503. Connections are closed once older than MAX_LIFETIME (give or take 10%,
+so they do not all reconnect at once) or idle for MAX_IDLE, keeping
+MIN_SIZE. Session state (SET, temp tables) survives checkouts, as with
+CONN_MAX_AGE.
+
+Locks come from `threading`, which gevent patches, so the pool is safe for
+threads and greenlets alike: a caller waiting for a connection blocks only
+its own greenlet. Pools are per process; a forked child starts without any.
+"""
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+import psycopg2
+from django.http import JsonResponse
+from psycopg2 import extensions
+
+from config.utils.metrics import POOL_CLOSED, POOL_CONNECTIONS, POOL_OPENED, POOL_TIMEOUTS, POOL_WAIT
+from config.utils.middleware import HybridMiddleware
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+@dataclass
+class PooledConnection:
+    connection: object
+    expires_at: float
+    returned_at: float = 0
+
+
+class ConnectionPool:
+    def __init__(self, connect, name='default', min_size=0, max_size=20, timeout=10,
+                 max_lifetime=None, max_idle=None, pre_ping_after=None):
+        self.connect = connect
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.pre_ping_after = pre_ping_after
+        # connections open, idle or checked out
+        self.size = 0
+        self.closed = False
+        # last in, first out: the most recently used connections stay busy
+        # and the ones at the bottom idle long enough to be closed
+        self._idle = []
+        self._in_use = {}
+        self._condition = threading.Condition()
+        self.counts = {'checkouts': 0, 'waits': 0, 'timeouts': 0, 'opened': 0, 'closed': 0}
+        self.wait_seconds = 0.0
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            pooled = self._checkout(started, deadline)
+            if pooled is None:
+                pooled = self._open()
+            elif not self._usable(pooled, time.monotonic()):
+                continue
+            self._in_use[id(pooled.connection)] = pooled
+            POOL_CONNECTIONS.labels(self.name, 'in_use').inc()
+            return pooled.connection
+
+    def _checkout(self, started, deadline):
+        # an idle connection, or None when the caller may open one
+        expired = []
+        try:
+            with self._condition:
+                expired = self._expire_idle(time.monotonic())
+                waited = False
+                while not self._idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counts['timeouts'] += 1
+                        POOL_TIMEOUTS.labels(self.name).inc()
+                        raise PoolTimeout(
+                            f'no database connection free after {self.timeout}s, all {self.max_size} are in use'
+                        )
+                    waited = True
+                    self._condition.wait(remaining)
+
+                wait = time.monotonic() - started
+                self.counts['checkouts'] += 1
+                self.counts['waits'] += waited
+                self.wait_seconds += wait
+                POOL_WAIT.labels(self.name).observe(wait)
+                if self._idle:
+                    POOL_CONNECTIONS.labels(self.name, 'idle').dec()
+                    return self._idle.pop()
+                self.size += 1
+                return None
+        finally:
+            for pooled in expired:
+                pooled.connection.close()
+
+    def _open(self):
+        # connecting takes a round trip, others may use the pool meanwhile
+        try:
+            connection = self.connect()
+        except BaseException:
+            self._discard(None)
+            raise
+        with self._condition:
+            self.counts['opened'] += 1
+        POOL_OPENED.labels(self.name).inc()
+        lifetime = self.max_lifetime * random.uniform(0.9, 1.0) if self.max_lifetime else float('inf')
+        return PooledConnection(connection, time.monotonic() + lifetime)
+
+    def _usable(self, pooled, now):
+        if now >= pooled.expires_at:
+            reason = 'lifetime'
+        elif self.pre_ping_after is not None and now - pooled.returned_at >= self.pre_ping_after and not _ping(pooled.connection):
+            reason = 'ping'
+        else:
+            return True
+        pooled.connection.close()
+        self._discard(reason)
+        return False
+
+    def putconn(self, connection):
+        pooled = self._in_use.pop(id(connection))
+        POOL_CONNECTIONS.labels(self.name, 'in_use').dec()
+        now = time.monotonic()
+        if self.closed:
+            # the pool was closed while this was checked out
+            reason = 'shutdown'
+        elif not _reset(connection):
+            reason = 'broken'
+        elif now >= pooled.expires_at:
+            reason = 'lifetime'
+        else:
+            pooled.returned_at = now
+            with self._condition:
+                self._idle.append(pooled)
+                self._condition.notify()
+            POOL_CONNECTIONS.labels(self.name, 'idle').inc()
+            return
+        connection.close()
+        self._discard(reason)
+
+    def _expire_idle(self, now):
+        # under the lock; the caller closes what this returns
+        expired = []
+        while self._idle and self.size > self.min_size:
+            oldest = self._idle[0]
+            if now < oldest.expires_at and (self.max_idle is None or now - oldest.returned_at < self.max_idle):
+                break
+            expired.append(self._idle.pop(0))
+            self.size -= 1
+            self.counts['closed'] += 1
+            POOL_CONNECTIONS.labels(self.name, 'idle').dec()
+            POOL_CLOSED.labels(self.name, 'idle' if now < oldest.expires_at else 'lifetime').inc()
+        return expired
+
+    def _discard(self, reason):
+        with self._condition:
+            self.size -= 1
+            if reason is not None:
+                self.counts['closed'] += 1
+            self._condition.notify()
+        if reason is not None:
+            POOL_CLOSED.labels(self.name, reason).inc()
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            idle, self._idle = self._idle, []
+            self.size -= len(idle)
+            self.counts['closed'] += len(idle)
+        for pooled in idle:
+            pooled.connection.close()
+        POOL_CONNECTIONS.labels(self.name, 'idle').dec(len(idle))
+        POOL_CLOSED.labels(self.name, 'shutdown').inc(len(idle))
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self.size,
+                'idle': len(self._idle),
+                'in_use': self.size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                **self.counts,
+                'wait_seconds': round(self.wait_seconds, 6),
+            }
+
+
+def _ping(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+
+def _reset(connection):
+    if connection.closed:
+        return False
+    status = connection.info.transaction_status
+    if status == extensions.TRANSACTION_STATUS_IDLE:
+        return True
+    if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    try:
+        connection.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(key, connect, **options):
+    with _lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(connect, **options)
+        return _pools[key]
+
+
+def close_pools(name=None):
+    with _lock:
+        keys = [key for key, pool in _pools.items() if name is None or pool.name == name]
+        pools = [_pools.pop(key) for key in keys]
+    for pool in pools:
+        pool.close()
+
+
+def pool_stats():
+    with _lock:
+        pools = list(_pools.values())
+    return [{'alias': pool.name, **pool.stats()} for pool in pools]
+
+
+# a child must not share its parent's sockets
+os.register_at_fork(after_in_child=_pools.clear)
+
+
+class PoolExhaustedMiddleware(HybridMiddleware):
+    """
+    A view that could not get a connection in time answers 503 with
+    Retry-After instead of a 500, so clients and load balancers back off.
+    """
+
+    def call(self, request):
+        return self.get_response(request)
+
+    async def acall(self, request):
+        return await self.get_response(request)
+
+    def process_exception(self, request, exception):
+        # Django wraps the psycopg2 error in its own OperationalError
+        if isinstance(exception, PoolTimeout) or isinstance(exception.__cause__, PoolTimeout):
+            return JsonResponse(
+                {'detail': 'The service is busy, try again shortly.'}, status=503, headers={'Retry-After': '1'},
+            )
+        return None
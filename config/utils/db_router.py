@@ -0,0 +1,170 @@
+"""
+Read replica routing.
+
+Reads go to a replica from settings.REPLICA_DATABASES only inside a
+GET/HEAD/OPTIONS request that ReplicaRoutingMiddleware marked as safe;
+everything else (writes, transactions, Celery, management commands) stays
+on the primary. A request that writes pins its user to the primary for
+REPLICA_STICKY_SECONDS, so the next reads see the write. Replicas lagging
+more than REPLICA_MAX_LAG seconds, or failing the check, are skipped.
+Cached responses are built on the primary, see primary_reads().
+"""
+import contextlib
+import contextvars
+import random
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from config.utils.middleware import HybridMiddleware
+
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+@dataclass
+class RoutingState:
+    use_replica: bool
+    wrote: bool = False
+
+
+_state = contextvars.ContextVar('replica_routing', default=None)
+
+# alias -> (checked at, lag in seconds), per process
+_lag_checks = {}
+
+
+def replica_lag(alias):
+    checked_at, lag = _lag_checks.get(alias, (None, None))
+    now = time.monotonic()
+    if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag = float(cursor.fetchone()[0])
+    except DatabaseError:
+        connections[alias].close()
+        lag = float('inf')
+    _lag_checks[alias] = (now, lag)
+    return lag
+
+
+def reset_lag_checks():
+    _lag_checks.clear()
+
+
+def healthy_replicas():
+    return [alias for alias in settings.REPLICA_DATABASES if replica_lag(alias) <= settings.REPLICA_MAX_LAG]
+
+
+def _pin_key(user_id):
+    return f'replica:pin:{user_id}'
+
+
+def request_user_id(request, user=None):
+    if user is not None and user.is_authenticated:
+        return user.pk
+    # JWT users are only authenticated inside the view; the token says who it is
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+    if not raw_token:
+        return None
+    try:
+        return authentication.get_validated_token(raw_token)[api_settings.USER_ID_CLAIM]
+    except (InvalidToken, TokenError, KeyError):
+        return None
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """
+    Reads inside go to the primary. For bodies shared between users, like
+    cached responses: one built on a lagging replica after someone's write
+    would be stored under the new generation and served to the writer too.
+    """
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    use_replica, state.use_replica = state.use_replica, False
+    try:
+        yield
+    finally:
+        state.use_replica = use_replica
+
+
+class ReplicaRoutingMiddleware(HybridMiddleware):
+    def call(self, request):
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+        user_id = request_user_id(request, getattr(request, 'user', None))
+        pinned = user_id is not None and cache.get(_pin_key(user_id)) is not None
+        state, token = self.start(request, pinned)
+        try:
+            return self.get_response(request)
+        finally:
+            _state.reset(token)
+            if state.wrote and user_id is not None:
+                cache.set(_pin_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+
+    async def acall(self, request):
+        if not settings.REPLICA_DATABASES:
+            return await self.get_response(request)
+        # the session user may need a query, which has to be awaited here
+        user = await request.auser() if hasattr(request, 'auser') else None
+        user_id = request_user_id(request, user)
+        pinned = user_id is not None and await cache.aget(_pin_key(user_id)) is not None
+        state, token = self.start(request, pinned)
+        try:
+            return await self.get_response(request)
+        finally:
+            _state.reset(token)
+            if state.wrote and user_id is not None:
+                await cache.aset(_pin_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+
+    def start(self, request, pinned):
+        state = RoutingState(use_replica=request.method in SAFE_METHODS and not pinned)
+        return state, _state.set(state)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.wrote:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        replicas = healthy_replicas()
+        return random.choice(replicas) if replicas else None
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
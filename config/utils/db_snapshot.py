@@ -0,0 +1,88 @@
+import re
+
+import psycopg2
+from psycopg2 import sql
+from django.db import connection
+
+
+# Snapshots are whole databases created from the working one as a TEMPLATE:
+# PostgreSQL copies the files instead of replaying rows, so saving or
+# restoring a multi-GB benchmark dataset takes seconds. Both need the working
+# database to have no other sessions.
+
+def snapshot_database_name(name):
+    if not re.fullmatch(r'[a-z0-9_]+', name):
+        raise ValueError('snapshot names are lower case letters, digits and _')
+    return f"{connection.settings_dict['NAME']}__snapshot_{name}"
+
+
+def _admin_cursor():
+    params = connection.get_connection_params()
+    # any database but the one being copied or replaced
+    params['dbname'] = 'template1' if params['dbname'] == 'postgres' else 'postgres'
+    admin = psycopg2.connect(**params)
+    admin.autocommit = True
+    return admin
+
+
+def _disconnect():
+    connection.close()
+    # idle pooled connections are sessions too
+    connection.close_pool()
+
+
+def _terminate_sessions(cursor, database):
+    cursor.execute(
+        'SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid()',
+        [database],
+    )
+
+
+def _copy_database(cursor, source, target):
+    cursor.execute(sql.SQL('DROP DATABASE IF EXISTS {}').format(sql.Identifier(target)))
+    strategy = sql.SQL(' STRATEGY FILE_COPY') if cursor.connection.server_version >= 150000 else sql.SQL('')
+    cursor.execute(
+        sql.SQL('CREATE DATABASE {} TEMPLATE {}{}').format(sql.Identifier(target), sql.Identifier(source), strategy)
+    )
+
+
+def save_snapshot(name, force=False):
+    database = connection.settings_dict['NAME']
+    _disconnect()
+    admin = _admin_cursor()
+    try:
+        with admin.cursor() as cursor:
+            if force:
+                _terminate_sessions(cursor, database)
+            _copy_database(cursor, database, snapshot_database_name(name))
+    finally:
+        admin.close()
+
+
+def restore_snapshot(name, force=False):
+    database = connection.settings_dict['NAME']
+    snapshot = snapshot_database_name(name)
+    _disconnect()
+    admin = _admin_cursor()
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM pg_database WHERE datname = %s', [snapshot])
+            if cursor.fetchone() is None:
+                raise ValueError(f'there is no snapshot named {name!r}')
+            if force:
+                _terminate_sessions(cursor, database)
+            _copy_database(cursor, snapshot, database)
+    finally:
+        admin.close()
+
+
+def list_snapshots():
+    prefix = snapshot_database_name('x')[:-1]
+    _disconnect()
+    admin = _admin_cursor()
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute('SELECT datname FROM pg_database WHERE starts_with(datname, %s) ORDER BY datname', [prefix])
+            return [row[0][len(prefix):] for row in cursor.fetchall()]
+    finally:
+        admin.close()
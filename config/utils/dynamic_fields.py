@@ -0,0 +1,66 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_field_tree(value):
+    """
+    "id,name,product.id,product.images" ->
+    {'id': {}, 'name': {}, 'product': {'id': {}, 'images': {}}}
+    """
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in path.strip().split('.'):
+            if name:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class DynamicFieldsMixin:
+    """
+    Lets GET clients pick fields with `?fields=` and pull in extra relations
+    listed in Meta.expandable_fields with `?expand=`. Dotted paths reach
+    nested serializers that use this mixin too, e.g.
+    `?fields=id,product.name&expand=product.images`.
+    """
+    # set by the parent serializer, None means "read them from the request"
+    requested_fields = None
+    requested_expand = None
+
+    def is_root(self):
+        root = self.root
+        return root is self or (self.parent is root and isinstance(root, serializers.ListSerializer))
+
+    def read_requested(self):
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS or not self.is_root():
+            return self.requested_fields, self.requested_expand
+
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        return (
+            parse_field_tree(fields) if fields else None,
+            parse_field_tree(expand) if expand else None,
+        )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested_fields, requested_expand = self.read_requested()
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+
+        wanted_expansions = set(requested_expand or {})
+        if requested_fields is not None:
+            wanted_expansions |= set(requested_fields) & set(expandable)
+        for name in wanted_expansions & set(expandable):
+            serializer_class, kwargs = expandable[name]
+            fields[name] = serializer_class(**kwargs)
+
+        if requested_fields is not None:
+            fields = {name: field for name, field in fields.items() if name in requested_fields}
+
+        for name, field in fields.items():
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(nested, DynamicFieldsMixin):
+                nested.requested_fields = (requested_fields or {}).get(name) or None
+                nested.requested_expand = (requested_expand or {}).get(name) or None
+        return fields
@@ -0,0 +1,60 @@
+"""
+gevent support.
+
+Under SERVER_MODE=gevent (gunicorn) and `celery worker -P gevent` every
+request or task runs on a greenlet, and the standard library is
+monkey-patched so sockets, locks and threading.local are cooperative. That
+covers Redis; psycopg2 talks to libpq directly, so it gets a wait callback
+that yields to the gevent hub while Postgres works. Django keeps one
+connection per greenlet, which config.db_backends.pooled_postgresql hands
+out from a shared per-process pool.
+
+This module is imported before Django, so it must not import it. COPY
+(config.utils.pg_copy) is not supported by psycopg2 with a wait callback;
+it is only used by management commands, which do not run patched.
+"""
+import os
+import sys
+
+
+def is_patched():
+    # gunicorn's gevent worker and celery -P gevent patch before loading the project
+    if 'gevent.monkey' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+
+def gevent_wait_callback(connection, timeout=None):
+    import psycopg2
+    from psycopg2 import extensions
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f'bad result from poll: {state!r}')
+
+
+def make_psycopg_green():
+    from psycopg2 import extensions
+    extensions.set_wait_callback(gevent_wait_callback)
+
+
+def patch():
+    """
+    Patches the process when SERVER_MODE=gevent or something (gunicorn,
+    Celery) already did, then makes psycopg2 cooperative. Has to run before
+    Django and the project are imported.
+    """
+    if os.getenv('SERVER_MODE') == 'gevent' and not is_patched():
+        from gevent import monkey
+        monkey.patch_all()
+    if is_patched():
+        make_psycopg_green()
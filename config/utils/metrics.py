@@ -0,0 +1,109 @@
+"""
+Prometheus metrics per view ("ProductViewSet.list").
+
+Under gunicorn, gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at a
+shared directory before the workers fork; prometheus_client then keeps
+every worker's values in mmapped files there and /metrics adds them up.
+Without it (runserver, tests) the values live in the process registry.
+"""
+import hmac
+import os
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+from config.utils.middleware import HybridMiddleware
+from config.utils.query_count import count_queries
+
+
+REQUESTS = Counter('http_requests_total', 'Requests by view, method and status', ['view', 'method', 'status'])
+LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time from the first middleware to the response', ['view', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+QUERIES = Histogram(
+    'http_request_db_queries', 'SQL queries per request', ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+QUERY_TIME = Histogram(
+    'http_request_db_seconds', 'Time spent in SQL per request', ['view'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes', 'Body size of non-streaming responses', ['view'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+CACHE = Counter('http_response_cache_total', 'Response cache lookups (X-Cache)', ['view', 'result'])
+
+# database connection pools (config.utils.db_pool), by alias; the gauge adds
+# up the workers that are alive
+POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Open pooled connections by state', ['alias', 'state'], multiprocess_mode='livesum',
+)
+POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Time to check out a connection', ['alias'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10),
+)
+POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Checkouts that found the pool exhausted until the timeout', ['alias'])
+POOL_OPENED = Counter('db_pool_connections_opened_total', 'Connections opened by the pool', ['alias'])
+POOL_CLOSED = Counter('db_pool_connections_closed_total', 'Connections closed by the pool, by reason', ['alias', 'reason'])
+
+
+def view_name(request, response):
+    # DRF responses carry the view instance, which knows its action
+    view = (getattr(response, 'renderer_context', None) or {}).get('view')
+    if view is not None:
+        return f'{type(view).__name__}.{getattr(view, "action", None) or request.method.lower()}'
+    match = request.resolver_match
+    if match is None:
+        # one label for every unknown path instead of one per path
+        return 'unmatched'
+    # the code that served it, not the URL name, which may be missing or reused
+    func = getattr(match.func, 'view_class', match.func)
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+class MetricsMiddleware(HybridMiddleware):
+    def call(self, request):
+        started = time.perf_counter()
+        with count_queries() as queries:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    async def acall(self, request):
+        started = time.perf_counter()
+        with count_queries() as queries:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, queries)
+        return response
+
+    def record(self, request, response, duration, queries):
+        view = view_name(request, response)
+        REQUESTS.labels(view, request.method, response.status_code).inc()
+        LATENCY.labels(view, request.method).observe(duration)
+        QUERIES.labels(view).observe(queries.count)
+        QUERY_TIME.labels(view).observe(queries.duration)
+        if not response.streaming:
+            RESPONSE_SIZE.labels(view).observe(len(response.content))
+        if 'X-Cache' in response:
+            CACHE.labels(view, response['X-Cache'].lower()).inc()
+
+
+def metrics_view(request):
+    # closed unless a token is configured, open without one only under DEBUG
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token and not settings.DEBUG:
+        return HttpResponseForbidden()
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
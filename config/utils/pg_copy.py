@@ -0,0 +1,20 @@
+import csv
+import io
+
+
+NULL = r'\N'
+
+
+def copy_rows(cursor, table, columns, rows):
+    """
+    Loads `rows` (sequences matching `columns`) into `table` with one
+    COPY ... FROM STDIN. None becomes NULL, '' stays an empty string.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([NULL if value is None else value for value in row])
+    buffer.seek(0)
+
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')"
+    cursor.copy_expert(sql, buffer)
@@ -0,0 +1,217 @@
+"""
+Profiles single requests on demand.
+
+A request is profiled when it sends "X-Profile: sample" (wall-clock stack
+sampling, written as collapsed stacks for flamegraph.pl / speedscope) or
+"X-Profile: cprofile" (deterministic, a pstats file), and comes from a
+staff user or carries an X-Profile-Token made by `manage.py profile_token`.
+With "X-Profile-Output: inline" the profile and the SQL timeline replace
+the response body; otherwise they go to PROFILER_DIR and the response
+names the files in X-Profile.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from config.utils.metrics import view_name
+from config.utils.middleware import HybridMiddleware
+from config.utils.query_count import collect_queries
+
+
+TOKEN_SALT = 'config.utils.profiler'
+MODES = ('sample', 'cprofile')
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def _valid_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILER_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    # API clients authenticate inside the view, too late for middleware
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken):
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+
+def _frame_name(code):
+    path = code.co_filename
+    if 'site-packages' in path:
+        path = path.split('site-packages', 1)[1].lstrip(os.sep)
+    elif path.startswith(str(settings.BASE_DIR)):
+        path = os.path.relpath(path, settings.BASE_DIR)
+    return f'{path}:{code.co_name}'.replace(';', ':')
+
+
+class SamplingProfiler:
+    """
+    Records the stack of the calling thread every `interval` seconds from a
+    helper thread.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def output(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class CProfiler:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def output(self, limit=60):
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+
+class SqlTimeline:
+    def __init__(self, started):
+        self.started = started
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'start_ms': round((started - self.started) * 1000, 3),
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+                'database': context['connection'].alias,
+                'sql': sql,
+                'many': many,
+            })
+
+
+class ProfilerMiddleware(HybridMiddleware):
+    """
+    Under ASGI the profilers see the event loop thread, including other
+    requests it serves meanwhile, and not the threads async ORM calls run on.
+    """
+
+    def call(self, request):
+        mode = request.headers.get('X-Profile')
+        if mode not in MODES or not self.allowed(request):
+            return self.get_response(request)
+
+        profiler, timeline = self.start(mode)
+        try:
+            with collect_queries(timeline):
+                response = self.get_response(request)
+        finally:
+            profiler.stop()
+        return self.finish(request, response, mode, profiler, timeline)
+
+    async def acall(self, request):
+        mode = request.headers.get('X-Profile')
+        if mode not in MODES or not await sync_to_async(self.allowed)(request):
+            return await self.get_response(request)
+
+        profiler, timeline = self.start(mode)
+        try:
+            with collect_queries(timeline):
+                response = await self.get_response(request)
+        finally:
+            profiler.stop()
+        return self.finish(request, response, mode, profiler, timeline)
+
+    def start(self, mode):
+        profiler = SamplingProfiler(settings.PROFILER_SAMPLE_INTERVAL) if mode == 'sample' else CProfiler()
+        timeline = SqlTimeline(time.perf_counter())
+        profiler.start()
+        return profiler, timeline
+
+    def finish(self, request, response, mode, profiler, timeline):
+        report = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view_name(request, response),
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - timeline.started) * 1000, 3),
+            'sql_ms': round(sum(query['duration_ms'] for query in timeline.queries), 3),
+            'sql': timeline.queries,
+        }
+        if request.headers.get('X-Profile-Output') == 'inline':
+            return JsonResponse({**report, 'mode': mode, 'profile': profiler.output()})
+
+        response['X-Profile'] = ', '.join(self.save(mode, profiler, report))
+        return response
+
+    def allowed(self, request):
+        token = request.headers.get('X-Profile-Token')
+        if token:
+            return _valid_token(token)
+        return _is_staff(request)
+
+    def save(self, mode, profiler, report):
+        directory = settings.PROFILER_DIR
+        os.makedirs(directory, exist_ok=True)
+        name = f"{timezone.now():%Y%m%d-%H%M%S}-{report['view']}-{uuid.uuid4().hex[:8]}"
+        if mode == 'sample':
+            profile = f'{name}.folded'
+            with open(os.path.join(directory, profile), 'w') as file:
+                file.write(profiler.output())
+        else:
+            profile = f'{name}.prof'
+            profiler.profile.dump_stats(os.path.join(directory, profile))
+        sql = f'{name}.sql.json'
+        with open(os.path.join(directory, sql), 'w') as file:
+            json.dump(report, file, indent=2)
+        return [profile, sql]
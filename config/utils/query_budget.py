@@ -0,0 +1,29 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin for pinning how many SQL queries an endpoint may run.
+
+    Unlike assertNumQueries it returns the response, so the same call can be
+    checked for status/data, and on failure it lists every captured statement.
+    """
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+
+        executed = len(context)
+        if executed != budget:
+            queries = '\n'.join(
+                f"{index}. {query['sql']}"
+                for index, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail(f"{executed} queries executed, budget is {budget}:\n{queries}")
+        return result
+
+    def assertQueryBudgetForSizes(self, budget, func, sizes):
+        for size in sizes:
+            with self.subTest(size=size):
+                self.assertQueryBudget(budget, func, size)
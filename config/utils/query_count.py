@@ -0,0 +1,96 @@
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from config.utils.middleware import HybridMiddleware
+
+
+QUERY_COUNT_HEADER = 'X-Query-Count'
+
+# Collectors see every query of the context that registered them. A context
+# variable rather than per-connection wrappers, because async ORM calls run
+# on another thread's connection but inherit the context.
+_collectors = contextvars.ContextVar('query_collectors', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    for collector in reversed(_collectors.get()):
+        execute = functools.partial(collector, execute)
+    return execute(sql, params, many, context)
+
+
+def _install(connection):
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_dispatch)
+
+
+def _install_on_connect(sender, connection, **kwargs):
+    _install(connection)
+
+
+connection_created.connect(_install_on_connect, dispatch_uid='config.utils.query_count')
+
+
+@contextmanager
+def collect_queries(collector):
+    """
+    Passes every query run in this context to `collector`, an execute
+    wrapper (see connection.execute_wrapper), while the block runs.
+    """
+    for connection in connections.all():
+        _install(connection)
+    token = _collectors.set((*_collectors.get(), collector))
+    try:
+        yield collector
+    finally:
+        _collectors.reset(token)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def count_queries():
+    """
+    Counts the queries of this context and their time while the block runs.
+    """
+    return collect_queries(QueryStats())
+
+
+class QueryCountMiddleware(HybridMiddleware):
+    """
+    Adds the number of database queries a request ran as X-Query-Count when
+    settings.QUERY_COUNT_HEADER is on. The benchmark_api command reads it;
+    leave it off in production.
+    """
+
+    def call(self, request):
+        if not getattr(settings, 'QUERY_COUNT_HEADER', False):
+            return self.get_response(request)
+        with count_queries() as stats:
+            response = self.get_response(request)
+        response[QUERY_COUNT_HEADER] = str(stats.count)
+        return response
+
+    async def acall(self, request):
+        if not getattr(settings, 'QUERY_COUNT_HEADER', False):
+            return await self.get_response(request)
+        with count_queries() as stats:
+            response = await self.get_response(request)
+        response[QUERY_COUNT_HEADER] = str(stats.count)
+        return response
@@ -0,0 +1,132 @@
+"""
+Slow query and N+1 logging.
+
+Every query of a request (or of an inspect_queries() block) is timed and
+reduced to a fingerprint, its SQL with literals and IN lists collapsed.
+Queries slower than SLOW_QUERY_MS are logged with the project frames that
+ran them and, for a SLOW_QUERY_EXPLAIN_SAMPLE_RATE share, their EXPLAIN.
+When one fingerprint runs N_PLUS_ONE_THRESHOLD times or more, the block is
+reported once with the stack of the query that crossed the threshold,
+which is the loop doing it.
+"""
+import functools
+import logging
+import random
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from config.utils.middleware import HybridMiddleware
+from config.utils.query_count import collect_queries
+
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+_VALUES = re.compile(r'\bVALUES (?:\((?:[^()]|\([^()]*\))*\)\s*,?\s*)+', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _VALUES.sub('VALUES (...) ', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def _project_stack(limit):
+    # project frames, minus the instrumentation in this package
+    base, utils = str(Path(settings.BASE_DIR)), str(Path(__file__).parent)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-1]
+        if frame.filename.startswith(base) and not frame.filename.startswith(utils) and 'site-packages' not in frame.filename
+    ]
+    return ''.join(traceback.format_list(frames[-limit:]))
+
+
+class QueryInspector:
+    def __init__(self, label=''):
+        self.label = label
+        self.slow = getattr(settings, 'SLOW_QUERY_MS', 200) / 1000
+        self.sample_rate = getattr(settings, 'SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0)
+        self.threshold = getattr(settings, 'N_PLUS_ONE_THRESHOLD', 10)
+        self.stack_depth = getattr(settings, 'QUERY_INSPECTOR_STACK_DEPTH', 8)
+        self.counts = Counter()
+        self.repeated = {}
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+
+        shape = fingerprint(sql)
+        self.counts[shape] += 1
+        if self.counts[shape] == self.threshold:
+            self.repeated[shape] = _project_stack(self.stack_depth)
+        if duration >= self.slow:
+            self.log_slow(shape, sql, params, many, duration, context['connection'])
+        return result
+
+    def log_slow(self, shape, sql, params, many, duration, connection):
+        plan = None
+        if not many and sql.lstrip()[:6].upper() == 'SELECT' and random.random() < self.sample_rate:
+            plan = self.explain(connection, sql, params)
+        logger.warning(
+            'slow query %.0fms %s: %s\n%s%s',
+            duration * 1000, self.label, shape, _project_stack(self.stack_depth),
+            f'EXPLAIN:\n{plan}' if plan else '',
+        )
+
+    def explain(self, connection, sql, params):
+        self.explaining = True
+        try:
+            # a savepoint inside atomic(), or the failed EXPLAIN would abort the transaction
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN {sql}', params)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+        except Exception as error:
+            # a failed EXPLAIN must never fail the request
+            return f'failed: {error}'
+        finally:
+            self.explaining = False
+
+    def report(self):
+        for shape, stack in self.repeated.items():
+            logger.warning(
+                'possible N+1 %s: %d queries like %s\n%s', self.label, self.counts[shape], shape, stack,
+            )
+
+
+@contextmanager
+def inspect_queries(label=''):
+    with collect_queries(QueryInspector(label)) as inspector:
+        yield inspector
+    inspector.report()
+
+
+class QueryInspectorMiddleware(HybridMiddleware):
+    def call(self, request):
+        if not getattr(settings, 'QUERY_INSPECTOR_ENABLED', True):
+            return self.get_response(request)
+        with inspect_queries(f'{request.method} {request.path}'):
+            return self.get_response(request)
+
+    async def acall(self, request):
+        if not getattr(settings, 'QUERY_INSPECTOR_ENABLED', True):
+            return await self.get_response(request)
+        with inspect_queries(f'{request.method} {request.path}'):
+            return await self.get_response(request)
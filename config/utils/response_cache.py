@@ -0,0 +1,175 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+from config.utils.db_router import primary_reads
+
+
+# Cached responses are keyed on "generations": random tokens stored in Redis
+# that writes replace. Bumping a generation orphans every response built on
+# it, so invalidation never has to find or delete individual keys, and a
+# generation evicted from Redis comes back as a fresh token, never an old one.
+
+def list_generation_key(namespace):
+    return f'generation:{namespace}:list'
+
+
+def detail_generation_key(namespace, pk):
+    return f'generation:{namespace}:detail:{pk}'
+
+
+def all_details_generation_key(namespace):
+    return f'generation:{namespace}:detail:all'
+
+
+def get_generations(keys):
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, uuid.uuid4().hex, None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+async def aget_generations(keys):
+    generations = await cache.aget_many(keys)
+    for key in keys:
+        if key not in generations:
+            await cache.aadd(key, uuid.uuid4().hex, None)
+            generations[key] = await cache.aget(key)
+    return [generations[key] for key in keys]
+
+
+def bump_generations(*keys):
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+
+def invalidate_list(namespace):
+    bump_generations(list_generation_key(namespace))
+
+
+def invalidate_details(namespace, pks):
+    bump_generations(list_generation_key(namespace), *[detail_generation_key(namespace, pk) for pk in pks])
+
+
+def invalidate_all(namespace):
+    bump_generations(list_generation_key(namespace), all_details_generation_key(namespace))
+
+
+def response_cache_enabled(endpoint):
+    return getattr(settings, 'RESPONSE_CACHE_ENDPOINTS', {}).get(endpoint, False)
+
+
+def response_cache_timeout(endpoint):
+    timeouts = getattr(settings, 'RESPONSE_CACHE_TIMEOUTS', {})
+    return timeouts.get(endpoint, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+
+
+def response_cache_key(endpoint, request, generations, media_type):
+    # the normalized query string, host and the generations of what the response was built from
+    query = sorted(
+        (key, value)
+        for key, values in request.GET.lists()
+        for value in values
+        if value != ''
+    )
+    raw = repr((request.get_host(), request.path, query, generations, media_type))
+    digest = hashlib.sha1(raw.encode()).hexdigest()
+    return f'response:{endpoint}:{digest}'
+
+
+def _counter_key(endpoint, outcome):
+    return f'response_cache:{outcome}:{endpoint}'
+
+
+def _count(endpoint, outcome):
+    key = _counter_key(endpoint, outcome)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+async def acount_response_cache(endpoint, outcome):
+    key = _counter_key(endpoint, outcome)
+    await cache.aadd(key, 0, None)
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aset(key, 1, None)
+
+
+def response_cache_stats():
+    endpoints = getattr(settings, 'RESPONSE_CACHE_ENDPOINTS', {})
+    keys = [_counter_key(endpoint, outcome) for endpoint in endpoints for outcome in ('hits', 'misses')]
+    counters = cache.get_many(keys)
+    return {
+        endpoint: {
+            outcome: counters.get(_counter_key(endpoint, outcome), 0)
+            for outcome in ('hits', 'misses')
+        }
+        for endpoint in endpoints
+    }
+
+
+class CachedResponseMixin:
+    """
+    Caches list/retrieve response data in Redis.
+
+    Endpoints are switched on in settings.RESPONSE_CACHE_ENDPOINTS by
+    "<basename>.<action>", RESPONSE_CACHE_TIMEOUTS can shorten the TTL of
+    single endpoints. Custom actions call cached_response() themselves and
+    must be listed in cached_actions. The key covers the normalized query
+    string, host and the generations of what the response was built from.
+    """
+    cache_namespace = None
+    cached_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_endpoint(self):
+        return f'{self.basename}.{self.action}'
+
+    def is_response_cache_enabled(self):
+        return self.action in self.cached_actions and response_cache_enabled(self.get_cache_endpoint())
+
+    def get_response_cache_timeout(self):
+        return response_cache_timeout(self.get_cache_endpoint())
+
+    def get_cache_generation_keys(self):
+        namespace = self.cache_namespace or self.basename
+        if self.detail:
+            pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            return [detail_generation_key(namespace, pk), all_details_generation_key(namespace)]
+        return [list_generation_key(namespace)]
+
+    def get_response_cache_key(self, request):
+        generations = get_generations(self.get_cache_generation_keys())
+        return response_cache_key(self.get_cache_endpoint(), request, generations, request.accepted_media_type)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.is_response_cache_enabled():
+            return handler(request, *args, **kwargs)
+
+        endpoint = self.get_cache_endpoint()
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            _count(endpoint, 'hits')
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        _count(endpoint, 'misses')
+        with primary_reads():
+            response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.get_response_cache_timeout())
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,34 @@
+"""
+Test runner that keeps the tests off the Redis databases a running stack
+uses. Tests clear the cache before each case, which is a FLUSHDB, so the
+cache and the cart store are moved to TEST_REDIS_DBS on the same servers.
+"""
+import copy
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+TEST_REDIS_DBS = {'cache': 15, 'cart_store': 14}
+
+
+def with_db(url, db):
+    return urlsplit(url)._replace(path=f'/{db}').geturl()
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        caches = copy.deepcopy(settings.CACHES)
+        caches['default']['LOCATION'] = with_db(caches['default']['LOCATION'], TEST_REDIS_DBS['cache'])
+        self.redis_settings = override_settings(
+            CACHES=caches,
+            CART_STORE_REDIS_URL=with_db(settings.CART_STORE_REDIS_URL, TEST_REDIS_DBS['cart_store']),
+        )
+        self.redis_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.redis_settings.disable()
+        super().teardown_test_environment(**kwargs)
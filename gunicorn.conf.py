@@ -0,0 +1,37 @@
+import os
+import shutil
+
+# workers write their metrics here, see config/utils/metrics.py; prometheus_client
+# picks its storage on import, so this has to be set before importing it
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+
+from prometheus_client import multiprocess  # noqa: E402
+
+
+# SERVER_MODE=asgi serves config.asgi with uvicorn workers, where the /async/
+# endpoints (products.async_views) overlap their database and Redis waits.
+# Sync DRF views still work there but run one at a time per worker, on the
+# thread Django keeps for sync code, so the default stays WSGI.
+if os.getenv('SERVER_MODE') == 'asgi':
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'config.wsgi:application'
+
+# SERVER_MODE=gevent keeps WSGI but serves every request on a greenlet, up to
+# worker_connections per worker, for traffic that mostly waits on Postgres,
+# Redis or slow clients; see config/utils/green.py
+if os.getenv('SERVER_MODE') == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.getenv('WORKER_CONNECTIONS', 1000))
+
+
+def on_starting(server):
+    # values from a previous master would be added to the new ones
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from products.models import (
     Cart, Product, ProductTag,
-    Review, FavoriteProduct, ProductImage, CartItem
+    Review, FavoriteProduct, ProductImage, CartItem, FxRate
 )
 
 
@@ -11,6 +11,7 @@ admin.site.register(Review)
 admin.site.register(FavoriteProduct)
 admin.site.register(ProductImage)
 admin.site.register(CartItem)
+admin.site.register(FxRate)
 
 class ProductImageInLine(admin.StackedInline):
     model = ProductImage
@@ -0,0 +1,64 @@
+"""
+Async versions of the product, product detail and tag reads, for the ASGI
+deployment (SERVER_MODE=asgi in gunicorn.conf.py). Bodies, filters and
+response caching and throttles match ProductViewSet / TagViewSet; ETags
+and cursor pagination are left to the sync endpoints.
+"""
+from asgiref.sync import sync_to_async
+
+from config.utils.async_api import ApiResponse, acached_response, apaginate, async_api_view, error
+from config.utils.response_cache import all_details_generation_key, detail_generation_key, list_generation_key
+from products.models import Product, ProductTag
+from products.pagination import ProductPagination
+from products.serializers import ProductTagSerializer
+from products.views import ProductViewSet, TagViewSet
+
+
+# ProductFilter fields that query while validating (tag/category ids, FX rates)
+QUERYING_FILTERS = {'tags', 'categories', 'price_min', 'price_max'}
+
+
+def _product_view(request, action, **kwargs):
+    return ProductViewSet(request=request, action=action, format_kwarg=None, args=(), kwargs=kwargs)
+
+
+async def _filtered_products(view):
+    queryset = view.get_queryset()
+    if QUERYING_FILTERS.isdisjoint(view.request.query_params):
+        return view.filter_queryset(queryset)
+    return await sync_to_async(view.filter_queryset)(queryset)
+
+
+@async_api_view(throttle_classes=ProductViewSet.throttle_classes)
+async def product_list(request):
+    async def build():
+        view = _product_view(request, 'list')
+        queryset = await _filtered_products(view)
+        body = await apaginate(
+            request, queryset, ProductPagination, lambda products: view.get_serializer(products, many=True).data,
+        )
+        if body is None:
+            return error(404, 'Invalid page.')
+        return ApiResponse(body)
+
+    return await acached_response('product.async_list', request, [list_generation_key('products')], build)
+
+
+@async_api_view(throttle_classes=ProductViewSet.throttle_classes)
+async def product_detail(request, pk):
+    async def build():
+        view = _product_view(request, 'retrieve', pk=pk)
+        try:
+            product = await view.get_queryset().aget(pk=pk)
+        except Product.DoesNotExist:
+            return error(404, 'No Product matches the given query.')
+        return ApiResponse(view.get_serializer(product).data)
+
+    keys = [detail_generation_key('products', pk), all_details_generation_key('products')]
+    return await acached_response('product.async_retrieve', request, keys, build)
+
+
+@async_api_view(throttle_classes=TagViewSet.throttle_classes)
+async def tag_list(request):
+    tags = [tag async for tag in ProductTag.objects.all()]
+    return ApiResponse(ProductTagSerializer(tags, many=True).data)
@@ -0,0 +1,293 @@
+"""
+HTTP load generator behind the benchmark_api command.
+
+Every client thread keeps one keep-alive connection and loops: pick an
+endpoint from the weighted mix, send it, record latency, status and the
+X-Query-Count header (config.utils.query_count). Threads have their own
+seeded random.Random, so a seed replays the same sequence of requests.
+"""
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from urllib.parse import urlencode, urlsplit
+
+from config.utils.query_count import QUERY_COUNT_HEADER
+
+
+DEFAULT_MIX = {
+    'product_list': 25,
+    'product_search': 15,
+    'product_detail': 25,
+    'cart_read': 10,
+    'cart_write': 5,
+    'favorites': 8,
+    'login': 7,
+    'registration': 5,
+}
+
+PASSWORD = 'password123'
+REGISTRATION_PASSWORD = 'Bench-passw0rd!'
+
+
+@dataclass
+class Fixtures:
+    product_ids: list
+    search_terms: list
+    # [(email, access token)], all with PASSWORD
+    users: list
+    # pages of /products/ the list scenario walks through
+    pages: int = 20
+
+
+@dataclass
+class Call:
+    method: str
+    path: str
+    body: dict = None
+    user: tuple = None
+
+
+def product_list(rng, fixtures, user):
+    return Call('GET', '/products/?' + urlencode({'page': rng.randint(1, fixtures.pages)}), user=user)
+
+
+def product_search(rng, fixtures, user):
+    return Call('GET', '/products/?' + urlencode({'q': rng.choice(fixtures.search_terms)}), user=user)
+
+
+def product_detail(rng, fixtures, user):
+    return Call('GET', f'/products/{rng.choice(fixtures.product_ids)}/', user=user)
+
+
+def category_list(rng, fixtures, user):
+    return Call('GET', '/categories/', user=user)
+
+
+def tag_list(rng, fixtures, user):
+    return Call('GET', '/tags/', user=user)
+
+
+def cart_read(rng, fixtures, user):
+    return Call('GET', '/cart/', user=user)
+
+
+def cart_write(rng, fixtures, user):
+    body = {'product_id': rng.choice(fixtures.product_ids), 'quantity': rng.randint(1, 3)}
+    return Call('POST', '/cart_items/', body, user=user)
+
+
+def favorites(rng, fixtures, user):
+    if rng.random() < 0.5:
+        return Call('GET', '/favorite_products/', user=user)
+    # repeats answer 400 "already in favorites", which is part of the real traffic
+    return Call('POST', '/favorite_products/', {'product_id': rng.choice(fixtures.product_ids)}, user=user)
+
+
+def login(rng, fixtures, user):
+    return Call('POST', '/login/', {'email': user[0], 'password': PASSWORD})
+
+
+def registration(rng, fixtures, user):
+    name = uuid.UUID(int=rng.getrandbits(128)).hex[:16]
+    return Call('POST', '/register/', {
+        'email': f'bench-{name}@example.com',
+        'username': f'bench-{name}',
+        'phone_number': f'+{rng.getrandbits(40)}',
+        'password': REGISTRATION_PASSWORD,
+        'password2': REGISTRATION_PASSWORD,
+    })
+
+
+def async_variant(scenario):
+    # the same request against products.async_views / categories.async_views
+    def call(rng, fixtures, user):
+        request = scenario(rng, fixtures, user)
+        request.path = '/async' + request.path
+        return request
+    return call
+
+
+SCENARIOS = {
+    'product_list': product_list,
+    'product_search': product_search,
+    'product_detail': product_detail,
+    'category_list': category_list,
+    'tag_list': tag_list,
+    'async_product_list': async_variant(product_list),
+    'async_product_search': async_variant(product_search),
+    'async_product_detail': async_variant(product_detail),
+    'async_category_list': async_variant(category_list),
+    'async_tag_list': async_variant(tag_list),
+    'cart_read': cart_read,
+    'cart_write': cart_write,
+    'favorites': favorites,
+    'login': login,
+    'registration': registration,
+}
+
+
+def parse_mix(value):
+    """
+    A JSON file ({"product_list": 30, ...}) or inline "product_list=30,login=5".
+    """
+    if value is None:
+        return dict(DEFAULT_MIX)
+    if value.endswith('.json'):
+        with open(value) as file:
+            mix = json.load(file)
+    else:
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f'unknown endpoints in mix: {", ".join(sorted(unknown))}')
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+@dataclass
+class Sample:
+    endpoint: str
+    latency: float
+    status: int
+    queries: int = None
+
+
+class Client:
+    def __init__(self, base_url, timeout=30):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.timeout = timeout
+        self.connection = None
+
+    def send(self, call):
+        headers = {'Accept': 'application/json'}
+        body = None
+        if call.body is not None:
+            body = json.dumps(call.body)
+            headers['Content-Type'] = 'application/json'
+        if call.user is not None:
+            headers['Authorization'] = f'Bearer {call.user[1]}'
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(call.method, call.path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.close()
+                return response
+            except (http.client.HTTPException, ConnectionError):
+                # the server closed a kept-alive connection, retry once on a new one
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+@dataclass
+class BenchmarkRunner:
+    base_url: str
+    mix: dict
+    fixtures: Fixtures
+    concurrency: int = 8
+    duration: float = 30
+    warmup: float = 5
+    seed: int = 1
+    samples: list = field(default_factory=list)
+
+    def worker(self, index, start, measure_from, deadline):
+        rng = random.Random(f'{self.seed}:{index}')
+        names, weights = list(self.mix), list(self.mix.values())
+        client = Client(self.base_url)
+        samples = []
+        start.wait()
+        try:
+            while time.perf_counter() < deadline:
+                endpoint = rng.choices(names, weights)[0]
+                call = SCENARIOS[endpoint](rng, self.fixtures, rng.choice(self.fixtures.users))
+                started = time.perf_counter()
+                try:
+                    response = client.send(call)
+                    status, queries = response.status, response.getheader(QUERY_COUNT_HEADER)
+                except OSError:
+                    status, queries = 0, None
+                finished = time.perf_counter()
+                if started >= measure_from:
+                    samples.append(Sample(endpoint, finished - started, status, int(queries) if queries else None))
+        finally:
+            client.close()
+            with self.lock:
+                self.samples += samples
+
+    def run(self):
+        self.lock = threading.Lock()
+        start = threading.Event()
+        begin = time.perf_counter() + 0.1
+        measure_from = begin + self.warmup
+        deadline = measure_from + self.duration
+        threads = [
+            threading.Thread(target=self.worker, args=(index, start, measure_from, deadline), daemon=True)
+            for index in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return summarize(self.samples, self.duration)
+
+
+def percentile(values, fraction):
+    # nearest rank on sorted values
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def _stats(samples, duration):
+    latencies = sorted(sample.latency * 1000 for sample in samples)
+    queries = [sample.queries for sample in samples if sample.queries is not None]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if not 200 <= sample.status < 400),
+        'statuses': {str(status): count for status, count in sorted(_count(sample.status for sample in samples).items())},
+        'throughput': round(len(samples) / duration, 2) if duration else None,
+        'p50_ms': _round(percentile(latencies, 0.50)),
+        'p95_ms': _round(percentile(latencies, 0.95)),
+        'p99_ms': _round(percentile(latencies, 0.99)),
+        'mean_ms': _round(sum(latencies) / len(latencies)) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def _count(values):
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    return counts
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def summarize(samples, duration):
+    by_endpoint = {}
+    for sample in samples:
+        by_endpoint.setdefault(sample.endpoint, []).append(sample)
+    return {
+        'total': _stats(samples, duration),
+        'endpoints': {name: _stats(by_endpoint[name], duration) for name in sorted(by_endpoint)},
+    }
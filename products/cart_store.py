@@ -0,0 +1,284 @@
+"""
+Write-behind cart store, on with CART_STORE_ENABLED.
+
+A user's cart lives in the Redis hash "cart:{user_id}": a "cart" field
+with the Cart id and one "item:{id}" field per CartItem, holding its
+product, quantity and price as JSON. Adding, changing and removing items
+only touch the hash and put the user in the "cart:dirty" set; the
+flush_carts beat task writes dirty carts to Cart/CartItem in batches.
+A cart missing from Redis is rebuilt from Postgres on first use.
+
+The hashes are the only copy of unflushed changes, so they live in their
+own Redis (CART_STORE_REDIS_URL), never evicted and never cleared with
+the cache. Flushes of one cart hold a Postgres advisory lock and read the
+hash only once they have it, so an older snapshot cannot overwrite a newer one.
+
+Item ids come from the CartItem sequence, reserved in blocks, so the ids
+the API returns are the ones the rows get. Cart reads call persist_cart()
+first, so they see Postgres up to date; checkout has to do the same.
+"""
+import json
+import logging
+import os
+import threading
+from collections import deque
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from redis import Redis, WatchError
+from rest_framework.permissions import SAFE_METHODS
+
+from products.models import Cart, CartItem, Product
+
+
+logger = logging.getLogger(__name__)
+
+DIRTY_KEY = 'cart:dirty'
+CART_FIELD = 'cart'
+ITEM_PREFIX = 'item:'
+# first key of pg_advisory_xact_lock(int, int), the second is the user id
+LOCK_NAMESPACE = 0x63617274
+
+
+def cart_store_enabled():
+    return getattr(settings, 'CART_STORE_ENABLED', False)
+
+
+_clients = {}
+
+
+def _redis():
+    # keyed by URL, so tests can point the store elsewhere
+    url = settings.CART_STORE_REDIS_URL
+    if url not in _clients:
+        _clients[url] = Redis.from_url(url)
+    return _clients[url]
+
+
+def _cart_key(user_id):
+    return f'cart:{user_id}'
+
+
+class _ItemIds:
+    # CartItem ids reserved from the sequence, per process
+    def __init__(self):
+        self.ids = deque()
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            if not self.ids:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT nextval(pg_get_serial_sequence('products_cartitem', 'id')) FROM generate_series(1, %s)",
+                        [settings.CART_STORE_ID_BLOCK],
+                    )
+                    self.ids.extend(row[0] for row in cursor.fetchall())
+            return self.ids.popleft()
+
+    def clear(self):
+        self.ids = deque()
+
+
+_item_ids = _ItemIds()
+# a child must not hand out its parent's ids
+os.register_at_fork(after_in_child=_item_ids.clear)
+
+
+def _encode(item):
+    return json.dumps({
+        'product_id': item.product_id,
+        'quantity': item.quantity,
+        'price': str(item.price_at_time_of_addition),
+    })
+
+
+def _decode(cart_id, field, value):
+    data = json.loads(value)
+    return CartItem(
+        id=int(field[len(ITEM_PREFIX):]),
+        cart_id=cart_id,
+        product_id=data['product_id'],
+        quantity=data['quantity'],
+        price_at_time_of_addition=Decimal(data['price']),
+    )
+
+
+def load_cart(user):
+    """
+    The user's Cart id, after rebuilding the hash from Postgres if Redis
+    has none. The rebuild is skipped when a concurrent request wrote it first.
+    """
+    redis, key = _redis(), _cart_key(user.id)
+    cart_id = redis.hget(key, CART_FIELD)
+    if cart_id is not None:
+        return int(cart_id)
+
+    cart, _ = Cart.objects.get_or_create(user=user)
+    mapping = {CART_FIELD: cart.id}
+    for item in cart.items.all():
+        mapping[f'{ITEM_PREFIX}{item.id}'] = _encode(item)
+    with redis.pipeline() as pipe:
+        try:
+            pipe.watch(key)
+            if pipe.exists(key):
+                return int(pipe.hget(key, CART_FIELD))
+            pipe.multi()
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, settings.CART_STORE_TTL)
+            pipe.execute()
+        except WatchError:
+            return int(redis.hget(key, CART_FIELD))
+    return cart.id
+
+
+def _save(user, item):
+    # a bad item in the hash would fail every flush of the cart
+    item.clean_fields(exclude=['cart', 'product'])
+    key = _cart_key(user.id)
+    with _redis().pipeline(transaction=True) as pipe:
+        pipe.hset(key, f'{ITEM_PREFIX}{item.id}', _encode(item))
+        # in case the hash expired since it was loaded
+        pipe.hsetnx(key, CART_FIELD, item.cart_id)
+        pipe.expire(key, settings.CART_STORE_TTL)
+        pipe.sadd(DIRTY_KEY, user.id)
+        pipe.execute()
+
+
+def add_item(user, product, quantity):
+    item = CartItem(
+        id=_item_ids.next(), cart_id=load_cart(user), product=product,
+        quantity=quantity, price_at_time_of_addition=product.price,
+    )
+    _save(user, item)
+    return item
+
+
+def get_item(user, item_id):
+    cart_id = load_cart(user)
+    value = _redis().hget(_cart_key(user.id), f'{ITEM_PREFIX}{item_id}')
+    if value is None:
+        return None
+    item = _decode(cart_id, f'{ITEM_PREFIX}{item_id}', value)
+    item.cart = Cart(id=cart_id, user=user)
+    return item
+
+
+def update_item(user, item):
+    _save(user, item)
+    return item
+
+
+def remove_item(user, item):
+    key = _cart_key(user.id)
+    with _redis().pipeline(transaction=True) as pipe:
+        pipe.hdel(key, f'{ITEM_PREFIX}{item.id}')
+        pipe.sadd(DIRTY_KEY, user.id)
+        pipe.execute()
+
+
+def _write_carts(carts):
+    """
+    Makes CartItem match the hashes, {user id: hash}: rows gone from a hash
+    are deleted, the others inserted or updated.
+    """
+    cart_ids, items = [], []
+    for cart in carts.values():
+        cart_id = int(cart[CART_FIELD])
+        cart_ids.append(cart_id)
+        items += [_decode(cart_id, field, value) for field, value in cart.items() if field.startswith(ITEM_PREFIX)]
+    # carts and products deleted since would fail the whole batch
+    cart_ids = set(Cart.objects.filter(id__in=cart_ids).values_list('id', flat=True))
+    products = set(Product.objects.filter(id__in={item.product_id for item in items}).values_list('id', flat=True))
+    # rows locked in one order, so concurrent flushes cannot deadlock
+    items = sorted((item for item in items if item.cart_id in cart_ids and item.product_id in products), key=lambda item: item.id)
+
+    CartItem.objects.filter(cart_id__in=cart_ids).exclude(id__in=[item.id for item in items]).delete()
+    CartItem.objects.bulk_create(
+        items, update_conflicts=True, unique_fields=['id'],
+        update_fields=['product', 'quantity', 'price_at_time_of_addition', 'updated_at'],
+    )
+
+
+def _write(user_ids):
+    """
+    Writes the users' carts in one transaction and returns how many there
+    were. The hashes are read under the users' locks, so whoever flushes
+    last writes the newest state.
+    """
+    user_ids = sorted(user_ids)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s, user_id) FROM unnest(%s::int[]) AS user_id',
+                [LOCK_NAMESPACE, user_ids],
+            )
+        with _redis().pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(_cart_key(user_id))
+            hashes = pipe.execute()
+        carts = {
+            user_id: {field.decode(): value.decode() for field, value in cart.items()}
+            for user_id, cart in zip(user_ids, hashes)
+            # expired from Redis: Postgres already has it
+            if cart
+        }
+        if carts:
+            _write_carts(carts)
+    return len(carts)
+
+
+def _flush(user_ids):
+    # (carts written, users whose cart could not be)
+    try:
+        return _write(user_ids), []
+    except Exception:
+        if len(user_ids) == 1:
+            logger.exception('could not flush the cart of user %s', user_ids[0])
+            return 0, user_ids
+    # one bad cart must not hold back the rest of the batch
+    flushed, failed = 0, []
+    for user_id in user_ids:
+        written, not_written = _flush([user_id])
+        flushed += written
+        failed += not_written
+    return flushed, failed
+
+
+def flush_carts(batch_size=None):
+    """
+    Writes every dirty cart to Postgres, batch_size carts per transaction.
+    A cart changed while it is written is dirty again and goes in the next
+    run, as does one that failed.
+    """
+    batch_size = batch_size or settings.CART_STORE_FLUSH_BATCH_SIZE
+    redis, flushed, failed = _redis(), 0, []
+    while user_ids := [int(user_id) for user_id in redis.spop(DIRTY_KEY, batch_size) or []]:
+        written, not_written = _flush(user_ids)
+        flushed += written
+        failed += not_written
+    if failed:
+        redis.sadd(DIRTY_KEY, *failed)
+    return flushed
+
+
+def persist_cart(user):
+    # before anything reads the cart from Postgres, and before checkout
+    if cart_store_enabled() and _redis().srem(DIRTY_KEY, user.id):
+        try:
+            _write([user.id])
+        except Exception:
+            _redis().sadd(DIRTY_KEY, user.id)
+            raise
+
+
+class PersistCartMixin:
+    """
+    Views reading carts from Postgres write the user's pending changes first.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            persist_cart(request.user)
@@ -0,0 +1,206 @@
+"""
+Synthetic catalog data for benchmarks, written with COPY.
+
+Work is cut into chunks of consecutive ids and every chunk gets its own
+random.Random / Faker seeded from (seed, table, chunk index), so the same
+arguments produce the same rows whatever the number of worker processes.
+"""
+import random
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from faker import Faker
+from config.utils.pg_copy import copy_rows
+from products.choices import Currency
+from products.models import RATING_COUNT_FIELDS
+
+
+RATING_WEIGHTS = [5, 7, 15, 33, 40]
+CURRENCIES = [Currency.GEL.value, Currency.USD.value, Currency.EURO.value]
+PASSWORD = 'password123'
+
+PRODUCT_COLUMNS = [
+    'id', 'name', 'description', 'price', 'currency', 'quantity', 'user_id', 'created_at', 'updated_at',
+    'review_count', 'rating_sum', *RATING_COUNT_FIELDS.values(),
+]
+USER_COLUMNS = [
+    'id', 'password', 'is_superuser', 'username', 'first_name', 'last_name', 'email', 'phone_number',
+    'is_staff', 'is_active', 'date_joined', 'created_at', 'updated_at',
+]
+
+
+@dataclass
+class DatasetConfig:
+    products: int = 1000
+    users: int = 0
+    reviews_per_product: int = 0
+    tags: int = 0
+    categories: int = 0
+    images: int = 0
+    favorites_per_user: int = 0
+    cart_items_per_user: int = 0
+    seed: int = 42
+    chunk_size: int = 20000
+    # first ids, set by the caller from the current table contents
+    first_user_id: int = 1
+    first_cart_id: int = 1
+    first_product_id: int = 1
+    tag_ids: tuple = ()
+    category_ids: tuple = ()
+    password_hash: str = ''
+
+
+def chunk_tasks(kind, config, first_id, total):
+    return [
+        (kind, config, index, first_id + start, min(config.chunk_size, total - start))
+        for index, start in enumerate(range(0, total, config.chunk_size))
+    ]
+
+
+def _random(config, kind, index):
+    seed = f'{config.seed}:{kind}:{index}'
+    faker = Faker()
+    faker.seed_instance(seed)
+    return random.Random(seed), faker
+
+
+class _Text:
+    # Faker is ~10x slower than the rest of a row, so each chunk draws from
+    # a pool of its phrases and sentences instead of calling it per row
+    def __init__(self, faker, rng, size=500):
+        self.rng = rng
+        self.phrases = [faker.catch_phrase() for _ in range(size)]
+        self.words = [faker.word() for _ in range(size)]
+        self.sentences = [faker.sentence(nb_words=12) for _ in range(size)]
+
+    def name(self):
+        return f'{self.rng.choice(self.phrases)} {self.rng.choice(self.words)}'
+
+    def paragraph(self, sentences=4):
+        return ' '.join(self.rng.choices(self.sentences, k=sentences))
+
+    def sentence(self):
+        return self.rng.choice(self.sentences)
+
+
+def _timestamp(rng, now):
+    return now - timedelta(seconds=rng.randint(0, 2 * 365 * 24 * 3600))
+
+
+def _user_rows(config, index, first_id, count, cursor):
+    rng, faker = _random(config, 'users', index)
+    now = timezone.now()
+    users, carts = [], []
+    for user_id in range(first_id, first_id + count):
+        joined = _timestamp(rng, now)
+        users.append([
+            user_id, config.password_hash, False, f'user{user_id}', faker.first_name(), faker.last_name(),
+            f'user{user_id}@example.com', f'+995{user_id:09d}', False, True, joined, joined, joined,
+        ])
+        # what the create_user_cart signal would have done
+        carts.append([config.first_cart_id + user_id - config.first_user_id, user_id, joined, joined])
+    copy_rows(cursor, 'users_user', USER_COLUMNS, users)
+    copy_rows(cursor, 'products_cart', ['id', 'user_id', 'created_at', 'updated_at'], carts)
+    return len(users)
+
+
+def _product_rows(config, index, first_id, count, cursor):
+    rng, faker = _random(config, 'products', index)
+    text = _Text(faker, rng)
+    now = timezone.now()
+    user_ids = range(config.first_user_id, config.first_user_id + config.users)
+    products, reviews, tag_links, category_links, images = [], [], [], [], []
+
+    for product_id in range(first_id, first_id + count):
+        created = _timestamp(rng, now)
+        owner = rng.choice(user_ids) if user_ids and rng.random() < 0.8 else None
+
+        review_count = min(rng.randint(0, 2 * config.reviews_per_product), len(user_ids))
+        ratings = rng.choices(range(1, 6), weights=RATING_WEIGHTS, k=review_count)
+        for user_id, rating in zip(rng.sample(user_ids, review_count), ratings):
+            reviewed = created + (now - created) * rng.random()
+            reviews.append([product_id, user_id, text.sentence(), rating, reviewed, reviewed])
+
+        products.append([
+            product_id, text.name(), text.paragraph(),
+            f'{rng.uniform(1, 1000):.2f}', rng.choice(CURRENCIES), rng.randint(0, 100), owner, created, created,
+            review_count, sum(ratings), *(ratings.count(rating) for rating in RATING_COUNT_FIELDS),
+        ])
+
+        for tag_id in rng.sample(config.tag_ids, min(rng.randint(0, 3), len(config.tag_ids))):
+            tag_links.append([product_id, tag_id])
+        if config.category_ids and rng.random() < 0.9:
+            category_links.append([rng.choice(config.category_ids), product_id])
+        for number in range(config.images):
+            images.append([f'products/dataset/{product_id}_{number}.webp', product_id, created, created])
+
+    copy_rows(cursor, 'products_product', PRODUCT_COLUMNS, products)
+    copy_rows(cursor, 'products_review', ['product_id', 'user_id', 'content', 'rating', 'created_at', 'updated_at'], reviews)
+    copy_rows(cursor, 'products_product_tags', ['product_id', 'producttag_id'], tag_links)
+    copy_rows(cursor, 'categories_category_products', ['category_id', 'product_id'], category_links)
+    copy_rows(cursor, 'products_productimage', ['image', 'product_id', 'created_at', 'updated_at'], images)
+    return len(products)
+
+
+def _activity_rows(config, index, first_id, count, cursor):
+    rng, _ = _random(config, 'activity', index)
+    now = timezone.now()
+    product_ids = range(config.first_product_id, config.first_product_id + config.products)
+    favorites, items = [], []
+
+    for user_id in range(first_id, first_id + count):
+        favorite_count = min(rng.randint(0, 2 * config.favorites_per_user), len(product_ids))
+        for product_id in rng.sample(product_ids, favorite_count):
+            added = _timestamp(rng, now)
+            favorites.append([product_id, user_id, added, added])
+
+        item_count = min(rng.randint(0, 2 * config.cart_items_per_user), len(product_ids))
+        for product_id in rng.sample(product_ids, item_count):
+            added = _timestamp(rng, now)
+            cart_id = config.first_cart_id + user_id - config.first_user_id
+            items.append([cart_id, product_id, rng.randint(1, 5), f'{rng.uniform(1, 1000):.2f}', added, added])
+
+    copy_rows(cursor, 'products_favoriteproduct', ['product_id', 'user_id', 'created_at', 'updated_at'], favorites)
+    copy_rows(
+        cursor, 'products_cartitem',
+        ['cart_id', 'product_id', 'quantity', 'price_at_time_of_addition', 'created_at', 'updated_at'], items,
+    )
+    return len(favorites) + len(items)
+
+
+GENERATORS = {
+    'users': _user_rows,
+    'products': _product_rows,
+    'activity': _activity_rows,
+}
+
+
+def run_task(task):
+    kind, config, index, first_id, count = task
+    with transaction.atomic(), connection.cursor() as cursor:
+        return GENERATORS[kind](config, index, first_id, count, cursor)
+
+
+def init_worker():
+    # forked workers must not share the parent's database socket
+    connections.close_all()
+
+
+def create_names(model, count, seed):
+    """
+    Adds `count` uniquely named rows (tags, categories) and returns the ids of
+    all of them, so products link to earlier ones too.
+    """
+    faker = Faker()
+    faker.seed_instance(f'{seed}:{model._meta.model_name}')
+    start = model.objects.count()
+    model.objects.bulk_create([model(name=f'{faker.word()} {start + number}') for number in range(count)])
+    return tuple(model.objects.order_by('id').values_list('id', flat=True))
+
+
+def password_hash(seed):
+    # fixed salt keeps snapshots byte-identical between runs
+    return make_password(PASSWORD, salt=f'dataset{seed}')
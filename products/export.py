@@ -0,0 +1,92 @@
+import csv
+import json
+import zlib
+
+from django.conf import settings
+from django.contrib.postgres.expressions import ArraySubquery
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import OuterRef
+from django.http import StreamingHttpResponse
+from products.models import Product
+
+
+EXPORT_FIELDS = [
+    'id', 'name', 'description', 'price', 'currency', 'price_in_base', 'quantity',
+    'user_id', 'review_count', 'created_at', 'updated_at',
+]
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+def export_rows(queryset, chunk_size=None):
+    """
+    Plain dicts for every product in `queryset`, read through a server-side
+    cursor `chunk_size` rows at a time. Tag names come from a correlated
+    subquery per row, so nothing has to be grouped or prefetched up front.
+    """
+    tag_names = ArraySubquery(
+        Product.tags.through.objects
+        .filter(product_id=OuterRef('pk'))
+        .order_by('producttag__name')
+        .values('producttag__name')
+    )
+    rows = queryset.order_by('id').values(*EXPORT_FIELDS, tag_names=tag_names)
+    return rows.iterator(chunk_size=chunk_size or getattr(settings, 'PRODUCT_EXPORT_CHUNK_SIZE', 2000))
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class _Line:
+    # csv.writer target that hands back the line instead of buffering it
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow([*EXPORT_FIELDS, 'tag_names'])
+    for row in rows:
+        yield writer.writerow([*(row[field] for field in EXPORT_FIELDS), '|'.join(row['tag_names'])])
+
+
+def encode(lines, buffer_size=64 * 1024):
+    # one write per ~64KB instead of one per row
+    buffer, size = [], 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(queryset, export_format='ndjson', compress=False, filename='products'):
+    content_type, extension = EXPORT_FORMATS[export_format]
+    lines = ndjson_lines if export_format == 'ndjson' else csv_lines
+    chunks = encode(lines(export_rows(queryset)))
+    filename = f'{filename}.{extension}'
+    if compress:
+        chunks = gzip_chunks(chunks)
+        content_type, filename = 'application/gzip', f'{filename}.gz'
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.db.models import Count, Q
+from products.choices import Currency
+from products.models import Product
+
+
+def price_buckets():
+    bounds = getattr(settings, 'PRODUCT_FACET_PRICE_BUCKETS', [0, 50, 100, 250, 500, 1000])
+    return [
+        (low, high)
+        for low, high in zip(bounds, [*bounds[1:], None])
+    ]
+
+
+def _counts(queryset, id_field, name_field):
+    rows = (
+        queryset.filter(**{f'{id_field}__isnull': False})
+        .values(id_field, name_field)
+        .annotate(count=Count('id'))
+        .order_by('-count', name_field)
+    )
+    return [{'id': row[id_field], 'name': row[name_field], 'count': row['count']} for row in rows]
+
+
+def product_facets(filtered):
+    """
+    Sidebar counts for an already filtered/searched product queryset, in four
+    aggregate queries whatever its size: tags, categories, currencies and the
+    price histogram.
+    """
+    products = Product.objects.filter(pk__in=filtered.order_by().values('pk'))
+
+    currencies = dict(products.values_list('currency').annotate(count=Count('id')).order_by())
+
+    buckets = price_buckets()
+    histogram = products.aggregate(**{
+        f'bucket_{index}': Count('id', filter=Q(price_in_base__gte=low, **({'price_in_base__lt': high} if high is not None else {})))
+        for index, (low, high) in enumerate(buckets)
+    })
+
+    return {
+        'tags': _counts(products, 'tags__id', 'tags__name'),
+        'categories': _counts(products, 'categories__id', 'categories__name'),
+        'currencies': [
+            {'currency': value, 'label': label, 'count': currencies.get(value, 0)}
+            for value, label in Currency.choices
+        ],
+        'price': [
+            {'min': low, 'max': high, 'count': histogram[f'bucket_{index}']}
+            for index, (low, high) in enumerate(buckets)
+        ],
+    }
@@ -1,13 +1,47 @@
-from django_filters import FilterSet, NumberFilter
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F
+from django_filters import FilterSet, NumberFilter, ChoiceFilter
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+from products.choices import Currency
+from products.fx import to_base
 from products.models import Product, Review
+from products.search import search_products
 
 class ProductFilter(FilterSet):
-    price_min = NumberFilter(field_name='price', lookup_expr='gte')
-    price_max = NumberFilter(field_name='price', lookup_expr='lte')
+    # bounds are in price_currency (default settings.BASE_CURRENCY) and compared
+    # with price_in_base, so products in every currency are filtered alike
+    price_min = NumberFilter(method='filter_price_min')
+    price_max = NumberFilter(method='filter_price_max')
+    price_currency = ChoiceFilter(choices=Currency.choices, method='filter_price_currency')
+    # rating_average is aliased by products.querysets.product_queryset
+    rating_min = NumberFilter(field_name='rating_average', lookup_expr='gte')
+    rating_max = NumberFilter(field_name='rating_average', lookup_expr='lte')
+    review_count_min = NumberFilter(field_name='review_count', lookup_expr='gte')
 
     class Meta:
         model = Product
-        fields = ['categories', 'price_min', 'price_max']
+        fields = [
+            'categories', 'tags', 'currency', 'price_min', 'price_max', 'price_currency',
+            'rating_min', 'rating_max', 'review_count_min',
+        ]
+
+    def filter_price(self, queryset, lookup, value):
+        currency = self.form.cleaned_data.get('price_currency') or settings.BASE_CURRENCY
+        bound = to_base(value, currency)
+        if bound is None:
+            return queryset.none()
+        return queryset.filter(**{f'price_in_base__{lookup}': bound})
+
+    def filter_price_min(self, queryset, name, value):
+        return self.filter_price(queryset, 'gte', value)
+
+    def filter_price_max(self, queryset, name, value):
+        return self.filter_price(queryset, 'lte', value)
+
+    def filter_price_currency(self, queryset, name, value):
+        # only read by filter_price
+        return queryset
 
 
 
@@ -18,4 +52,57 @@ class ReviewFilter(FilterSet):
 
     class Meta:
         model = Review
-        fields = ['product', 'rating_min', 'rating_max']
\ No newline at end of file
+        fields = ['product', 'rating_min', 'rating_max']
+
+
+
+class ProductFullTextSearchFilter(BaseFilterBackend):
+    """
+    `?q=` search over the indexed search_vector column, ranked with name
+    matches above description matches.
+    """
+    search_param = 'q'
+
+    def filter_queryset(self, request, queryset, view):
+        terms = request.query_params.get(self.search_param, '').strip()
+        if not terms:
+            return queryset
+        return search_products(queryset, terms)
+
+
+class ProductOrderingFilter(OrderingFilter):
+    """
+    Maps public names through the view's ordering_aliases and ends every
+    ordering with id in the same direction, so pages are stable and each
+    ordering matches one of the (<field>, id) indexes on Product. Without
+    ?ordering= a queryset already ordered by an earlier backend (?q= rank)
+    keeps its order instead of falling back to the view default.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        if not request.query_params.get(self.ordering_param) and queryset.query.order_by:
+            return None
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        aliases = getattr(view, 'ordering_aliases', {})
+        ordering = [
+            ('-' if term.startswith('-') else '') + aliases.get(term.lstrip('-'), term.lstrip('-'))
+            for term in ordering
+        ]
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering = [*ordering, '-id' if ordering[-1].startswith('-') else 'id']
+        return [_nulls_last(queryset, term) for term in ordering]
+
+
+def _nulls_last(queryset, term):
+    # products without an FX rate have no price_in_base, they come last
+    # either way, as in cursor pages
+    name = term.lstrip('-')
+    try:
+        nullable = queryset.model._meta.get_field(name).null
+    except FieldDoesNotExist:
+        return term
+    if not nullable:
+        return term
+    return F(name).desc(nulls_last=True) if term.startswith('-') else F(name).asc(nulls_last=True)
@@ -0,0 +1,35 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from products.models import FxRate
+
+
+FX_RATES_CACHE_KEY = 'fx_rates'
+
+
+def get_rates():
+    """
+    {currency: rate to settings.BASE_CURRENCY}, cached until an FxRate changes.
+    """
+    rates = cache.get(FX_RATES_CACHE_KEY)
+    if rates is None:
+        rates = dict(FxRate.objects.values_list('currency', 'rate'))
+        cache.set(FX_RATES_CACHE_KEY, rates, getattr(settings, 'FX_RATES_CACHE_TIMEOUT', 60 * 60))
+    return rates
+
+
+def invalidate_rates():
+    cache.delete(FX_RATES_CACHE_KEY)
+
+
+def to_base(amount, currency):
+    """
+    Converts `amount` of `currency` to the base currency, None when there is no rate.
+    """
+    if currency == settings.BASE_CURRENCY:
+        return Decimal(amount)
+    rate = get_rates().get(currency)
+    if rate is None:
+        return None
+    return (Decimal(amount) * rate).quantize(Decimal('0.01'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from config.utils.response_cache import invalidate_all
+from products.models import Product
+from products.search import product_search_vector
+
+
+class Command(BaseCommand):
+    help = "Fill Product.search_vector for rows written before the search trigger existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--all', action='store_true', help='recompute every row, not only empty ones')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Product.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(search_vector__isnull=True)
+
+        last_id = 0
+        updated = 0
+        while True:
+            ids = list(
+                queryset.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            updated += Product.objects.filter(id__in=ids).update(search_vector=product_search_vector())
+            last_id = ids[-1]
+            self.stdout.write(f'updated {updated} products (last id {last_id})')
+
+        if updated:
+            invalidate_all('products')
+        self.stdout.write(self.style.SUCCESS(f'search vectors filled for {updated} products'))
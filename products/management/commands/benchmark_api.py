@@ -0,0 +1,196 @@
+import json
+import math
+import random
+import socket
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+import uvicorn
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.test.testcases import LiveServerThread
+from django.test.utils import override_settings
+from rest_framework.throttling import SimpleRateThrottle
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from products.benchmark import PASSWORD, BenchmarkRunner, Fixtures, parse_mix
+from products.models import Product
+from products.pagination import ProductPagination
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a weighted mix of API requests at a fixed concurrency and report p50/p95/p99 latency, "
+        "throughput and queries per request for every endpoint, optionally as JSON for comparing runs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mix', help='JSON file or "product_list=25,login=5,..." (default: products.benchmark.DEFAULT_MIX)',
+        )
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+        parser.add_argument('--warmup', type=float, default=5, help='seconds of traffic before measuring')
+        parser.add_argument('--users', type=int, default=50, help='accounts the clients log in as')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='write the results as JSON')
+        parser.add_argument('--compare', metavar='JSON', help='print the change against an earlier --output')
+        parser.add_argument(
+            '--url', help='benchmark a server that is already running (start it with QUERY_COUNT_HEADER=1); '
+                          'by default a threaded server is started in this process',
+        )
+        parser.add_argument(
+            '--server', choices=['wsgi', 'asgi'], default='wsgi',
+            help='in-process server: threaded WSGI, or uvicorn serving config.asgi (for the async_* endpoints)',
+        )
+        parser.add_argument('--keep-throttling', action='store_true')
+
+    def fixtures(self, options):
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:10000])
+        if not product_ids:
+            raise CommandError('no products, create some with create_products')
+        rng = random.Random(options['seed'])
+        names = Product.objects.filter(id__in=rng.sample(product_ids, min(200, len(product_ids)))).values_list('name', flat=True)
+        search_terms = sorted({word for name in names for word in name.split() if len(word) > 3}) or ['product']
+
+        # accounts from create_products --users share its password
+        users = list(User.objects.filter(email__endswith='@example.com', is_active=True).order_by('id')[:options['users']])
+        for user in users:
+            if not user.check_password(PASSWORD):
+                raise CommandError(f'{user.email} does not use the benchmark password')
+        existing = {user.email for user in users}
+        for number in range(options['users'] - len(users)):
+            email = f'bench{number}@example.com'
+            if email not in existing:
+                users.append(User.objects.create_user(
+                    username=f'bench{number}', email=email, phone_number=f'+1{number:09d}', password=PASSWORD,
+                ))
+        tokens = [(user.email, str(RefreshToken.for_user(user).access_token)) for user in users]
+        pages = min(20, math.ceil(Product.objects.count() / ProductPagination.page_size))
+        return Fixtures(product_ids, search_terms, tokens, pages)
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except (ValueError, OSError) as error:
+            raise CommandError(error)
+        fixtures = self.fixtures(options)
+
+        runner = BenchmarkRunner(
+            base_url=options['url'], mix=mix, fixtures=fixtures, concurrency=options['concurrency'],
+            duration=options['duration'], warmup=options['warmup'], seed=options['seed'],
+        )
+        started = time.time()
+        if options['url']:
+            results = runner.run()
+        else:
+            results = self.run_local(runner, options)
+
+        report = {
+            'commit': self.commit(),
+            'started': started,
+            'config': {
+                'mix': mix,
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+                'warmup': options['warmup'],
+                'users': len(fixtures.users),
+                'seed': options['seed'],
+                'url': options['url'],
+                'server': None if options['url'] else options['server'],
+            },
+            **results,
+        }
+        self.print_report(report)
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.print_comparison(json.load(file), report)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"results written to {options['output']}"))
+
+    def run_local(self, runner, options):
+        # DRF binds throttle rates at import time, so override_settings would not reach them
+        rates = SimpleRateThrottle.THROTTLE_RATES
+        throttling = mock.patch.dict(rates, {} if options['keep_throttling'] else {scope: None for scope in rates})
+        serve = self.serve_asgi if options['server'] == 'asgi' else self.serve_wsgi
+        with override_settings(QUERY_COUNT_HEADER=True, ALLOWED_HOSTS=['*']), throttling, serve() as base_url:
+            runner.base_url = base_url
+            return runner.run()
+
+    @contextmanager
+    def serve_wsgi(self):
+        server = LiveServerThread('localhost', static_handler=lambda handler: handler)
+        server.daemon = True
+        server.start()
+        server.is_ready.wait()
+        if server.error:
+            raise server.error
+        try:
+            yield f'http://localhost:{server.port}'
+        finally:
+            server.terminate()
+
+    @contextmanager
+    def serve_asgi(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        server = uvicorn.Server(uvicorn.Config(get_asgi_application(), lifespan='off', log_level='warning'))
+        thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+        thread.start()
+        while not server.started:
+            if not thread.is_alive():
+                raise CommandError('uvicorn did not start')
+            time.sleep(0.01)
+        try:
+            yield f'http://127.0.0.1:{sock.getsockname()[1]}'
+        finally:
+            server.should_exit = True
+            thread.join()
+            sock.close()
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{'endpoint':<22}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        for name, stats in [*report['endpoints'].items(), ('total', report['total'])]:
+            self.stdout.write(
+                f"{name:<22}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput'] or 0:>9.1f}"
+                f"{stats['p50_ms'] or 0:>9.1f}{stats['p95_ms'] or 0:>9.1f}{stats['p99_ms'] or 0:>9.1f}"
+                f"{stats['queries_per_request'] if stats['queries_per_request'] is not None else '-':>9}"
+            )
+
+    def print_comparison(self, before, after):
+        self.stdout.write(f"\nchange against {before.get('commit') or 'previous run'} (p95 ms, req/s, queries)")
+        for name in sorted(set(before['endpoints']) | set(after['endpoints'])):
+            old, new = before['endpoints'].get(name), after['endpoints'].get(name)
+            if not old or not new:
+                self.stdout.write(f'{name:<22} only in {"new" if new else "old"} run')
+                continue
+            self.stdout.write(
+                f"{name:<22}{self.delta(old['p95_ms'], new['p95_ms']):>26}"
+                f"{self.delta(old['throughput'], new['throughput']):>26}"
+                f"{self.delta(old['queries_per_request'], new['queries_per_request']):>26}"
+            )
+
+    def delta(self, old, new):
+        if old is None or new is None:
+            return '-'
+        if not old:
+            return f'{old} -> {new}'
+        return f'{old} -> {new} ({(new - old) / old:+.0%})'
@@ -0,0 +1,104 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from categories.models import Category
+from products.models import Product, ProductTag
+from products.querysets import product_queryset
+from products.views import ProductViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the first page of every supported product filter/ordering "
+        "combination and time it. Meant to run against a seeded database (1M+ products)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--analyze', action='store_true', help='ANALYZE the product tables first')
+        parser.add_argument(
+            '--force-index', action='store_true',
+            help='disable sequential scans, to check an index exists even on a small table',
+        )
+        parser.add_argument('--check', action='store_true', help='fail if any plan has a sequential scan')
+
+    def scenarios(self):
+        scenarios = [
+            ('default', {}),
+            ('price', {'ordering': 'price'}),
+            ('-price', {'ordering': '-price'}),
+            ('created_at', {'ordering': 'created_at'}),
+            ('name', {'ordering': 'name'}),
+            ('-rating_average', {'ordering': '-rating_average'}),
+            ('-review_count', {'ordering': '-review_count'}),
+            ('price range', {'price_min': 10, 'price_max': 20, 'ordering': 'price'}),
+            ('currency, price', {'currency': 'usd', 'ordering': 'price'}),
+            ('rating_min', {'rating_min': 4, 'ordering': '-rating_average'}),
+        ]
+        category = Category.objects.order_by('id').first()
+        if category is not None:
+            scenarios.append(('category', {'categories': category.id}))
+        tag = ProductTag.objects.order_by('id').first()
+        if tag is not None:
+            scenarios.append(('tag', {'tags': tag.id}))
+        return scenarios
+
+    def api_queryset(self, params, user_id=None):
+        # the same filter backends the list endpoint runs
+        view = ProductViewSet(action='list', kwargs={}, format_kwarg=None)
+        view.request = Request(APIRequestFactory().get('/products/', params))
+        queryset = view.queryset if user_id is None else view.queryset.filter(user_id=user_id)
+        return view.filter_queryset(product_queryset(queryset, view.get_serializer()))
+
+    def measure(self, queryset, repeat, page_size):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(queryset.values_list('id', flat=True)[:page_size])
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[max(int(len(timings) * 0.95) - 1, 0)]
+
+    def plan(self, queryset, page_size):
+        lines = queryset.values_list('id', flat=True)[:page_size].explain().splitlines()
+        return [line.strip().lstrip('-> ') for line in lines if 'Scan' in line]
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        page_size = options['page_size']
+
+        with connection.cursor() as cursor:
+            if options['analyze']:
+                cursor.execute('ANALYZE products_product, products_product_tags, categories_category_products')
+            if options['force_index']:
+                cursor.execute('SET enable_seqscan = off')
+
+        self.stdout.write(f'{Product.objects.count()} products, {repeat} runs per query\n')
+
+        scenarios = [(label, self.api_queryset(params)) for label, params in self.scenarios()]
+        owner_id = Product.objects.filter(user__isnull=False).values_list('user_id', flat=True).first()
+        if owner_id is not None:
+            scenarios.append(('my_products', self.api_queryset({}, user_id=owner_id)))
+
+        failures = []
+        try:
+            for label, queryset in scenarios:
+                scans = self.plan(queryset, page_size)
+                median, p95 = self.measure(queryset, repeat, page_size)
+                if any(scan.startswith('Seq Scan') for scan in scans):
+                    failures.append(label)
+                self.stdout.write(
+                    f'{label:<18} median={median:8.2f}ms p95={p95:8.2f}ms  {"; ".join(scans)}'
+                )
+        finally:
+            if options['force_index']:
+                with connection.cursor() as cursor:
+                    cursor.execute('RESET enable_seqscan')
+
+        if failures and options['check']:
+            raise CommandError(f'sequential scans in: {", ".join(failures)}')
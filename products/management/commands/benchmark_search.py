@@ -0,0 +1,54 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from products.models import Product
+from products.search import search_products
+
+
+class Command(BaseCommand):
+    help = "Compare the ILIKE SearchFilter path with the full-text ?q= path"
+
+    def add_arguments(self, parser):
+        parser.add_argument('terms', nargs='*', default=['phone', 'black shoes', 'garden'])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=10)
+
+    def legacy_queryset(self, term):
+        # what rest_framework.filters.SearchFilter builds for search_fields = ['name', 'description']
+        queryset = Product.objects.all()
+        for bit in term.split():
+            queryset = queryset.filter(Q(name__icontains=bit) | Q(description__icontains=bit))
+        return queryset.order_by('-id')
+
+    def measure(self, queryset, repeat, page_size):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            queryset.count()
+            list(queryset[:page_size])
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+    def plan(self, queryset, page_size):
+        lines = queryset[:page_size].explain().splitlines()
+        scans = [line.strip().lstrip('-> ') for line in lines if 'Scan' in line]
+        return scans[0] if scans else lines[0]
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        page_size = options['page_size']
+        self.stdout.write(f'{Product.objects.count()} products, {repeat} runs per query\n')
+
+        for term in options['terms']:
+            for label, queryset in [
+                ('search', self.legacy_queryset(term)),
+                ('q', search_products(Product.objects.all(), term)),
+            ]:
+                median, p95 = self.measure(queryset, repeat, page_size)
+                self.stdout.write(
+                    f'{term!r:<20} ?{label:<7} matches={queryset.count():<8} '
+                    f'median={median:8.2f}ms p95={p95:8.2f}ms  {self.plan(queryset, page_size)}'
+                )
@@ -1,42 +1,130 @@
-from django.core.management.base import BaseCommand
-from faker import Faker
-import random
+import multiprocessing
+import os
+import time
 
-faker = Faker()
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Max
+
+from categories.models import Category
+from config.utils.db_snapshot import save_snapshot, restore_snapshot, list_snapshots
+from config.utils.response_cache import invalidate_all
+from products.dataset import DatasetConfig, chunk_tasks, create_names, init_worker, password_hash, run_task
+from products.models import Cart, Product, ProductTag
+from users.models import User
+
+SEQUENCES = ['users_user', 'products_cart', 'products_product']
+
+ANALYZE_TABLES = [
+    'users_user', 'products_cart', 'products_product', 'products_review', 'products_product_tags',
+    'categories_category_products', 'products_productimage', 'products_favoriteproduct', 'products_cartitem',
+]
 
-from products.choices import Currency
-from products.models import Product
 
 class Command(BaseCommand):
-    def handle(self, *args, **kwargs):
-        products_to_create = []
+    help = (
+        "Generate a reproducible synthetic dataset (users, products, reviews, tags, categories, images, "
+        "favorites, carts) with COPY from several processes, and save/restore database snapshots"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=0)
+        parser.add_argument('--reviews-per-product', type=int, default=0, help='average, needs --users')
+        parser.add_argument('--tags', type=int, default=0)
+        parser.add_argument('--categories', type=int, default=0)
+        parser.add_argument('--images', type=int, default=0, help='image rows per product (no files are written)')
+        parser.add_argument('--favorites-per-user', type=int, default=0, help='average')
+        parser.add_argument('--cart-items-per-user', type=int, default=0, help='average')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=20000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--snapshot', metavar='NAME', help='save the database as NAME when done')
+        parser.add_argument('--restore', metavar='NAME', help='replace the database with snapshot NAME and exit')
+        parser.add_argument('--list-snapshots', action='store_true')
+        parser.add_argument('--force', action='store_true', help='disconnect other sessions for --snapshot/--restore')
+
+    def next_id(self, model):
+        return (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+    def run(self, label, tasks, workers):
+        if not tasks:
+            return
+        started = time.perf_counter()
+        done = 0
+        if workers > 1:
+            # children get fresh connections, see init_worker
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers, initializer=init_worker) as pool:
+                for rows in pool.imap_unordered(run_task, tasks):
+                    done += rows
+                    self.progress(label, done, started)
+        else:
+            for task in tasks:
+                done += run_task(task)
+                self.progress(label, done, started)
 
-        currencies = [
+    def progress(self, label, done, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label}: {done} ({done / elapsed:,.0f}/s)')
 
-            Currency.GEL,
-            Currency.USD,
-            Currency.EURO,
-        ]
+    def handle(self, *args, **options):
+        try:
+            if options['list_snapshots']:
+                self.stdout.write('\n'.join(list_snapshots()))
+                return
+            if options['restore']:
+                restore_snapshot(options['restore'], force=options['force'])
+                self.stdout.write(self.style.SUCCESS(f"restored snapshot {options['restore']}"))
+                return
+        except ValueError as error:
+            raise CommandError(error)
 
+        if options['reviews_per_product'] and not options['users']:
+            raise CommandError('--reviews-per-product needs --users')
 
-        for _ in range(1000):
-            name = faker.name()
-            description = faker.text()
-            price = round(random.uniform(1,1000),2)
-            quantity = random.randint(1,100)
-            currency = random.choice(currencies)
+        started = time.perf_counter()
+        config = DatasetConfig(
+            products=options['products'],
+            users=options['users'],
+            reviews_per_product=options['reviews_per_product'],
+            tags=options['tags'],
+            categories=options['categories'],
+            images=options['images'],
+            favorites_per_user=options['favorites_per_user'],
+            cart_items_per_user=options['cart_items_per_user'],
+            seed=options['seed'],
+            chunk_size=options['chunk_size'],
+            first_user_id=self.next_id(User),
+            first_cart_id=self.next_id(Cart),
+            first_product_id=self.next_id(Product),
+            password_hash=password_hash(options['seed']) if options['users'] else '',
+        )
+        config.tag_ids = create_names(ProductTag, config.tags, config.seed)
+        config.category_ids = create_names(Category, config.categories, config.seed)
 
+        workers = options['workers']
+        self.run('users', chunk_tasks('users', config, config.first_user_id, config.users), workers)
+        self.run('products', chunk_tasks('products', config, config.first_product_id, config.products), workers)
+        if config.users and (config.favorites_per_user or config.cart_items_per_user):
+            self.run('favorites and cart items', chunk_tasks('activity', config, config.first_user_id, config.users), workers)
 
-            product = Product(
-                name=name,
-                description=description,
-                price=price,
-                quantity=quantity,
-                currency=currency,
-            )
+        with connection.cursor() as cursor:
+            # rows were written with explicit ids
+            for table in SEQUENCES:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT MAX(id) FROM {table}), 1))"
+                )
+            cursor.execute(f"ANALYZE {', '.join(ANALYZE_TABLES)}")
+        invalidate_all('products')
 
-            products_to_create.append(product)
+        self.stdout.write(self.style.SUCCESS(
+            f'created {config.users} users and {config.products} products in {time.perf_counter() - started:.1f}s'
+        ))
 
-        
-        Product.objects.bulk_create(products_to_create, batch_size=100)
-        print('created 1000 products')
\ No newline at end of file
+        if options['snapshot']:
+            try:
+                save_snapshot(options['snapshot'], force=options['force'])
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(self.style.SUCCESS(f"saved snapshot {options['snapshot']}"))
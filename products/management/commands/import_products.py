@@ -0,0 +1,223 @@
+import csv
+import gzip
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from config.utils.pg_copy import copy_rows
+from config.utils.response_cache import invalidate_all
+from products.choices import Currency
+
+
+# every staging column is text, values are cast in the upsert so a bad row
+# fails with the line range of its batch instead of inside COPY
+STAGE_COLUMNS = ['line', 'id', 'name', 'description', 'price', 'currency', 'quantity', 'user_id', 'tag_names', 'category_names']
+
+CREATE_STAGE = '''
+CREATE TEMP TABLE IF NOT EXISTS import_products_stage (
+    line bigint, id text, name text, description text, price text, currency text,
+    quantity text, user_id text, tag_names text, category_names text
+)
+'''
+
+# explicit ids of this batch and ids others took must never come from the
+# sequence; nextval() covers ids handed out but not committed yet
+RESERVE_IDS = '''
+SELECT setval(pg_get_serial_sequence('products_product', 'id'), GREATEST(
+    (SELECT MAX(id::bigint) FROM import_products_stage WHERE id <> ''),
+    (SELECT MAX(id) FROM products_product),
+    nextval(pg_get_serial_sequence('products_product', 'id'))
+))
+'''
+
+ASSIGN_IDS = '''
+UPDATE import_products_stage SET id = nextval(pg_get_serial_sequence('products_product', 'id'))::text
+WHERE id IS NULL OR id = ''
+'''
+
+# the last line wins when a batch has the same id twice
+UPSERT_PRODUCTS = '''
+INSERT INTO products_product (
+    id, name, description, price, currency, quantity, user_id, created_at, updated_at,
+    review_count, rating_sum, rating_1_count, rating_2_count, rating_3_count, rating_4_count, rating_5_count
+)
+SELECT DISTINCT ON (id::bigint)
+    id::bigint, name, COALESCE(description, ''), price::numeric, COALESCE(NULLIF(currency, ''), %s),
+    COALESCE(NULLIF(quantity, '')::integer, 1), NULLIF(user_id, '')::bigint, now(), now(),
+    0, 0, 0, 0, 0, 0, 0
+FROM import_products_stage
+ORDER BY id::bigint, line DESC
+ON CONFLICT (id) DO UPDATE SET
+    name = EXCLUDED.name,
+    description = EXCLUDED.description,
+    price = EXCLUDED.price,
+    currency = EXCLUDED.currency,
+    quantity = EXCLUDED.quantity,
+    user_id = EXCLUDED.user_id,
+    updated_at = now()
+'''
+
+# {names} is tag_names or category_names; a NULL column leaves the links alone,
+# an empty one clears them
+UPSERT_NAMES = '''
+INSERT INTO {table} (name, created_at, updated_at)
+SELECT DISTINCT link.name, now(), now()
+FROM import_products_stage, unnest(string_to_array({names}, '|')) AS link(name)
+WHERE link.name <> ''
+ON CONFLICT (name) DO NOTHING
+'''
+
+DELETE_LINKS = '''
+DELETE FROM {through} WHERE product_id IN (
+    SELECT id::bigint FROM import_products_stage WHERE {names} IS NOT NULL
+)
+'''
+
+INSERT_LINKS = '''
+INSERT INTO {through} (product_id, {target})
+SELECT DISTINCT stage.id::bigint, target.id
+FROM import_products_stage AS stage, unnest(string_to_array(stage.{names}, '|')) AS link(name)
+JOIN {table} AS target ON target.name = link.name
+ON CONFLICT DO NOTHING
+'''
+
+LINKS = [
+    {'names': 'tag_names', 'table': 'products_producttag', 'through': 'products_product_tags', 'target': 'producttag_id'},
+    {'names': 'category_names', 'table': 'categories_category', 'through': 'categories_category_products', 'target': 'category_id'},
+]
+
+# price_in_base needs an FX rate, unknown currencies would get NULL
+UNKNOWN_CURRENCY = '''
+SELECT line, currency FROM import_products_stage
+WHERE currency <> '' AND currency <> ALL(%s)
+ORDER BY line LIMIT 1
+'''
+
+
+def _names(value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return '|'.join(str(name) for name in value)
+    return str(value)
+
+
+class Command(BaseCommand):
+    help = (
+        "Import products from CSV or NDJSON (optionally .gz) through COPY into a staging "
+        "table and INSERT ... ON CONFLICT upserts, batch by batch with resumable checkpoints"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--checkpoint', help='defaults to <path>.checkpoint.json')
+        parser.add_argument('--resume', action='store_true', help='skip the lines a previous run committed')
+
+    def detect_format(self, path):
+        name = path[:-3] if path.endswith('.gz') else path
+        if name.endswith('.csv'):
+            return 'csv'
+        if name.endswith(('.ndjson', '.jsonl')):
+            return 'ndjson'
+        raise CommandError('cannot tell the format from the file name, pass --format')
+
+    def read_rows(self, path, file_format):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', newline='') as file:
+            if file_format == 'csv':
+                yield from csv.DictReader(file)
+            else:
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def stage_row(self, line, row):
+        return [
+            line, row.get('id'), row.get('name'), row.get('description'), row.get('price'),
+            row.get('currency'), row.get('quantity'), row.get('user_id'),
+            _names(row.get('tag_names')), _names(row.get('category_names')),
+        ]
+
+    def read_checkpoint(self, checkpoint, path):
+        if not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as file:
+            state = json.load(file)
+        if state.get('source') != os.path.abspath(path):
+            raise CommandError(f'{checkpoint} belongs to {state.get("source")}')
+        return state['lines']
+
+    def write_checkpoint(self, checkpoint, path, lines):
+        temporary = f'{checkpoint}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump({'source': os.path.abspath(path), 'lines': lines}, file)
+        os.replace(temporary, checkpoint)
+
+    def import_batch(self, cursor, batch):
+        cursor.execute('TRUNCATE import_products_stage')
+        copy_rows(cursor, 'import_products_stage', STAGE_COLUMNS, batch)
+        cursor.execute(UNKNOWN_CURRENCY, [Currency.values])
+        if unknown := cursor.fetchone():
+            raise ValueError(f'line {unknown[0]}: unknown currency {unknown[1]!r}, expected one of {", ".join(Currency.values)}')
+        cursor.execute(RESERVE_IDS)
+        cursor.execute(ASSIGN_IDS)
+        cursor.execute(UPSERT_PRODUCTS, [Currency.GEL.value])
+        for link in LINKS:
+            cursor.execute(UPSERT_NAMES.format(**link))
+            cursor.execute(DELETE_LINKS.format(**link))
+            cursor.execute(INSERT_LINKS.format(**link))
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+        file_format = options['format'] or self.detect_format(path)
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint.json'
+
+        lines = self.read_checkpoint(checkpoint, path) if options['resume'] else 0
+        if lines:
+            self.stdout.write(f'resuming after line {lines}')
+        rows = islice(enumerate(self.read_rows(path, file_format), start=1), lines, None)
+
+        started = time.perf_counter()
+        imported = 0
+        with connection.cursor() as cursor:
+            cursor.execute(CREATE_STAGE)
+            try:
+                while batch := [self.stage_row(line, row) for line, row in islice(rows, batch_size)]:
+                    batch_started = time.perf_counter()
+                    try:
+                        with transaction.atomic():
+                            self.import_batch(cursor, batch)
+                    except Exception as error:
+                        raise CommandError(
+                            f'lines {batch[0][0]}-{batch[-1][0]} failed, '
+                            f'rerun with --resume to continue after line {lines}: {error}'
+                        ) from error
+
+                    lines = batch[-1][0]
+                    imported += len(batch)
+                    self.write_checkpoint(checkpoint, path, lines)
+
+                    now = time.perf_counter()
+                    self.stdout.write(
+                        f'line {lines}: {imported} rows imported, {len(batch) / (now - batch_started):,.0f} rows/s '
+                        f'(overall {imported / (now - started):,.0f} rows/s)'
+                    )
+            finally:
+                # committed batches are visible either way
+                if imported:
+                    invalidate_all('products')
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.perf_counter() - started
+        rate = imported / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f'imported {imported} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from config.utils.profiler import make_token
+
+
+class Command(BaseCommand):
+    help = "Print a token that lets one send X-Profile requests without a staff account (see config.utils.profiler)"
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from config.utils.response_cache import invalidate_details
+from products.models import Product, Review, AGGREGATE_FIELDS, RATING_COUNT_FIELDS
+
+
+class Command(BaseCommand):
+    help = "Recompute Product review aggregates from the reviews table and repair drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def actual_aggregates(self, ids):
+        counts = {
+            field: Count('id', filter=Q(rating=rating))
+            for rating, field in RATING_COUNT_FIELDS.items()
+        }
+        rows = (
+            Review.objects.filter(product_id__in=ids)
+            .values('product_id')
+            .annotate(review_count=Count('id'), rating_sum=Sum('rating'), **counts)
+        )
+        return {row.pop('product_id'): row for row in rows}
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        checked = repaired = 0
+
+        while True:
+            ids = list(
+                Product.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                # lock the batch so review writes cannot land between read and write
+                products = list(
+                    Product.objects.filter(id__in=ids)
+                    .select_for_update()
+                    .only('id', 'updated_at', *AGGREGATE_FIELDS)
+                )
+                actual = self.actual_aggregates(ids)
+
+                drifted = []
+                for product in products:
+                    expected = actual.get(product.id, {})
+                    if any(getattr(product, field) != (expected.get(field) or 0) for field in AGGREGATE_FIELDS):
+                        for field in AGGREGATE_FIELDS:
+                            setattr(product, field, expected.get(field) or 0)
+                        product.updated_at = timezone.now()
+                        drifted.append(product)
+
+                Product.objects.bulk_update(drifted, [*AGGREGATE_FIELDS, 'updated_at'])
+                if drifted:
+                    product_ids = [product.id for product in drifted]
+                    transaction.on_commit(lambda ids=product_ids: invalidate_details('products', ids))
+
+            checked += len(products)
+            repaired += len(drifted)
+            last_id = ids[-1]
+            self.stdout.write(f'checked {checked} products, repaired {repaired}')
+
+        self.stdout.write(self.style.SUCCESS(f'done: {repaired} of {checked} products had drifted'))
@@ -0,0 +1,76 @@
+# Generated by Django 5.1.5 on 2026-10-18 11:38
+
+from django.db import migrations, models
+
+
+# same values as the reconcile_ratings command computes
+BACKFILL = '''
+UPDATE products_product AS product
+SET review_count = reviews.review_count,
+    rating_sum = reviews.rating_sum,
+    rating_1_count = reviews.rating_1_count,
+    rating_2_count = reviews.rating_2_count,
+    rating_3_count = reviews.rating_3_count,
+    rating_4_count = reviews.rating_4_count,
+    rating_5_count = reviews.rating_5_count
+FROM (
+    SELECT
+        product_id,
+        count(*) AS review_count,
+        sum(rating) AS rating_sum,
+        count(*) FILTER (WHERE rating = 1) AS rating_1_count,
+        count(*) FILTER (WHERE rating = 2) AS rating_2_count,
+        count(*) FILTER (WHERE rating = 3) AS rating_3_count,
+        count(*) FILTER (WHERE rating = 4) AS rating_4_count,
+        count(*) FILTER (WHERE rating = 5) AS rating_5_count
+    FROM products_review
+    GROUP BY product_id
+) AS reviews
+WHERE reviews.product_id = product.id;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_trigram_name_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 5.1.5 on 2026-10-18 11:53
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# indicative GEL rates to start from, real ones are maintained through FxRate
+INITIAL_GEL_RATES = {'gel': Decimal('1'), 'usd': Decimal('2.70'), 'euro': Decimal('2.95')}
+
+# keep in sync with products.tasks.recompute_prices_in_base()
+CREATE_TRIGGER = '''
+CREATE FUNCTION products_product_price_in_base_update() RETURNS trigger AS $$
+BEGIN
+    NEW.price_in_base := round(
+        NEW.price * (SELECT rate FROM products_fxrate WHERE currency = NEW.currency), 2
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_product_price_in_base
+    BEFORE INSERT OR UPDATE OF price, currency ON products_product
+    FOR EACH ROW EXECUTE FUNCTION products_product_price_in_base_update();
+'''
+
+DROP_TRIGGER = '''
+DROP TRIGGER IF EXISTS products_product_price_in_base ON products_product;
+DROP FUNCTION IF EXISTS products_product_price_in_base_update();
+'''
+
+BACKFILL = '''
+UPDATE products_product AS product
+SET price_in_base = round(product.price * fxrate.rate, 2)
+FROM products_fxrate AS fxrate
+WHERE fxrate.currency = product.currency;
+'''
+
+
+def seed_rates(apps, schema_editor):
+    FxRate = apps.get_model('products', 'FxRate')
+    base = INITIAL_GEL_RATES.get(settings.BASE_CURRENCY, Decimal('1'))
+    FxRate.objects.bulk_create([
+        FxRate(currency=currency, rate=(rate / base).quantize(Decimal('0.00000001')))
+        for currency, rate in INITIAL_GEL_RATES.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0015_product_filter_ordering_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('currency', models.CharField(choices=[('gel', '₾'), ('usd', '$'), ('euro', '€')], max_length=255, unique=True)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(seed_rates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_price_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_currency_price_id_idx',
+        ),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='price_at_time_of_addition',
+            field=models.DecimalField(decimal_places=2, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='price_in_base',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=14, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price_in_base', 'id'], name='product_price_in_base_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['currency', 'price_in_base', 'id'], name='product_currency_base_id_idx'),
+        ),
+    ]
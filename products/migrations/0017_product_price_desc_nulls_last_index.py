@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-18 13:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0016_product_price_in_base'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(models.OrderBy(models.F('price_in_base'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='product_price_base_desc_idx'),
+        ),
+    ]
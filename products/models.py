@@ -1,19 +1,142 @@
 from django.db import models
 from django.core.validators import MaxValueValidator
+from django.contrib.postgres.indexes import GinIndex, GistIndex, OpClass
+from django.db.models import CharField, DecimalField, ExpressionWrapper, F, FloatField, OuterRef, Sum
+from django.db.models.functions import Upper, Cast, Greatest, JSONObject, Now
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.search import SearchVectorField
 from config.model_utils.models import TimeStampedModel
 from products.choices import Currency
 from config.utils.image_validators import validate_image_size, validate_image_dimesions, validate_image_count
 
+
+RATING_COUNT_FIELDS = {rating: f'rating_{rating}_count' for rating in range(1, 6)}
+# Product columns only written by apply_rating_change and reconcile_ratings
+AGGREGATE_FIELDS = ['review_count', 'rating_sum', *RATING_COUNT_FIELDS.values()]
+
+
+def rating_average():
+    # 0 for products without reviews, so they sort below rated ones in both directions
+    return Cast(F('rating_sum'), FloatField()) / Greatest(F('review_count'), 1)
+
+
+def line_total():
+    # CartItem.total_price() in SQL
+    return ExpressionWrapper(
+        F('quantity') * F('price_at_time_of_addition'), output_field=DecimalField(max_digits=22, decimal_places=2)
+    )
+
+
+def cart_totals():
+    # for a Cart queryset; prices stay in their product's currency, so a cart
+    # has one total per currency in it: [{'currency': 'usd', 'total': '12.00'}]
+    totals = (
+        CartItem.objects.filter(cart=OuterRef('pk')).order_by('product__currency').values('product__currency')
+        .annotate(total=Sum(line_total()))
+        .values(row=JSONObject(currency=F('product__currency'), total=Cast('total', CharField())))
+    )
+    return ArraySubquery(totals)
+
+
 class Product(TimeStampedModel, models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField()
-    price = models.FloatField()
+    price = models.DecimalField(max_digits=12, decimal_places=2)
     currency = models.CharField(max_length=255, choices=Currency.choices, default=Currency.GEL)
+    # price in settings.BASE_CURRENCY, set by the products_product_price_in_base trigger
+    # (migration 0016) and recomputed by products.tasks.recompute_prices_in_base on FX changes
+    price_in_base = models.DecimalField(max_digits=14, decimal_places=2, null=True, editable=False)
     tags = models.ManyToManyField("products.ProductTag", related_name='products', blank=True)
     quantity = models.PositiveIntegerField(default=1)
     user = models.ForeignKey('users.User', related_name='products', on_delete=models.CASCADE,null=True, blank=True)
+    # maintained by the products_product_search_vector trigger (migration 0011)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # review aggregates, kept in sync by Product.apply_rating_change
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            # Max(updated_at) for ETags
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+            models.Index(fields=['price_in_base', 'id'], name='product_price_in_base_id_idx'),
+            # -price with products without an FX rate last
+            models.Index(F('price_in_base').desc(nulls_last=True), F('id').desc(), name='product_price_base_desc_idx'),
+            models.Index(fields=['currency', 'price_in_base', 'id'], name='product_currency_base_id_idx'),
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['review_count', 'id'], name='product_review_count_id_idx'),
+            # same expression as the rating_average alias, so ?ordering=rating_average and
+            # ?rating_min= are index scans
+            models.Index(rating_average(), F('id'), name='product_rating_id_idx'),
+            # my_products; unowned (seeded/imported) products stay out of the index
+            models.Index(
+                fields=['user', 'created_at', 'id'],
+                name='product_user_created_id_idx',
+                condition=models.Q(user__isnull=False),
+            ),
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            # icontains compiles to UPPER(name) LIKE UPPER(...), so the trigram index is on UPPER(name)
+            GistIndex(OpClass(Upper('name'), name='gist_trgm_ops'), name='product_name_trgm_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # an existing row keeps its stored review aggregates: the values loaded
+        # with the instance may predate reviews applied since
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name not in AGGREGATE_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def average_rating(self):
-        pass
+        if not self.review_count:
+            return None
+        return round(self.rating_sum / self.review_count, 2)
+
+    def rating_histogram(self):
+        return {rating: getattr(self, field) for rating, field in RATING_COUNT_FIELDS.items()}
+
+    @classmethod
+    def apply_rating_change(cls, product_id, old_rating=None, new_rating=None):
+        """
+        Moves the stored aggregates from old_rating to new_rating with a single
+        F() update, so concurrent review writes never overwrite each other.
+        None means the review did not exist before / does not exist anymore.
+        """
+        deltas = {}
+        if old_rating is not None:
+            deltas['review_count'] = deltas.get('review_count', 0) - 1
+            deltas['rating_sum'] = deltas.get('rating_sum', 0) - old_rating
+            field = RATING_COUNT_FIELDS[old_rating]
+            deltas[field] = deltas.get(field, 0) - 1
+        if new_rating is not None:
+            deltas['review_count'] = deltas.get('review_count', 0) + 1
+            deltas['rating_sum'] = deltas.get('rating_sum', 0) + new_rating
+            field = RATING_COUNT_FIELDS[new_rating]
+            deltas[field] = deltas.get(field, 0) + 1
+
+        changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if changes:
+            # ratings are part of the product body, so its validators must move too
+            cls.objects.filter(id=product_id).update(updated_at=Now(), **changes)
+
+
+class FxRate(TimeStampedModel, models.Model):
+    currency = models.CharField(max_length=255, choices=Currency.choices, unique=True)
+    # units of settings.BASE_CURRENCY for one unit of `currency`
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+
+    def __str__(self):
+        return f"{self.currency} = {self.rate}"
 
 
 class Review(TimeStampedModel, models.Model):
@@ -24,6 +147,9 @@ class Review(TimeStampedModel, models.Model):
 
     class Meta:
         unique_together = ['product','user']
+        indexes = [
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_id_idx'),
+        ]
 
 
 class FavoriteProduct(TimeStampedModel, models.Model):
@@ -34,6 +160,11 @@ class FavoriteProduct(TimeStampedModel, models.Model):
 class ProductTag(TimeStampedModel, models.Model):
     name = models.CharField(max_length=255, unique=True)
 
+    class Meta:
+        indexes = [
+            GistIndex(OpClass(Upper('name'), name='gist_trgm_ops'), name='producttag_name_trgm_idx'),
+        ]
+
 
 class Cart(TimeStampedModel, models.Model):
     products = models.ManyToManyField('products.Product', related_name='carts')
@@ -53,11 +184,11 @@ class ProductImage(TimeStampedModel, models.Model):
         self.full_clean()
         super().save(*args, **kwargs)
 
-class CartItem(models.Model):
+class CartItem(TimeStampedModel, models.Model):
     cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey('product', related_name='cart_items', on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
-    price_at_time_of_addition = models.FloatField()
+    price_at_time_of_addition = models.DecimalField(max_digits=12, decimal_places=2)
 
 
     def __str__(self):
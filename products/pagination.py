@@ -1,6 +1,192 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 class ProductPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination limited to orderings backed by an index, so every page is
+    a single index range scan with no COUNT(*) and no OFFSET.
+
+    DRF's CursorPagination seeks on the first ordering field only and steps
+    over ties with an offset. Here the cursor holds every ordering value,
+    (value, id), and a page starts after it with a composite comparison, so
+    ties cost nothing. An ?ordering= outside `orderings` is a 400.
+
+    NULLs (price_in_base without an FX rate) come last in either direction
+    and are paged through by id; a NULL position is encoded as null.
+    Ordering terms may name annotations as well as model fields.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering_param = 'ordering'
+    orderings = {}
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_param)
+        if not ordering:
+            return self.ordering
+        if ordering not in self.orderings:
+            raise ValidationError({
+                self.ordering_param: [f'Cursor pagination orders by one of: {", ".join(self.orderings)}.']
+            })
+        return self.orderings[ordering]
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [
+            instance[term.lstrip('-')] if isinstance(instance, dict) else getattr(instance, term.lstrip('-'))
+            for term in ordering
+        ]
+        return json.dumps([None if value is None else str(value) for value in values])
+
+    def decode_position(self, queryset, position):
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError(position)
+            return [
+                None if value is None else self.field(queryset, term.lstrip('-')).to_python(value)
+                for term, value in zip(self.ordering, values)
+            ]
+        except (ValueError, TypeError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def field(self, queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def nullable(self, queryset, name):
+        return self.field(queryset, name).null
+
+    def seek(self, queryset, position, reverse):
+        # (a, id) after (x, y) is a > x OR (a = x AND id > y), led by a >= x
+        # so the planner reads it as one index range
+        condition = None
+        for term, value in reversed(list(zip(self.ordering, position))):
+            name = term.lstrip('-')
+            lookup = 'lt' if term.startswith('-') != reverse else 'gt'
+            nulls = self.nullable(queryset, name)
+            if value is None:
+                # NULLs are last: forward only NULLs follow, backward every value does
+                tied = Q(**{f'{name}__isnull': True}) & condition
+                condition = Q(**{f'{name}__isnull': False}) | tied if reverse else tied
+                continue
+            beyond = Q(**{f'{name}__{lookup}': value})
+            if nulls and not reverse:
+                beyond |= Q(**{f'{name}__isnull': True})
+            condition = beyond if condition is None else beyond | Q(**{name: value}) & condition
+        first, value = self.ordering[0], position[0]
+        if value is None or self.nullable(queryset, first.lstrip('-')):
+            return queryset.filter(condition)
+        lookup = 'lte' if first.startswith('-') != reverse else 'gte'
+        return queryset.filter(Q(**{f'{first.lstrip("-")}__{lookup}': value}) & condition)
+
+    def order(self, queryset, reverse):
+        ordering = []
+        for term in self.ordering:
+            name = term.lstrip('-')
+            descending = term.startswith('-') != reverse
+            if self.nullable(queryset, name):
+                # last going forward, so first going back
+                nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+                ordering.append(F(name).desc(**nulls) if descending else F(name).asc(**nulls))
+            else:
+                ordering.append(f'-{name}' if descending else name)
+        return queryset.order_by(*ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset with seek() in place of the
+        # single-field filter; the links are built by DRF as before
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        queryset = self.order(queryset, reverse)
+        if current_position is not None:
+            queryset = self.seek(queryset, self.decode_position(queryset, current_position), reverse)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        has_current = current_position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = has_current, following_position is not None
+            self.next_position, self.previous_position = current_position, following_position
+        else:
+            self.has_next, self.has_previous = following_position is not None, has_current
+            self.next_position, self.previous_position = following_position, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class ProductCursorPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+    orderings = {
+        'created_at': ('created_at', 'id'),
+        '-created_at': ('-created_at', '-id'),
+        'price': ('price_in_base', 'id'),
+        '-price': ('-price_in_base', '-id'),
+        'name': ('name', 'id'),
+        '-name': ('-name', '-id'),
+    }
+    # ?q= ranks its matches, so without an explicit ?ordering= its pages
+    # follow relevance as they do in page-number mode
+    rank_ordering = ('-rank', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        if not request.query_params.get(self.ordering_param) and 'rank' in queryset.query.annotations:
+            return self.rank_ordering
+        return super().get_ordering(request, queryset, view)
+
+
+class ReviewCursorPagination(KeysetPagination):
+    ordering = ('-created_at', '-id')
+    orderings = {
+        'created_at': ('created_at', 'id'),
+        '-created_at': ('-created_at', '-id'),
+    }
+
+
+class CursorPaginationMixin:
+    """
+    Switches a view to `cursor_pagination_class` when the client asks for it
+    with `?pagination=cursor`, otherwise `pagination_class` is used as before.
+    """
+    cursor_pagination_class = None
+    pagination_mode_query_param = 'pagination'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            request = getattr(self, 'request', None)
+            mode = request.query_params.get(self.pagination_mode_query_param) if request else None
+
+            if mode == 'cursor' and self.cursor_pagination_class is not None:
+                self._paginator = self.cursor_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
@@ -0,0 +1,73 @@
+from django.db.models import Prefetch
+from rest_framework import serializers
+from products.models import Product, rating_average
+from products.serializers import ProductSerializer
+
+
+def related_lookups(serializer, prefix=''):
+    """
+    select_related / prefetch_related lookups for exactly the relations
+    `serializer` is going to render, after ?fields= / ?expand= pruning.
+    Nested many relations become Prefetch objects shaped the same way, so a
+    FK under a prefetch is still joined rather than fetched separately.
+    """
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        lookup = prefix + field.source.replace('.', '__')
+
+        if isinstance(field, serializers.ListSerializer):
+            model = getattr(getattr(field.child, 'Meta', None), 'model', None)
+            if model is None:
+                prefetch.append(lookup)
+            else:
+                prefetch.append(Prefetch(lookup, queryset=shape_queryset(model._default_manager.all(), field.child)))
+        elif isinstance(field, serializers.ManyRelatedField):
+            prefetch.append(lookup)
+        elif isinstance(field, serializers.BaseSerializer) and annotations(field):
+            # select_related cannot carry annotations, the related rows get their own query
+            model = field.Meta.model
+            queryset = model._default_manager.only(*rendered_columns(field, model))
+            prefetch.append(Prefetch(lookup, queryset=shape_queryset(queryset, field)))
+        elif isinstance(field, serializers.BaseSerializer):
+            select.append(lookup)
+            nested_select, nested_prefetch = related_lookups(field, lookup + '__')
+            select += nested_select
+            prefetch += nested_prefetch
+    return select, prefetch
+
+
+def rendered_columns(serializer, model):
+    columns = {field.name for field in model._meta.concrete_fields}
+    return [model._meta.pk.name, *(
+        field.source for field in serializer.fields.values() if not field.write_only and field.source in columns
+    )]
+
+
+def annotations(serializer):
+    # serializers rendering values computed in SQL return them from get_annotations()
+    get_annotations = getattr(serializer, 'get_annotations', None)
+    return get_annotations() if get_annotations is not None else {}
+
+
+def shape_queryset(queryset, serializer):
+    if values := annotations(serializer):
+        queryset = queryset.annotate(**values)
+    select, prefetch = related_lookups(serializer)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def product_aliases(queryset):
+    # alias, not annotate: only computed when filtered or ordered on
+    return queryset.alias(rating_average=rating_average())
+
+
+def product_queryset(queryset=None, serializer=None):
+    if queryset is None:
+        queryset = Product.objects.all()
+    return shape_queryset(product_aliases(queryset), serializer or ProductSerializer())
@@ -0,0 +1,55 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramDistance
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, Upper
+from products.models import Product, ProductTag
+
+
+SEARCH_CONFIG = 'english'
+
+
+def product_search_vector():
+    # same weights as the products_product_search_vector trigger
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def product_search_query(terms):
+    return SearchQuery(terms, search_type='websearch', config=SEARCH_CONFIG)
+
+
+def search_products(queryset, terms):
+    query = product_search_query(terms)
+    # ts_rank is a real; as a double it reads back exactly, so a cursor
+    # holding it seeks to the same row
+    return (
+        queryset
+        .filter(search_vector=query)
+        .annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+        .order_by('-rank', '-id')
+    )
+
+
+def _closest(queryset, term, limit, **lookups):
+    # both the filter and ORDER BY UPPER(name) <-> term are answered by the
+    # UPPER(name) gist_trgm_ops index, the ordering as a nearest-neighbour
+    # scan, so it stays cheap however many rows match
+    return list(
+        queryset.alias(upper_name=Upper('name'))
+        .filter(**lookups)
+        .order_by(TrigramDistance('upper_name', term.upper()))
+        .values('id', 'name')[:limit]
+    )
+
+
+def autocomplete(term, limit=10):
+    products = _closest(Product.objects.all(), term, limit, name__icontains=term)
+    tags = _closest(ProductTag.objects.all(), term, limit, name__icontains=term)
+
+    # "did you mean": nothing contains the term, fall back to similar names
+    suggestions = []
+    if not products and not tags:
+        suggestions = _closest(Product.objects.all(), term, limit, upper_name__trigram_similar=term.upper())
+
+    return {'products': products, 'tags': tags, 'suggestions': suggestions}
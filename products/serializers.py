@@ -1,5 +1,16 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.utils import timezone
 from rest_framework import serializers
-from products.models import Review, Product, Cart, ProductTag, ProductImage, FavoriteProduct, CartItem
+from config.utils.dynamic_fields import DynamicFieldsMixin
+from config.utils.response_cache import invalidate_list, invalidate_details
+from products.cart_store import add_item, cart_store_enabled, update_item
+from products.fx import to_base
+from products.models import Review, Product, Cart, ProductTag, ProductImage, FavoriteProduct, CartItem, RATING_COUNT_FIELDS, cart_totals, line_total
 
 class ReviewSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField(write_only=True)
@@ -27,7 +38,21 @@ class ReviewSerializer(serializers.ModelSerializer):
         if existing_reviews.exists():
             raise serializers.ValidationError('you have already reviewed this product')
         
-        return Review.objects.create(product=product, user=user, **validated_data)
+        with transaction.atomic():
+            review = Review.objects.create(product=product, user=user, **validated_data)
+            Product.apply_rating_change(product.id, new_rating=review.rating)
+        return review
+
+    def update(self, instance, validated_data):
+        old_product_id, old_rating = instance.product_id, instance.rating
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+            if instance.product_id != old_product_id:
+                Product.apply_rating_change(old_product_id, old_rating=old_rating)
+                Product.apply_rating_change(instance.product_id, new_rating=instance.rating)
+            else:
+                Product.apply_rating_change(instance.product_id, old_rating, instance.rating)
+        return instance
 
 class ProductTagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -35,8 +60,18 @@ class ProductTagSerializer(serializers.ModelSerializer):
         exclude = ['created_at', 'updated_at']
 
 
-class ProductSerializer(serializers.ModelSerializer):
-    reviews = ReviewSerializer(many=True, read_only=True)
+class ProductImageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductImage
+        fields = ['id', 'image', 'product']
+    
+
+class ProductCategorySerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+
+
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     tag_ids = serializers.PrimaryKeyRelatedField(
         source='tags',
         queryset=ProductTag.objects.all(),
@@ -45,15 +80,27 @@ class ProductSerializer(serializers.ModelSerializer):
     )
 
     tags = ProductTagSerializer(many=True, read_only = True)
+    average_rating = serializers.FloatField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+
     class Meta:
-        exclude = ['created_at', 'updated_at']
+        exclude = ['created_at', 'updated_at', 'search_vector', *RATING_COUNT_FIELDS.values()]
+        read_only_fields = ['review_count', 'rating_sum']
         model = Product
+        # only rendered (and prefetched) when asked for with ?expand= or ?fields=
+        expandable_fields = {
+            'images': (ProductImageSerializer, {'many': True, 'read_only': True}),
+            'reviews': (ReviewSerializer, {'source': 'review_set', 'many': True, 'read_only': True}),
+            'categories': (ProductCategorySerializer, {'many': True, 'read_only': True}),
+        }
 
     
     def create(self, validated_data):
         tags = validated_data.pop("tags", [])
         product = Product.objects.create(**validated_data)
         product.tags.set(tags)
+        # set by the price_in_base trigger
+        product.refresh_from_db(fields=['price_in_base'])
         return product
 
 
@@ -62,8 +109,129 @@ class ProductSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags', None)
         if tags is not None:
             instance.tags.set(tags)
-        return super().update(instance, validated_data)
-    
+        product = super().update(instance, validated_data)
+        product.refresh_from_db(fields=['price_in_base'])
+        return product
+
+
+def _as_pk(value):
+    return int(value) if str(value).isdigit() else None
+
+
+class ProductBulkListSerializer(serializers.ListSerializer):
+    """
+    Validates a batch of products with one tag query (plus the owned products
+    passed in as `instance` for updates) instead of queries per item, and
+    writes it with bulk_create / bulk_update. Errors come back as a list
+    aligned with the input, {} for valid items.
+    """
+
+    def to_internal_value(self, data):
+        tag_ids = set()
+        if isinstance(data, list):
+            for item in data:
+                if isinstance(item, dict) and isinstance(item.get('tag_ids'), list):
+                    tag_ids.update(_as_pk(tag_id) for tag_id in item['tag_ids'])
+        tag_ids.discard(None)
+        self.known_tag_ids = set(ProductTag.objects.filter(id__in=tag_ids).values_list('id', flat=True))
+        self.seen_ids = set()
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        product = None
+        if self.instance is not None:
+            product = self.instance.get(_as_pk(data.get('id'))) if isinstance(data, dict) else None
+            if product is None:
+                raise serializers.ValidationError({'id': ['Product does not exist or is not yours.']})
+            # a second item would add the same tag rows again
+            if product.id in self.seen_ids:
+                raise serializers.ValidationError({'id': ['Product appears more than once in the batch.']})
+            self.seen_ids.add(product.id)
+            self.child.instance = product
+
+        validated = super().run_child_validation(data)
+        missing = [tag_id for tag_id in validated.get('tags', []) if tag_id not in self.known_tag_ids]
+        if missing:
+            raise serializers.ValidationError({
+                'tag_ids': [f'Invalid pk "{tag_id}" - object does not exist.' for tag_id in missing]
+            })
+        if product is not None:
+            validated['id'] = product.id
+        return validated
+
+    def set_tags(self, products, validated_data, replace):
+        through = Product.tags.through
+        changed = [(product, item['tags']) for product, item in zip(products, validated_data) if 'tags' in item]
+        if not changed:
+            return
+        if replace:
+            through.objects.filter(product_id__in=[product.id for product, _ in changed]).delete()
+        through.objects.bulk_create([
+            through(product_id=product.id, producttag_id=tag_id)
+            for product, tag_ids in changed
+            for tag_id in dict.fromkeys(tag_ids)
+        ])
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        products = Product.objects.bulk_create([
+            Product(user=user, **{field: value for field, value in item.items() if field != 'tags'})
+            for item in validated_data
+        ])
+        self.set_tags(products, validated_data, replace=False)
+        # bulk writes skip the model signals
+        transaction.on_commit(lambda: invalidate_list('products'))
+        return products
+
+    def update(self, instance, validated_data):
+        now = timezone.now()
+        products, fields = [], {'updated_at'}
+        for item in validated_data:
+            product = instance[item['id']]
+            for field, value in item.items():
+                if field not in ('id', 'tags'):
+                    setattr(product, field, value)
+                    fields.add(field)
+            product.updated_at = now
+            products.append(product)
+
+        Product.objects.bulk_update(products, sorted(fields))
+        self.set_tags(products, validated_data, replace=True)
+        product_ids = [product.id for product in products]
+        transaction.on_commit(lambda: invalidate_details('products', product_ids))
+        return products
+
+
+class ProductBulkSerializer(ProductSerializer):
+    # checked against one query for the whole batch by ProductBulkListSerializer
+    tag_ids = serializers.ListField(child=serializers.IntegerField(), source='tags', write_only=True)
+
+    class Meta(ProductSerializer.Meta):
+        read_only_fields = [*ProductSerializer.Meta.read_only_fields, 'user']
+        list_serializer_class = ProductBulkListSerializer
+
+
+class ProductBulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_ids(self, value):
+        # read per request, not when the module is imported
+        if len(value) > settings.PRODUCT_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {settings.PRODUCT_BULK_MAX_ITEMS} elements.'
+            )
+        owned = set(
+            Product.objects.filter(user=self.context['request'].user, id__in=value).values_list('id', flat=True)
+        )
+        errors = {
+            index: ['Product does not exist or is not yours.']
+            for index, pk in enumerate(value)
+            if pk not in owned
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        return list(dict.fromkeys(value))
+
 
 class FavoriteProductSerializer(serializers.ModelSerializer):
     user = serializers.HiddenField(default=serializers.CurrentUserDefault())
@@ -96,14 +264,39 @@ class FavoriteProductSerializer(serializers.ModelSerializer):
     #ამოწმებს პროდუქტი არსებობს თუ არა მონაცემთა ბაზაში
 
 
-class ProductImageSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ProductImage
-        fields = ['id', 'image', 'product']
-    
 
-class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class ProductSummarySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """
+    What a cart line shows of its product. The first image comes from a
+    subquery, so the summaries of a whole cart are one query.
+    """
+    price_currency = serializers.CharField(source='currency', read_only=True)
+    primary_image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'price_currency', 'primary_image']
+
+    def get_annotations(self):
+        if 'primary_image' not in self.fields:
+            return {}
+        first = ProductImage.objects.filter(product=OuterRef('pk')).order_by('id').values('image')[:1]
+        return {'primary_image_path': Subquery(first)}
+
+    def get_primary_image(self, obj):
+        if hasattr(obj, 'primary_image_path'):
+            path = obj.primary_image_path
+        else:
+            path = obj.images.order_by('id').values_list('image', flat=True).first()
+        if not path:
+            return None
+        url = default_storage.url(path)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request is not None else url
+
+
+class CartItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    product = ProductSummarySerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
         queryset=Product.objects.all(),
         write_only=True,
@@ -122,12 +315,19 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 
+    def get_annotations(self):
+        return {'line_total': line_total()} if 'total_price' in self.fields else {}
+
     def get_total_price(self, obj):
+        if hasattr(obj, 'line_total'):
+            return obj.line_total
         return obj.total_price()
     
     def create(self, validated_data):
         product = validated_data.get('product')
         user = self.context['request'].user
+        if cart_store_enabled():
+            return add_item(user, product, validated_data.get('quantity', 1))
         cart, created = Cart.objects.get_or_create(user=user)
         validated_data['cart'] = cart
         validated_data['price_at_time_of_addition'] = product.price
@@ -135,22 +335,44 @@ class CartItemSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
     
     def update(self, instance, validated_data):
-        quantity = validated_data.pop('quantity', None)
-        instance.quantity = quantity
+        # a PATCH without quantity keeps it
+        instance.quantity = validated_data.pop('quantity', instance.quantity)
+        if cart_store_enabled():
+            return update_item(self.context['request'].user, instance)
         instance.save()
+        # annotated before the new quantity
+        vars(instance).pop('line_total', None)
         return instance
     
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = serializers.HiddenField(default = serializers.CurrentUserDefault())
     items = CartItemSerializer(many=True, read_only=True)
     total = serializers.SerializerMethodField()
+    totals = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'items', 'total']
+        fields = ['id', 'user', 'items', 'total', 'totals']
 
     
+    def get_annotations(self):
+        return {'items_totals': cart_totals()} if {'total', 'totals'} & set(self.fields) else {}
+
+    def currency_totals(self, obj):
+        if hasattr(obj, 'items_totals'):
+            return {row['currency']: Decimal(row['total']) for row in obj.items_totals}
+        rows = obj.items.order_by('product__currency').values('product__currency').annotate(total=Sum(line_total()))
+        return {row['product__currency']: row['total'] for row in rows}
+
     def get_total(self, obj):
-        return sum(item.total_price() for item in obj.items.all())
\ No newline at end of file
+        # in settings.BASE_CURRENCY at the current FX rates, None while a currency has no rate
+        amounts = [to_base(amount, currency) for currency, amount in self.currency_totals(obj).items()]
+        if None in amounts:
+            return None
+        return sum(amounts, Decimal('0.00'))
+
+    def get_totals(self, obj):
+        # {currency: total}, one entry per currency in the cart
+        return self.currency_totals(obj)
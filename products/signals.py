@@ -0,0 +1,81 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from categories.models import Category
+from config.utils.response_cache import invalidate_details, invalidate_all
+from products.models import Product, ProductTag, ProductImage, Review, FxRate
+from products.fx import invalidate_rates
+from products.tasks import recompute_prices_in_base
+
+
+# invalidations run on commit, otherwise a concurrent request could cache the
+# old rows under the new generation
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate_details('products', [pk]))
+
+
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_product_of(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: invalidate_details('products', [product_id]))
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def invalidate_product_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # tag.products changed, pk_set holds product ids (None on clear)
+        if pk_set is None:
+            transaction.on_commit(lambda: invalidate_all('products'))
+        else:
+            product_ids = list(pk_set)
+            transaction.on_commit(lambda: invalidate_details('products', product_ids))
+    else:
+        pk = instance.pk
+        transaction.on_commit(lambda: invalidate_details('products', [pk]))
+
+
+@receiver([post_save, post_delete], sender=ProductTag)
+def invalidate_tag(sender, instance, **kwargs):
+    # tags are rendered inside every product that has them
+    transaction.on_commit(lambda: invalidate_all('products'))
+
+
+@receiver(m2m_changed, sender=Category.products.through)
+def invalidate_category_products(sender, instance, action, reverse, pk_set, **kwargs):
+    # ?expand=categories renders membership inside the product
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # product.categories changed
+        pk = instance.pk
+        transaction.on_commit(lambda: invalidate_details('products', [pk]))
+    elif pk_set is None:
+        # category.products cleared, the ids are gone
+        transaction.on_commit(lambda: invalidate_all('products'))
+    else:
+        product_ids = list(pk_set)
+        transaction.on_commit(lambda: invalidate_details('products', product_ids))
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category(sender, instance, **kwargs):
+    # category names are rendered inside every product in them
+    transaction.on_commit(lambda: invalidate_all('products'))
+
+
+@receiver([post_save, post_delete], sender=FxRate)
+def recompute_prices(sender, instance, **kwargs):
+    currency = instance.currency
+
+    def on_commit():
+        invalidate_rates()
+        recompute_prices_in_base.delay(currency)
+
+    transaction.on_commit(on_commit)
@@ -0,0 +1,49 @@
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, Min, Value
+from django.db.models.functions import Now, Round
+from config.utils.response_cache import invalidate_all
+from products import cart_store
+from products.models import FxRate, Product
+
+
+@shared_task
+def recompute_prices_in_base(currency=None, batch_size=None):
+    """
+    Recomputes Product.price_in_base after an FX rate change, one UPDATE per
+    id range so no single statement locks the whole table. Keep the
+    conversion in sync with the products_product_price_in_base trigger.
+    """
+    batch_size = batch_size or getattr(settings, 'PRICE_RECOMPUTE_BATCH_SIZE', 10000)
+    rates = dict(FxRate.objects.values_list('currency', 'rate'))
+    currencies = [currency] if currency else list(Product.objects.values_list('currency', flat=True).distinct().order_by())
+
+    updated = 0
+    for code in currencies:
+        products = Product.objects.filter(currency=code)
+        rate = rates.get(code)
+        if rate is None:
+            price_in_base = Value(None, output_field=DecimalField())
+        else:
+            price_in_base = Round(F('price') * Value(rate, output_field=DecimalField()), 2)
+
+        bounds = products.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            continue
+        for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+            with transaction.atomic():
+                updated += products.filter(id__gte=start, id__lt=start + batch_size).update(
+                    price_in_base=price_in_base, updated_at=Now(),
+                )
+
+    transaction.on_commit(lambda: invalidate_all('products'))
+    return updated
+
+
+@shared_task
+def flush_carts():
+    # on the beat schedule; nothing to do unless the cart store is on
+    if not cart_store.cart_store_enabled():
+        return 0
+    return cart_store.flush_carts()
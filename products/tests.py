@@ -1,3 +1,1923 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+import psycopg2
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count, F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import http_date
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from rest_framework import status
+from rest_framework.throttling import SimpleRateThrottle
+from rest_framework_simplejwt.tokens import RefreshToken
+from config.utils.query_budget import QueryBudgetMixin
+from config.utils.query_inspector import fingerprint, inspect_queries
+from config.utils.profiler import make_token
+from config.utils.db_router import ReplicaRouter, reset_lag_checks
+from config.utils.db_pool import ConnectionPool, PoolTimeout
+from config.utils.response_cache import response_cache_stats
+from config.utils.test_runner import TEST_REDIS_DBS
+from products.benchmark import parse_mix, percentile
+from prometheus_client import REGISTRY
+from products.models import Product, ProductTag, ProductImage, Cart, CartItem, Review, FxRate
+from products.serializers import CartSerializer, ProductSerializer
+from products import cart_store
+from products.fx import get_rates
+from products.tasks import flush_carts, recompute_prices_in_base
+from products.views import TagViewSet
+from categories.models import Category
 
-# Create your tests here.
+User = get_user_model()
+
+
+class ProductTestMixin:
+    def setUp(self):
+        super().setUp()
+        # cached responses from earlier tests would otherwise leak in; the
+        # test runner points the cache at a database of its own
+        cache.clear()
+
+    def create_user(self, email='owner@example.com', username='owner', phone_number='555'):
+        return User.objects.create_user(
+            username=username,
+            email=email,
+            phone_number=phone_number,
+            password='password123',
+        )
+
+    def create_products(self, count, user=None, tags=None):
+        tags = tags if tags is not None else []
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'product {index}',
+                description=f'description {index}',
+                price=index + 1,
+                user=user,
+            )
+            for index in range(count)
+        ])
+        for product in products:
+            product.tags.set(tags)
+        return products
+
+
+class ProductQueryBudgetTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+
+        self.tags = [ProductTag.objects.create(name=f'tag {index}') for index in range(3)]
+        self.products = self.create_products(30, user=self.user, tags=self.tags)
+
+    def test_product_list(self):
+        url = reverse('product-list')
+
+        def request(page_size):
+            response = self.client.get(url, {'page_size': page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results'][0]['tags']), 3)
+            return response
+
+        # validators, tag validator, count, products, tags
+        self.assertQueryBudgetForSizes(5, request, [1, 10, 30])
+
+    def test_product_detail(self):
+        url = reverse('product-detail', args=[self.products[0].id])
+        response = self.assertQueryBudget(4, self.client.get, url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_my_products(self):
+        url = reverse('product-my-products')
+
+        def request(page_size):
+            response = self.client.get(url, {'page_size': page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response
+
+        self.assertQueryBudgetForSizes(3, request, [1, 10, 30])
+
+    def test_cart_items_and_cart(self):
+        cart = Cart.objects.get(user=self.user)
+        url = reverse('cart-items-list')
+        # cached between rate changes
+        get_rates()
+
+        for start, end in [(0, 1), (1, 10), (10, 30)]:
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, price_at_time_of_addition=product.price)
+                for product in self.products[start:end]
+            ])
+            with self.subTest(items=end):
+                # validators, items with line totals, product summaries
+                response = self.assertQueryBudget(3, self.client.get, url)
+                self.assertEqual(len(response.data), end)
+
+        # validators, carts with totals, items, product summaries
+        response = self.assertQueryBudget(4, self.client.get, reverse('cart-list'))
+        self.assertEqual(len(response.data[0]['items']), 30)
+
+
+class CursorPaginationTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.products = self.create_products(25, user=self.user)
+
+    def collect_pages(self, url, params):
+        response = self.client.get(url, params)
+        results = list(response.data['results'])
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            results += response.data['results']
+        return response, results
+
+    def test_cursor_mode_is_opt_in(self):
+        response = self.client.get(reverse('product-list'))
+        self.assertIn('count', response.data)
+
+        response = self.client.get(reverse('product-list'), {'pagination': 'cursor'})
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+
+    def test_price_ordering_with_price_filter(self):
+        params = {'pagination': 'cursor', 'ordering': '-price', 'price_min': 6, 'page_size': 4}
+        _, results = self.collect_pages(reverse('product-list'), params)
+
+        prices = [product['price'] for product in results]
+        self.assertEqual(prices, [float(price) for price in range(25, 5, -1)])
+
+    def test_page_does_not_count(self):
+        params = {'pagination': 'cursor', 'ordering': 'created_at', 'page_size': 5}
+        first_page = self.client.get(reverse('product-list'), params)
+
+        # products, tags
+        response = self.assertQueryBudget(2, self.client.get, first_page.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['id'], self.products[5].id)
+
+    def test_ties_are_sought_not_offset(self):
+        Product.objects.filter(id__in=[product.id for product in self.products[:6]]).update(price=0)
+        params = {'pagination': 'cursor', 'ordering': 'price', 'page_size': 2}
+        first_page = self.client.get(reverse('product-list'), params)
+        with CaptureQueriesContext(connections['default']) as queries:
+            second_page = self.client.get(first_page.data['next'])
+        self.assertFalse([query for query in queries if 'OFFSET' in query['sql']])
+
+        _, results = self.collect_pages(reverse('product-list'), params)
+        ids = [product['id'] for product in results]
+        self.assertEqual(len(ids), 25)
+        # the six tied at the lowest price, in id order
+        self.assertEqual(ids[:6], [product.id for product in self.products[:6]])
+
+        previous = self.client.get(second_page.data['previous'])
+        self.assertEqual(previous.data['results'], first_page.data['results'])
+
+    def test_null_prices_come_last(self):
+        FxRate.objects.filter(currency='euro').delete()
+        unpriced = Product.objects.bulk_create([
+            Product(name=f'unpriced {index}', description='-', price=1, currency='euro', user=self.user) for index in range(3)
+        ])
+        self.assertIsNone(Product.objects.get(id=unpriced[0].id).price_in_base)
+        unpriced_ids = [product.id for product in unpriced]
+
+        for ordering, expected in [('price', unpriced_ids), ('-price', unpriced_ids[::-1])]:
+            with self.subTest(ordering=ordering):
+                # pages end inside the NULLs and on the way into them
+                params = {'pagination': 'cursor', 'ordering': ordering, 'page_size': 2}
+                response, results = self.collect_pages(reverse('product-list'), params)
+                self.assertEqual(len(results), 28)
+                self.assertEqual([product['id'] for product in results[-3:]], expected)
+
+                # and back again
+                back = []
+                while response.data['previous']:
+                    response = self.client.get(response.data['previous'])
+                    back = response.data['results'] + back
+                self.assertEqual(back, results[:len(back)])
+                self.assertEqual(len(back), 26)
+
+                pages = self.client.get(reverse('product-list'), {'ordering': ordering, 'page': 3})
+                self.assertEqual([product['id'] for product in pages.data['results'][-3:]], expected)
+
+    def test_unsupported_ordering(self):
+        response = self.client.get(reverse('product-list'), {'pagination': 'cursor', 'ordering': 'review_count'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ordering', response.data)
+        # page numbers still take every OrderingFilter field
+        response = self.client.get(reverse('product-list'), {'ordering': 'review_count'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('product-list'), {'pagination': 'cursor', 'cursor': 'cD1ub3Rqc29u'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_my_products_cursor(self):
+        self.create_products(3)
+        _, results = self.collect_pages(reverse('product-my-products'), {'pagination': 'cursor', 'page_size': 10})
+        self.assertEqual(len(results), 25)
+
+    def test_review_cursor(self):
+        product = self.products[0]
+        for index in range(5):
+            user = self.create_user(f'reviewer{index}@example.com', f'reviewer{index}', f'600{index}')
+            Review.objects.create(product=product, user=user, content='content', rating=index + 1)
+
+        url = reverse('product-reviews-list', args=[product.id])
+        self.assertEqual(len(self.client.get(url).data), 5)
+
+        _, results = self.collect_pages(url, {'pagination': 'cursor', 'ordering': 'created_at', 'page_size': 2})
+        self.assertEqual([review['rating'] for review in results], [1, 2, 3, 4, 5])
+
+
+class FullTextSearchTest(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+
+        self.in_description = Product.objects.create(
+            name='speaker', description='a bluetooth speaker that pairs with any phone', price=40,
+        )
+        self.in_name = Product.objects.create(
+            name='android phone', description='unlocked, 128GB', price=300, user=self.user,
+        )
+        Product.objects.create(name='garden chair', description='wooden', price=60)
+
+    def search(self, **params):
+        response = self.client.get(reverse('product-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product['id'] for product in response.data['results']]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search(q='phones'), [self.in_name.id, self.in_description.id])
+
+    def test_cursor_pages_keep_rank_order(self):
+        tied = Product.objects.bulk_create([
+            Product(name='case', description='a phone case', price=10) for _ in range(3)
+        ])
+        expected = self.search(q='phone', page_size=10)
+        self.assertEqual(expected[0], self.in_name.id)
+        self.assertEqual(set(expected), {self.in_name.id, self.in_description.id, *(product.id for product in tied)})
+
+        response = self.client.get(reverse('product-list'), {'q': 'phone', 'pagination': 'cursor', 'page_size': 2})
+        first_page = response.data['results']
+        ids = [product['id'] for product in first_page]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [product['id'] for product in response.data['results']]
+        self.assertEqual(ids, expected)
+
+        second_page = self.client.get(self.client.get(
+            reverse('product-list'), {'q': 'phone', 'pagination': 'cursor', 'page_size': 2}
+        ).data['next'])
+        self.assertEqual(self.client.get(second_page.data['previous']).data['results'], first_page)
+
+    def test_combines_with_filters(self):
+        self.assertEqual(self.search(q='phone', price_max=100), [self.in_description.id])
+
+    def test_vector_follows_updates(self):
+        response = self.client.patch(
+            reverse('product-detail', args=[self.in_name.id]), {'name': 'tablet'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.search(q='phone'), [self.in_description.id])
+        self.assertEqual(self.search(q='tablet'), [self.in_name.id])
+
+    def test_backfill_command(self):
+        Product.objects.update(search_vector=None)
+        self.assertEqual(self.search(q='chair'), [])
+
+        call_command('backfill_search_vectors', batch_size=2, stdout=StringIO())
+        self.assertEqual(len(self.search(q='chair')), 1)
+        self.assertFalse(Product.objects.filter(search_vector__isnull=True).exists())
+
+
+class AutocompleteTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('product-autocomplete')
+
+        self.headphones = Product.objects.create(name='Wireless Headphones', description='-', price=90)
+        self.phone = Product.objects.create(name='Phone case', description='-', price=10)
+        self.tag = ProductTag.objects.create(name='headphones')
+
+    def test_returns_ids_and_names_only(self):
+        # products, tags
+        response = self.assertQueryBudget(2, self.client.get, self.url, {'q': 'headph'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['products'], [{'id': self.headphones.id, 'name': 'Wireless Headphones'}])
+        self.assertEqual(response.data['tags'], [{'id': self.tag.id, 'name': 'headphones'}])
+        self.assertEqual(response.data['suggestions'], [])
+
+    def test_did_you_mean(self):
+        response = self.client.get(self.url, {'q': 'wirless headphnes'})
+        self.assertEqual(response.data['products'], [])
+        self.assertEqual(response.data['suggestions'][0]['id'], self.headphones.id)
+
+    def test_short_term(self):
+        response = self.assertQueryBudget(0, self.client.get, self.url, {'q': 'h'})
+        self.assertEqual(response.data['products'], [])
+
+
+class RatingAggregatesTest(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.product, self.other = self.create_products(2)
+        self.reviews_url = reverse('product-reviews-list', args=[self.product.id])
+
+    def review(self, rating, product=None):
+        product = product or self.product
+        user = self.create_user(f'r{rating}{product.id}@example.com', f'r{rating}{product.id}', f'7{rating}{product.id}')
+        return Review.objects.create(product=product, user=user, content='-', rating=rating)
+
+    def test_review_writes_update_aggregates(self):
+        response = self.client.post(
+            self.reviews_url, {'product_id': self.product.id, 'content': 'ok', 'rating': 4}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        review = Review.objects.get(user=self.user)
+
+        self.client.patch(
+            reverse('product-reviews-detail', args=[self.product.id, review.id]), {'rating': 2}, format='json'
+        )
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (1, 2))
+        self.assertEqual(self.product.rating_histogram(), {1: 0, 2: 1, 3: 0, 4: 0, 5: 0})
+
+        self.client.delete(reverse('product-reviews-detail', args=[self.product.id, review.id]))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_sum), (0, 0))
+        self.assertIsNone(self.product.average_rating())
+
+    def test_saves_keep_aggregates(self):
+        loaded = Product.objects.get(id=self.product.id)
+        Product.apply_rating_change(self.product.id, new_rating=5)
+        loaded.name = 'renamed'
+        loaded.save()
+
+        serializer = ProductSerializer(loaded, data={'price': 3}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.price), ('renamed', 3))
+        self.assertEqual((self.product.review_count, self.product.rating_sum, self.product.rating_5_count), (1, 5, 1))
+
+    def test_serialized_sorted_and_filtered(self):
+        for rating in (5, 4):
+            Product.apply_rating_change(self.product.id, new_rating=rating)
+        Product.apply_rating_change(self.other.id, new_rating=3)
+
+        response = self.client.get(reverse('product-list'), {'ordering': '-rating_average'})
+        first = response.data['results'][0]
+        self.assertEqual(first['id'], self.product.id)
+        self.assertEqual(first['average_rating'], 4.5)
+        self.assertEqual(first['rating_histogram'], {'1': 0, '2': 0, '3': 0, '4': 1, '5': 1})
+
+        response = self.client.get(reverse('product-list'), {'rating_max': 3.5})
+        self.assertEqual([product['id'] for product in response.data['results']], [self.other.id])
+
+    def test_reconcile_repairs_drift(self):
+        self.review(5)
+        self.review(1)
+        self.review(3, product=self.other)
+        Product.objects.filter(id=self.other.id).update(review_count=7, rating_sum=1)
+
+        out = StringIO()
+        call_command('reconcile_ratings', batch_size=1, stdout=out)
+        self.assertIn('2 of 2', out.getvalue())
+
+        self.product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.product.review_count, self.product.rating_sum, self.product.rating_1_count), (2, 6, 1))
+        self.assertEqual((self.other.review_count, self.other.rating_sum, self.other.rating_3_count), (1, 3, 1))
+
+
+class ResponseCacheTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.tag = ProductTag.objects.create(name='sale')
+        self.product, self.other = self.create_products(2, user=self.user, tags=[self.tag])
+        self.list_url = reverse('product-list')
+        self.detail_url = reverse('product-detail', args=[self.product.id])
+
+    def test_hit_skips_database(self):
+        first = self.client.get(self.list_url, {'page': 1, 'price_min': ''})
+        self.assertEqual(first['X-Cache'], 'MISS')
+
+        # only the ETag validators
+        second = self.assertQueryBudget(2, self.client.get, self.list_url, {'price_min': '', 'page': 1})
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+
+        self.assertEqual(self.client.get(self.list_url, {'page_size': 1})['X-Cache'], 'MISS')
+        self.assertEqual(response_cache_stats()['product.list'], {'hits': 1, 'misses': 2})
+
+    def test_product_update_invalidates(self):
+        self.client.get(self.list_url)
+        self.client.get(self.detail_url)
+        other_detail = reverse('product-detail', args=[self.other.id])
+        self.client.get(other_detail)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.detail_url, {'name': 'renamed'}, format='json')
+
+        self.assertEqual(self.client.get(self.detail_url).data['name'], 'renamed')
+        self.assertEqual(self.client.get(self.list_url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(other_detail)['X-Cache'], 'HIT')
+
+    def test_review_and_tag_writes_invalidate(self):
+        self.client.get(self.detail_url)
+        reviewer = self.create_user('reviewer@example.com', 'reviewer', '999')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(product=self.product, user=reviewer, content='-', rating=5)
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'MISS')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'clearance'
+            self.tag.save()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['tags'][0]['name'], 'clearance')
+
+    def test_category_writes_invalidate(self):
+        params = {'expand': 'categories'}
+        self.client.get(self.detail_url, params)
+        category = Category.objects.create(name='audio')
+        with self.captureOnCommitCallbacks(execute=True):
+            category.products.add(self.product)
+        response = self.client.get(self.detail_url, params)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['categories'], [{'id': category.id, 'name': 'audio'}])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.categories.clear()
+        self.assertEqual(self.client.get(self.detail_url, params).data['categories'], [])
+
+        category.products.add(self.product)
+        self.client.get(self.detail_url, params)
+        with self.captureOnCommitCallbacks(execute=True):
+            category.name = 'sound'
+            category.save()
+        self.assertEqual(self.client.get(self.detail_url, params).data['categories'][0]['name'], 'sound')
+
+    @override_settings(RESPONSE_CACHE_ENDPOINTS={'product.list': True})
+    def test_endpoint_switch(self):
+        self.client.get(self.detail_url)
+        response = self.client.get(self.detail_url)
+        self.assertFalse(response.has_header('X-Cache'))
+
+
+class ConditionalGetTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.tag = ProductTag.objects.create(name='sale')
+        self.product, self.other = self.create_products(2, user=self.user, tags=[self.tag])
+
+    def test_product_detail_not_modified(self):
+        url = reverse('product-detail', args=[self.product.id])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        # validators only, nothing is serialized
+        not_modified = self.assertQueryBudget(2, self.client.get, url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # no Last-Modified to compare with
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        Product.apply_rating_change(self.product.id, new_rating=5)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_list_and_tags_change_etag(self):
+        url = reverse('product-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.tag.name = 'clearance'
+        self.tag.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        tags_url = reverse('producttag-list')
+        etag = self.client.get(tags_url)['ETag']
+        self.assertEqual(self.client.get(tags_url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(RESPONSE_CACHE_ENDPOINTS={})
+    def test_expanded_relations_change_etag(self):
+        url = reverse('product-detail', args=[self.product.id])
+        reviewer = self.create_user('reviewer@example.com', 'reviewer', '999')
+        review = Review.objects.create(product=self.product, user=reviewer, content='-', rating=5)
+        category = Category.objects.create(name='audio')
+        writes = {
+            'images': lambda: ProductImage.objects.bulk_create([ProductImage(product=self.product, image='products/new.webp')]),
+            'reviews': lambda: setattr(review, 'content', 'edited') or review.save(),
+            'categories': lambda: category.products.add(self.product),
+        }
+        for expand, write in writes.items():
+            with self.subTest(expand=expand):
+                etag = self.client.get(url, {'expand': expand})['ETag']
+                response = self.client.get(url, {'expand': expand}, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+                write()
+                response = self.client.get(url, {'expand': expand}, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cart_etag_follows_items(self):
+        url = reverse('cart-list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.post(
+            reverse('cart-items-list'), {'product_id': self.product.id, 'quantity': 2}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        item_url = reverse('cart-items-detail', args=[response.data[0]['items'][0]['id']])
+        self.client.patch(item_url, {'quantity': 3}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_cart_item_delete_changes_validators(self):
+        cart = Cart.objects.get(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, price_at_time_of_addition=product.price) for product in (self.product, self.other)
+        ])
+        url = reverse('cart-list')
+        response = self.client.get(url)
+        # the newest item stays, so Max(updated_at) does not move
+        CartItem.objects.filter(product=self.product).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date()).status_code, status.HTTP_200_OK)
+
+    def test_cursor_pages_have_no_validators(self):
+        response = self.client.get(reverse('product-list'), {'pagination': 'cursor'})
+        self.assertFalse(response.has_header('ETag'))
+
+
+class SparseFieldsTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.tag = ProductTag.objects.create(name='sale')
+        self.products = self.create_products(20, user=self.user, tags=[self.tag])
+        self.product = self.products[0]
+
+    def test_fields_skip_unrequested_relations(self):
+        def request(page_size):
+            response = self.client.get(reverse('product-list'), {'fields': 'id,name,price', 'page_size': page_size})
+            self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'price'})
+            return response
+
+        # validators, tag validator, count, products - no tags query
+        self.assertQueryBudgetForSizes(4, request, [1, 20])
+
+    def test_expand(self):
+        ProductImage.objects.bulk_create([ProductImage(product=self.product, image='products/i.webp')])
+        Category.objects.create(name='games').products.add(self.product)
+        Review.objects.create(product=self.product, user=self.user, content='great', rating=5)
+
+        url = reverse('product-detail', args=[self.product.id])
+        # validators, tag validator, product, tags, images, reviews, categories
+        response = self.assertQueryBudget(7, self.client.get, url, {'expand': 'images,reviews,categories'})
+        self.assertEqual(len(response.data['images']), 1)
+        self.assertEqual(response.data['reviews'], [{'content': 'great', 'rating': 5}])
+        self.assertEqual(response.data['categories'][0]['name'], 'games')
+
+        response = self.client.get(url, {'fields': 'id,images'})
+        self.assertEqual(set(response.data), {'id', 'images'})
+        self.assertNotIn('images', self.client.get(url).data)
+
+    def test_nested_fields_in_cart_items(self):
+        cart = Cart.objects.get(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, price_at_time_of_addition=product.price)
+            for product in self.products
+        ])
+        # validators, items with products - no tags query
+        response = self.assertQueryBudget(
+            2, self.client.get, reverse('cart-items-list'), {'fields': 'id,quantity,product.id,product.name'}
+        )
+        self.assertEqual(response.data[0]['product'], {'id': self.product.id, 'name': self.product.name})
+        self.assertEqual(set(response.data[0]), {'id', 'quantity', 'product'})
+
+    def test_writes_ignore_fields(self):
+        response = self.client.post(
+            reverse('product-list') + '?fields=id',
+            {'name': 'new', 'description': '-', 'price': 5, 'tag_ids': [self.tag.id]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Product.objects.get(name='new').tags.get(), self.tag)
+
+
+class FacetsTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.sale = ProductTag.objects.create(name='sale')
+        self.new = ProductTag.objects.create(name='new')
+        # prices 1..60
+        self.products = self.create_products(60, user=self.user, tags=[self.sale])
+        for product in self.products[:10]:
+            product.tags.add(self.new)
+        Category.objects.create(name='games').products.add(*self.products[:5])
+        Product.objects.filter(pk__in=[product.pk for product in self.products[:3]]).update(currency='usd')
+        self.url = reverse('product-facets')
+
+    def test_counts(self):
+        # tags, categories, currencies, price histogram
+        response = self.assertQueryBudget(4, self.client.get, self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(tag['name'], tag['count']) for tag in response.data['tags']],
+            [('sale', 60), ('new', 10)],
+        )
+        self.assertEqual(response.data['categories'][0]['count'], 5)
+        currencies = {row['currency']: row['count'] for row in response.data['currencies']}
+        self.assertEqual(currencies, {'gel': 57, 'usd': 3, 'euro': 0})
+        self.assertEqual(
+            [bucket['count'] for bucket in response.data['price']],
+            [49, 11, 0, 0, 0, 0],
+        )
+
+    def test_follows_filters(self):
+        # 4 and 5 GEL, and 1 USD; 2 and 3 USD are above 5 GEL
+        response = self.client.get(self.url, {'price_max': 5, 'tags': self.new.id})
+        self.assertEqual(
+            [(tag['name'], tag['count']) for tag in response.data['tags']],
+            [('new', 3), ('sale', 3)],
+        )
+        self.assertEqual(response.data['price'][0]['count'], 3)
+
+    def test_cached_until_products_change(self):
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        response = self.assertQueryBudget(0, self.client.get, self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('product-list'),
+                {'name': 'new one', 'description': '-', 'price': 500, 'tag_ids': [self.new.id]},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['price'][4]['count'], 1)
+
+
+class OrderingTest(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.products = self.create_products(6, user=self.user)
+        Product.objects.filter(pk__in=[product.pk for product in self.products[:3]]).update(price=1)
+        self.url = reverse('product-list')
+
+    def ids(self, params):
+        return [product['id'] for product in self.client.get(self.url, {**params, 'fields': 'id'}).data['results']]
+
+    def test_ties_broken_by_id(self):
+        ids = [product.id for product in self.products]
+        self.assertEqual(self.ids({'ordering': 'price'}), ids)
+        self.assertEqual(self.ids({'ordering': '-price'}), ids[::-1])
+        self.assertEqual(self.ids({}), ids[::-1])
+
+    def test_name_and_currency(self):
+        Product.objects.filter(pk=self.products[4].pk).update(name='a first', currency='usd')
+        self.assertEqual(self.ids({'ordering': 'name'})[0], self.products[4].id)
+        self.assertEqual(self.ids({'currency': 'usd'}), [self.products[4].id])
+
+    def test_search_rank_kept_without_ordering(self):
+        Product.objects.filter(pk=self.products[0].pk).update(name='garden chair')
+        Product.objects.filter(pk=self.products[1].pk).update(description='for the garden')
+        self.assertEqual(self.ids({'q': 'garden'}), [self.products[0].id, self.products[1].id])
+        self.assertEqual(self.ids({'q': 'garden', 'ordering': '-price'}), [self.products[1].id, self.products[0].id])
+
+    def test_every_combination_has_an_index(self):
+        Category.objects.create(name='games').products.add(*self.products)
+        self.products[0].tags.add(ProductTag.objects.create(name='sale'))
+        out = StringIO()
+        call_command('benchmark_indexes', '--force-index', '--check', '--repeat', '1', stdout=out)
+        self.assertIn('my_products', out.getvalue())
+
+
+class BaseCurrencyPriceTest(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        # seeded rates: 1 USD = 2.70 GEL, 1 EUR = 2.95 GEL
+        self.gel = Product.objects.create(name='gel', description='-', price=Decimal('10.00'))
+        self.usd = Product.objects.create(name='usd', description='-', price=Decimal('5.00'), currency='usd')
+        self.euro = Product.objects.create(name='euro', description='-', price=Decimal('3.00'), currency='euro')
+        self.url = reverse('product-list')
+
+    def names(self, params):
+        return [product['name'] for product in self.client.get(self.url, params).data['results']]
+
+    def test_trigger_converts_on_write(self):
+        self.usd.refresh_from_db()
+        self.assertEqual(self.usd.price_in_base, Decimal('13.50'))
+
+        Product.objects.filter(pk=self.usd.pk).update(currency='euro')
+        self.usd.refresh_from_db()
+        self.assertEqual(self.usd.price_in_base, Decimal('14.75'))
+
+    def test_writes_answer_the_converted_price(self):
+        response = self.client.post(
+            self.url, {'name': 'new', 'description': '-', 'price': 10, 'currency': 'usd', 'tag_ids': [], 'user': self.user.id},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Decimal(str(response.data['price_in_base'])), Decimal('27.00'))
+
+        url = reverse('product-detail', args=[response.data['id']])
+        response = self.client.patch(url, {'price': 20, 'currency': 'euro'}, format='json')
+        self.assertEqual(Decimal(str(response.data['price_in_base'])), Decimal('59.00'))
+
+    def test_filter_and_order_across_currencies(self):
+        self.assertEqual(self.names({'ordering': 'price'}), ['euro', 'gel', 'usd'])
+        self.assertEqual(self.names({'price_min': 8, 'price_max': 10, 'ordering': 'price'}), ['euro', 'gel'])
+        # 4 USD = 10.80 GEL
+        self.assertEqual(self.names({'price_min': 4, 'price_currency': 'usd', 'ordering': 'price'}), ['usd'])
+
+    def test_rate_change_recomputes_in_bulk(self):
+        with mock.patch('products.signals.recompute_prices_in_base.delay', side_effect=recompute_prices_in_base) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                FxRate.objects.filter(currency='usd').update(rate=Decimal('3'))
+                FxRate.objects.get(currency='usd').save()
+        delay.assert_called_once_with('usd')
+
+        self.usd.refresh_from_db()
+        self.gel.refresh_from_db()
+        self.assertEqual(self.usd.price_in_base, Decimal('15.00'))
+        self.assertEqual(self.gel.price_in_base, Decimal('10.00'))
+        self.assertEqual(self.names({'ordering': '-price'}), ['usd', 'gel', 'euro'])
+
+    def test_recompute_in_batches(self):
+        Product.objects.bulk_create([
+            Product(name=f'bulk {index}', description='-', price=1, currency='usd') for index in range(5)
+        ])
+        FxRate.objects.filter(currency='usd').update(rate=2)
+        self.assertEqual(recompute_prices_in_base(batch_size=2), 8)
+        self.assertFalse(Product.objects.filter(currency='usd').exclude(price_in_base=F('price') * 2).exists())
+
+
+class BulkProductTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.sale = ProductTag.objects.create(name='sale')
+        self.new = ProductTag.objects.create(name='new')
+        self.url = reverse('product-bulk')
+
+    def items(self, count):
+        return [
+            {'name': f'bulk {index}', 'description': '-', 'price': index + 1, 'tag_ids': [self.sale.id, self.new.id]}
+            for index in range(count)
+        ]
+
+    def test_create(self):
+        def request(count):
+            response = self.client.post(self.url, self.items(count), format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data), count)
+            return response
+
+        # savepoint x2, tags, products, tag rows, re-read products, re-read tags
+        self.assertQueryBudgetForSizes(7, request, [1, 20])
+        product = Product.objects.filter(name='bulk 0').first()
+        self.assertEqual(product.user, self.user)
+        self.assertEqual(set(product.tags.all()), {self.sale, self.new})
+        self.assertIsNotNone(product.price_in_base)
+
+    def test_errors_per_item(self):
+        items = self.items(3)
+        items[1]['tag_ids'] = [self.sale.id, 999999]
+        del items[2]['name']
+        response = self.client.post(self.url, items, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('tag_ids', response.data[1])
+        self.assertIn('name', response.data[2])
+        self.assertFalse(Product.objects.exists())
+
+    @override_settings(PRODUCT_BULK_MAX_ITEMS=2)
+    def test_max_items(self):
+        response = self.client.post(self.url, self.items(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update(self):
+        products = self.create_products(3, user=self.user, tags=[self.sale])
+        other = self.create_products(1)[0]
+        self.client.get(reverse('product-detail', args=[products[0].id]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, [
+                {'id': products[0].id, 'price': 50, 'currency': 'usd'},
+                {'id': products[1].id, 'tag_ids': [self.new.id]},
+            ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['price_in_base'], Decimal('135.00'))
+
+        self.assertEqual(list(products[1].tags.all()), [self.new])
+        self.assertEqual(list(products[2].tags.all()), [self.sale])
+        detail = self.client.get(reverse('product-detail', args=[products[0].id]))
+        self.assertEqual(detail['X-Cache'], 'MISS')
+        self.assertEqual(detail.data['currency'], 'usd')
+
+        response = self.client.patch(self.url, [{'id': products[2].id, 'price': 1}, {'id': other.id, 'price': 1}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('id', response.data[1])
+
+    def test_update_duplicate_ids(self):
+        product = self.create_products(1, user=self.user)[0]
+        response = self.client.patch(self.url, [
+            {'id': product.id, 'tag_ids': [self.sale.id]},
+            {'id': product.id, 'tag_ids': [self.sale.id]},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('id', response.data[1])
+
+    @override_settings(PRODUCT_BULK_MAX_ITEMS=1)
+    def test_delete_max_items(self):
+        products = self.create_products(2, user=self.user)
+        response = self.client.delete(self.url, {'ids': [product.id for product in products]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_delete(self):
+        products = self.create_products(3, user=self.user)
+        other = self.create_products(1)[0]
+
+        response = self.client.delete(self.url, {'ids': [products[0].id, other.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.data['ids']), [1])
+        self.assertEqual(Product.objects.count(), 4)
+
+        response = self.client.delete(self.url, {'ids': [products[0].id, products[1].id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(set(Product.objects.all()), {products[2], other})
+
+
+class ExportTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.tags = [ProductTag.objects.create(name='sale'), ProductTag.objects.create(name='new')]
+        self.products = self.create_products(25, user=self.user, tags=self.tags)
+        self.create_products(5)
+
+    def export(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    @override_settings(PRODUCT_EXPORT_CHUNK_SIZE=10)
+    def test_ndjson(self):
+        response, content = self.export(reverse('product-export'), {'price_min': 11})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        # 15 owned (11..25) and 5 unowned (1..5 -> below 11)
+        self.assertEqual([row['id'] for row in rows], [product.id for product in self.products[10:]])
+        self.assertEqual(rows[0]['tag_names'], ['new', 'sale'])
+        self.assertEqual(rows[0]['price'], '11.00')
+
+    def test_csv_gzip(self):
+        response, content = self.export(reverse('product-export'), {'export_format': 'csv', 'compress': 'gzip'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('products.csv.gz', response['Content-Disposition'])
+        rows = list(csv.DictReader(gzip.decompress(content).decode().splitlines()))
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(rows[0]['tag_names'], 'new|sale')
+
+    def test_my_products(self):
+        _, content = self.export(reverse('product-my-products-export'), {})
+        self.assertEqual(len(content.decode().splitlines()), 25)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('product-export'), {'export_format': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ImportProductsTest(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.existing = Product.objects.create(name='old name', description='-', price=1)
+        ProductTag.objects.create(name='sale')
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command('import_products', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_upsert_with_links(self):
+        path = self.write('catalog.csv', '\n'.join([
+            'id,name,description,price,currency,tag_names,category_names',
+            f'{self.existing.id},new name,-,10.50,usd,sale|new,games',
+            ',fresh,-,3,,,games|toys',
+            '500,explicit id,-,4,euro,new,',
+            '',
+        ]))
+        output = self.run_import(path, '--batch-size', '2')
+        self.assertIn('rows/s', output)
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.currency), ('new name', 'usd'))
+        self.assertEqual(self.existing.price_in_base, Decimal('28.35'))
+        self.assertEqual({tag.name for tag in self.existing.tags.all()}, {'sale', 'new'})
+        self.assertEqual(list(self.existing.categories.values_list('name', flat=True)), ['games'])
+
+        fresh = Product.objects.get(name='fresh')
+        self.assertEqual(fresh.currency, 'gel')
+        self.assertEqual(set(fresh.categories.values_list('name', flat=True)), {'games', 'toys'})
+        self.assertEqual(Product.objects.get(id=500).name, 'explicit id')
+        self.assertEqual(ProductTag.objects.count(), 2)
+        # the id sequence moved past the imported ids
+        self.assertGreater(Product.objects.create(name='next', description='-', price=1).id, 500)
+        self.assertFalse(os.path.exists(path + '.checkpoint.json'))
+
+    def test_ndjson_gzip_and_resume(self):
+        rows = [{'id': 1000 + index, 'name': f'row {index}', 'price': index, 'tag_names': ['sale']} for index in range(5)]
+        rows[3]['price'] = 'not a number'
+        path = self.write('catalog.ndjson.gz', ''.join(json.dumps(row) + '\n' for row in rows))
+
+        with self.assertRaises(CommandError):
+            self.run_import(path, '--batch-size', '2')
+        self.assertEqual(Product.objects.filter(id__gte=1000).count(), 2)
+        with open(path + '.checkpoint.json') as file:
+            self.assertEqual(json.load(file)['lines'], 2)
+
+        rows[3]['price'] = 3
+        path = self.write('catalog.ndjson.gz', ''.join(json.dumps(row) + '\n' for row in rows))
+        Product.objects.filter(id=1000).update(name='edited after the first run')
+        output = self.run_import(path, '--batch-size', '2', '--resume')
+
+        self.assertIn('resuming after line 2', output)
+        self.assertEqual(Product.objects.filter(id__gte=1000).count(), 5)
+        self.assertEqual(Product.objects.get(id=1000).name, 'edited after the first run')
+        self.assertEqual(Product.objects.get(id=1004).tags.get().name, 'sale')
+
+
+    def test_blank_ids_skip_explicit_ones(self):
+        # the sequence would hand the blank row the explicit id below
+        explicit = self.existing.id + 1
+        path = self.write('catalog.csv', '\n'.join([
+            'id,name,description,price',
+            ',blank id,-,1',
+            f'{explicit},explicit id,-,2',
+            '',
+        ]))
+        self.run_import(path)
+        self.assertEqual(Product.objects.get(id=explicit).name, 'explicit id')
+        self.assertGreater(Product.objects.get(name='blank id').id, explicit)
+        self.assertGreater(Product.objects.create(name='next', description='-', price=1).id, explicit)
+
+    def test_unknown_currency(self):
+        path = self.write('catalog.csv', 'id,name,description,price,currency\n,fresh,-,3,btc\n')
+        with self.assertRaisesMessage(CommandError, "line 1: unknown currency 'btc'"):
+            self.run_import(path)
+        self.assertFalse(Product.objects.filter(name='fresh').exists())
+
+
+class DatasetGeneratorTest(ProductTestMixin, TestCase):
+    def generate(self):
+        call_command(
+            'create_products', '--products', '30', '--users', '8', '--reviews-per-product', '3',
+            '--tags', '4', '--categories', '2', '--images', '1', '--favorites-per-user', '2',
+            '--cart-items-per-user', '2', '--chunk-size', '7', '--workers', '1', stdout=StringIO(),
+        )
+
+    def test_related_data(self):
+        self.generate()
+        self.assertEqual(Product.objects.count(), 30)
+        self.assertEqual(User.objects.count(), 8)
+        self.assertEqual(Cart.objects.count(), 8)
+        self.assertEqual(ProductImage.objects.count(), 30)
+        self.assertTrue(CartItem.objects.exists())
+        self.assertTrue(Product.objects.filter(categories__isnull=False).exists())
+        self.assertFalse(Product.objects.filter(price_in_base__isnull=True).exists())
+
+        # stored aggregates match the generated reviews
+        drifted = Product.objects.annotate(actual=Count('review')).exclude(review_count=F('actual'))
+        self.assertFalse(drifted.exists())
+        self.assertIn('repaired 0', self.reconcile())
+
+        # sequences were moved past the copied ids
+        self.create_user('after@example.com', 'after', '1')
+        Product.objects.create(name='after', description='-', price=1)
+
+    def reconcile(self):
+        out = StringIO()
+        call_command('reconcile_ratings', stdout=out)
+        return out.getvalue()
+
+    def test_fixed_seed(self):
+        def rows():
+            return list(Product.objects.order_by('id').values_list('id', 'name', 'price', 'user_id', 'review_count'))
+
+        self.generate()
+        first = rows()
+        for model in [Product, User, ProductTag, Category]:
+            model.objects.all().delete()
+        self.generate()
+        self.assertEqual(rows(), first)
+
+
+class BenchmarkApiTest(ProductTestMixin, TransactionTestCase):
+    # the benchmark server answers from its own threads and connections,
+    # so the fixtures have to be committed; its reads may go to replicas
+    databases = '__all__'
+
+    def test_results_json(self):
+        Product.objects.bulk_create([
+            Product(name=f'benchmark product {index}', description='-', price=10) for index in range(5)
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command(
+                'benchmark_api', '--mix', 'product_list=1,product_detail=1,cart_read=1', '--duration', '1',
+                '--warmup', '0', '--concurrency', '2', '--users', '2', '--output', output, stdout=StringIO(),
+            )
+            with open(output) as file:
+                results = json.load(file)
+
+        self.assertEqual(results['config']['concurrency'], 2)
+        self.assertEqual(set(results['endpoints']), {'product_list', 'product_detail', 'cart_read'})
+        for stats in results['endpoints'].values():
+            self.assertEqual(stats['errors'], 0)
+            self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+            self.assertGreater(stats['queries_per_request'], 0)
+        self.assertEqual(User.objects.filter(email__startswith='bench').count(), 2)
+
+    def test_asgi_server(self):
+        Product.objects.create(name='benchmark product', description='-', price=10)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command(
+                'benchmark_api', '--server', 'asgi', '--mix', 'async_product_detail=1,async_tag_list=1',
+                '--duration', '1', '--warmup', '0', '--concurrency', '2', '--users', '1', '--output', output,
+                stdout=StringIO(),
+            )
+            with open(output) as file:
+                results = json.load(file)
+        self.assertEqual(results['config']['server'], 'asgi')
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertGreater(results['total']['requests'], 0)
+
+    def test_mix_and_percentiles(self):
+        self.assertEqual(parse_mix('product_list=3,login=0'), {'product_list': 3})
+        with self.assertRaises(ValueError):
+            parse_mix('checkout=1')
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, fraction) for fraction in (0.5, 0.95, 0.99)], [50, 95, 99])
+
+
+class MetricsTest(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.create_user())
+        Product.objects.create(name='metered', description='-', price=10)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_per_view_metrics(self):
+        view = 'ProductViewSet.list'
+        requests = self.sample('http_requests_total', view=view, method='GET', status='200')
+        observed = self.sample('http_request_db_queries_count', view=view)
+        hits = self.sample('http_response_cache_total', view=view, result='hit')
+
+        self.client.get(reverse('product-list'))
+        self.client.get(reverse('product-list'))
+
+        self.assertEqual(self.sample('http_requests_total', view=view, method='GET', status='200'), requests + 2)
+        self.assertEqual(self.sample('http_request_db_queries_count', view=view), observed + 2)
+        self.assertEqual(self.sample('http_response_cache_total', view=view, result='hit'), hits + 1)
+
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'http_request_duration_seconds_bucket{', response.content)
+        self.assertIn(b'view="ProductViewSet.list"', response.content)
+
+    def test_unknown_paths_share_a_label(self):
+        before = self.sample('http_requests_total', view='unmatched', method='GET', status='404')
+        self.client.get('/no-such-page/')
+        self.client.get('/another-missing-page/')
+        self.assertEqual(self.sample('http_requests_total', view='unmatched', method='GET', status='404'), before + 2)
+
+    def test_plain_views_labelled_by_function(self):
+        view = 'config.utils.metrics.metrics_view'
+        before = self.sample('http_requests_total', view=view, method='GET', status='403')
+        self.client.get(reverse('metrics'))
+        self.assertEqual(self.sample('http_requests_total', view=view, method='GET', status='403'), before + 1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=False)
+    def test_closed_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(METRICS_TOKEN=None, DEBUG=True)
+    def test_open_under_debug_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_200_OK)
+
+
+class QueryInspectorTest(ProductTestMixin, TestCase):
+    logger = 'config.utils.query_inspector'
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.products = Product.objects.bulk_create([
+            Product(name=f'inspected {index}', description='-', price=10, user=self.user) for index in range(4)
+        ])
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'it''s'  LIMIT 21"),
+            fingerprint('SELECT * FROM t WHERE id IN (%s) AND name = \'other\' LIMIT 5'),
+        )
+
+    @override_settings(N_PLUS_ONE_THRESHOLD=3)
+    def test_repeated_queries(self):
+        with self.assertLogs(self.logger, 'WARNING') as logs:
+            with inspect_queries('owners'):
+                owners = [product.user.email for product in Product.objects.all()]
+        self.assertEqual(len(owners), 4)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('possible N+1 owners: 4 queries like SELECT', logs.output[0])
+        self.assertIn('products/tests.py', logs.output[0])
+
+    @override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_EXPLAIN_SAMPLE_RATE=1)
+    def test_slow_query_explain(self):
+        with self.assertLogs(self.logger, 'WARNING') as logs:
+            response = self.client.get(reverse('product-detail', args=[self.products[0].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        slow = [line for line in logs.output if 'products_product' in line and 'EXPLAIN' in line]
+        self.assertTrue(slow)
+        self.assertIn(f'GET /products/{self.products[0].id}/', slow[0])
+        self.assertIn('Scan', slow[0])
+
+    @override_settings(SLOW_QUERY_MS=0, SLOW_QUERY_EXPLAIN_SAMPLE_RATE=1)
+    def test_failed_explain_inside_atomic(self):
+        def broken_explain(execute, sql, params, many, context):
+            if sql.startswith('EXPLAIN'):
+                sql, params = 'SELECT 1 / 0', None
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(broken_explain), self.assertLogs(self.logger, 'WARNING') as logs:
+            with transaction.atomic(), inspect_queries('atomic'):
+                self.assertEqual(Product.objects.count(), 4)
+                # the transaction is still usable
+                self.assertEqual(Product.objects.filter(name='inspected 0').count(), 1)
+        self.assertIn('failed: division by zero', logs.output[0])
+
+    def test_quiet_request(self):
+        with self.assertNoLogs(self.logger, 'WARNING'):
+            self.client.get(reverse('product-list'))
+
+
+class ProfilerTest(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.product = Product.objects.create(name='profiled', description='-', price=10)
+        self.url = reverse('product-detail', args=[self.product.id])
+
+    def login(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def test_staff_inline_sample(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.login(self.user)
+
+        response = self.client.get(self.url, HTTP_X_PROFILE='sample', HTTP_X_PROFILE_OUTPUT='inline')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        report = response.json()
+        self.assertEqual(report['view'], 'ProductViewSet.retrieve')
+        self.assertEqual(report['status'], 200)
+        self.assertTrue(any('products_product' in query['sql'] for query in report['sql']))
+        starts = [query['start_ms'] for query in report['sql']]
+        self.assertEqual(starts, sorted(starts))
+
+    def test_ignored_for_other_users(self):
+        self.login(self.user)
+        response = self.client.get(self.url, HTTP_X_PROFILE='sample', HTTP_X_PROFILE_OUTPUT='inline')
+        self.assertEqual(response.data['name'], 'profiled')
+        self.assertFalse(response.has_header('X-Profile'))
+
+        response = self.client.get(self.url, HTTP_X_PROFILE='cprofile', HTTP_X_PROFILE_TOKEN='forged')
+        self.assertFalse(response.has_header('X-Profile'))
+
+    def test_signed_token_to_disk(self):
+        self.login(self.user)
+        with tempfile.TemporaryDirectory() as directory, override_settings(PROFILER_DIR=directory):
+            response = self.client.get(self.url, HTTP_X_PROFILE='cprofile', HTTP_X_PROFILE_TOKEN=make_token())
+            self.assertEqual(response.data['name'], 'profiled')
+            profile, sql = response['X-Profile'].split(', ')
+            self.assertTrue(profile.endswith('.prof'))
+            stats = pstats.Stats(os.path.join(directory, profile))
+            self.assertTrue(any(function[2] == 'retrieve' for function in stats.stats))
+            with open(os.path.join(directory, sql)) as file:
+                self.assertEqual(json.load(file)['view'], 'ProductViewSet.retrieve')
+
+
+@override_settings(REPLICA_DATABASES=['replica'], RESPONSE_CACHE_ENDPOINTS={})
+class ReplicaRoutingTest(ProductTestMixin, TransactionTestCase):
+    # the replica is a second connection to the test database, so it only
+    # sees committed rows, like a real one
+
+    def setUp(self):
+        super().setUp()
+        default = connections['default']
+        connections['replica'] = type(default)({**default.settings_dict}, alias='replica')
+        reset_lag_checks()
+        self.addCleanup(self.remove_replica)
+
+        self.user = self.create_user()
+        self.other = self.create_user('other@example.com', 'other', '556')
+        self.product = Product.objects.create(name='replicated', description='-', price=10)
+        self.client = APIClient()
+
+    def remove_replica(self):
+        connections['replica'].close()
+        connections['replica'].close_pool()
+        del connections['replica']
+        reset_lag_checks()
+
+    def login(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+
+    def get(self, url):
+        with CaptureQueriesContext(connections['replica']) as replica, \
+                CaptureQueriesContext(connections['default']) as primary:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(primary), len(replica)
+
+    def test_reads_use_replica(self):
+        self.login(self.user)
+        primary, replica = self.get(reverse('product-list'))
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_read_your_writes(self):
+        self.login(self.user)
+        response = self.client.post(reverse('cart-items-list'), {'product_id': self.product.id, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        primary, replica = self.get(reverse('cart-list'))
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+        # only the writer is pinned
+        self.login(self.other)
+        primary, replica = self.get(reverse('cart-list'))
+        self.assertEqual(primary, 0)
+
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            cache.clear()
+            self.login(self.user)
+            primary, replica = self.get(reverse('cart-list'))
+            self.assertEqual(primary, 0)
+
+    @override_settings(REPLICA_MAX_LAG=-1)
+    def test_lagging_replica_skipped(self):
+        self.login(self.user)
+        primary, replica = self.get(reverse('product-list'))
+        # only the lag check ran on the replica
+        self.assertEqual(replica, 1)
+        self.assertGreater(primary, 0)
+
+    @override_settings(RESPONSE_CACHE_ENDPOINTS={'product.retrieve': True})
+    def test_cached_responses_built_on_primary(self):
+        # everyone gets the cached body, the user who just wrote included
+        self.login(self.other)
+        url = reverse('product-detail', args=[self.product.id])
+        with CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        # the ETag validators are per request and may still come from the replica
+        body = [query for query in replica if 'products_product' in query['sql'] and not query['sql'].startswith('SELECT MAX(')]
+        self.assertFalse(body)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    def test_outside_requests(self):
+        self.assertIsNone(ReplicaRouter().db_for_read(Product))
+        self.assertEqual(Product.objects.get().name, 'replicated')
+
+
+class AsyncEndpointsTest(ProductTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user()
+        self.tag = ProductTag.objects.create(name='async')
+        self.products = Product.objects.bulk_create([
+            Product(name=f'async product {index}', description='-', price=index + 1, user=self.user)
+            for index in range(12)
+        ])
+        self.products[0].tags.add(self.tag)
+        self.category = Category.objects.create(name='async category')
+        token = RefreshToken.for_user(self.user).access_token
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    async def test_same_bodies_as_sync(self):
+        cases = [
+            ('product-list', 'async-product-list', [], {}),
+            ('product-list', 'async-product-list', [], {'page': 2, 'ordering': 'price'}),
+            ('product-list', 'async-product-list', [], {'page_size': 0}),
+            ('product-list', 'async-product-list', [], {'page_size': -3}),
+            ('product-list', 'async-product-list', [], {'page_size': 'all'}),
+            ('product-list', 'async-product-list', [], {'page': 'last', 'page_size': 4}),
+            ('product-list', 'async-product-list', [], {'tags': self.tag.id, 'fields': 'id,name,tags'}),
+            ('product-detail', 'async-product-detail', [self.products[3].id], {}),
+            ('producttag-list', 'async-tag-list', [], {}),
+            ('category-list', 'async-category-list', [], {'search': 'async'}),
+        ]
+        for sync_name, async_name, args, params in cases:
+            with self.subTest(async_name, params=params):
+                expected = await sync_to_async(self.client.get)(reverse(sync_name, args=args), params)
+                response = await self.async_client.get(reverse(async_name, args=args), params, headers=self.headers)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                body, expected = response.json(), expected.json()
+                if 'results' in expected:
+                    # links point at the async paths
+                    body, expected = (body['count'], body['results']), (expected['count'], expected['results'])
+                self.assertEqual(body, expected)
+
+    async def test_errors(self):
+        response = await self.async_client.get(reverse('async-product-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.get(reverse('async-product-list'), {'page': 9}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get(reverse('async-product-detail', args=[0]), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.post(reverse('async-tag-list'), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        response = await self.async_client.get(reverse('async-category-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_throttles_match_sync(self):
+        url = reverse('async-category-list')
+        with mock.patch.dict(SimpleRateThrottle.THROTTLE_RATES, {'anon': '2/day'}):
+            # one quota for both paths
+            anonymous = await sync_to_async(APIClient().get)(reverse('category-list'))
+            self.assertEqual(anonymous.status_code, status.HTTP_200_OK)
+            self.assertEqual((await self.async_client.get(url)).status_code, status.HTTP_200_OK)
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '86400')
+
+        with mock.patch.dict(SimpleRateThrottle.THROTTLE_RATES, {'user': '1/day'}):
+            url = reverse('async-product-list')
+            self.assertEqual((await self.async_client.get(url, headers=self.headers)).status_code, status.HTTP_200_OK)
+            response = await self.async_client.get(url, headers=self.headers)
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    async def test_response_cache(self):
+        url = reverse('async-product-detail', args=[self.products[0].id])
+        first = await self.async_client.get(url, headers=self.headers)
+        second = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+
+        # writes through the sync API invalidate the async entries too
+        def rename():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(reverse('product-detail', args=[self.products[0].id]), {'name': 'renamed'})
+
+        await sync_to_async(rename)()
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'renamed')
+
+
+GEVENT_SCRIPT = """
+from config.utils.green import patch
+patch()
+
+import json
+import sys
+import time
+
+import django
+django.setup()
+
+import gevent
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from config.utils.db_pool import _pools
+
+setup_test_environment()
+tokens = json.loads(sys.argv[1])
+
+
+def sleep(index):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_sleep(0.2)')
+    finally:
+        connection.close()
+
+
+def cached(index):
+    cache.set(f'gevent:{index}', index)
+    gevent.sleep(0.01)
+    return cache.get(f'gevent:{index}')
+
+
+def my_products(index):
+    token = tokens[index % len(tokens)]
+    try:
+        response = Client().get('/products/my_products/', headers={'Authorization': f'Bearer {token}'})
+    finally:
+        # the test client keeps connections open past the request
+        connection.close()
+    return [token, response.status_code, response.json().get('count')]
+
+
+def run(function, count):
+    greenlets = [gevent.spawn(function, index) for index in range(count)]
+    gevent.joinall(greenlets, raise_error=True)
+    return [greenlet.value for greenlet in greenlets]
+
+
+started = time.perf_counter()
+run(sleep, 20)
+print(json.dumps({
+    'engine': connection.settings_dict['ENGINE'],
+    'sleep_seconds': time.perf_counter() - started,
+    'cached': run(cached, 50),
+    'my_products': run(my_products, 30),
+    'pool_sizes': [pool.size for pool in _pools.values()],
+    'pool_max_sizes': [pool.max_size for pool in _pools.values()],
+}))
+"""
+
+
+class GeventTest(ProductTestMixin, TransactionTestCase):
+    # the patching has to happen before Django loads, so it runs in a child
+    # process against the test database, which sees the committed rows
+
+    def test_orm_cache_and_jwt_under_gevent(self):
+        tokens = {}
+        for index in range(3):
+            user = self.create_user(f'green{index}@example.com', f'green{index}', f'77{index}')
+            self.create_products(index + 1, user=user)
+            tokens[str(RefreshToken.for_user(user).access_token)] = index + 1
+
+        env = {
+            **os.environ,
+            'SERVER_MODE': 'gevent',
+            'DJANGO_SETTINGS_MODULE': 'config.settings',
+            'POSTGRES_DB': connections['default'].settings_dict['NAME'],
+            'DB_POOL_MAX_SIZE': '5',
+            'CACHE_REDIS_URL': settings.CACHES['default']['LOCATION'],
+        }
+        process = subprocess.run(
+            [sys.executable, '-c', GEVENT_SCRIPT, json.dumps(list(tokens))],
+            env=env, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        result = json.loads(process.stdout.splitlines()[-1])
+
+        self.assertEqual(result['engine'], 'config.db_backends.pooled_postgresql')
+        # 20 queries of 0.2s on 5 connections overlap, one after another they take 4s
+        self.assertLess(result['sleep_seconds'], 2)
+        self.assertEqual(result['cached'], list(range(50)))
+        for token, status_code, count in result['my_products']:
+            self.assertEqual(status_code, status.HTTP_200_OK)
+            self.assertEqual(count, tokens[token])
+        self.assertEqual(result['pool_max_sizes'], [5])
+        self.assertLessEqual(result['pool_sizes'][0], 5)
+
+
+class DatabasePoolTest(ProductTestMixin, TestCase):
+    def make_pool(self, **options):
+        params = connections['default'].get_connection_params()
+        pool = ConnectionPool(lambda: psycopg2.connect(**params), name='pool-test', **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, {'alias': 'pool-test', **labels}) or 0
+
+    def test_reuse(self):
+        opened = self.sample('db_pool_connections_opened_total')
+        pool = self.make_pool()
+        connection = pool.getconn()
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(), connection)
+        self.assertEqual(pool.stats()['opened'], 1)
+        self.assertEqual(pool.stats()['checkouts'], 2)
+        self.assertEqual(pool.stats()['in_use'], 1)
+        self.assertEqual(self.sample('db_pool_connections_opened_total'), opened + 1)
+
+    def test_rolls_back_returned_transactions(self):
+        pool = self.make_pool()
+        connection = pool.getconn()
+        connection.cursor().execute('SELECT 1')
+        pool.putconn(connection)
+        self.assertEqual(connection.info.transaction_status, psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_exhausted(self):
+        timeouts = self.sample('db_pool_timeouts_total')
+        pool = self.make_pool(max_size=1, timeout=0.05)
+        connection = pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        self.assertEqual(self.sample('db_pool_timeouts_total'), timeouts + 1)
+
+        # a waiting caller gets the connection once it is returned
+        pool.timeout = 5
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.getconn()))
+        waiter.start()
+        time.sleep(0.05)
+        pool.putconn(connection)
+        waiter.join()
+        self.assertEqual(got, [connection])
+        self.assertEqual(pool.stats()['waits'], 1)
+
+    def test_pre_ping_replaces_dead_connections(self):
+        pool = self.make_pool(pre_ping_after=0)
+        connection = pool.getconn()
+        pid = connection.info.backend_pid
+        pool.putconn(connection)
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)', [pid])
+
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, connection)
+        with replacement.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertEqual(pool.stats()['opened'], 2)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_max_lifetime_and_idle(self):
+        pool = self.make_pool(max_lifetime=0.01)
+        connection = pool.getconn()
+        time.sleep(0.02)
+        pool.putconn(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()['size'], 0)
+
+        # idle connections beyond MIN_SIZE are closed
+        pool = self.make_pool(min_size=1, max_idle=0)
+        first, second = pool.getconn(), pool.getconn()
+        pool.putconn(first)
+        pool.putconn(second)
+        self.assertIs(pool.getconn(), second)
+        self.assertTrue(first.closed)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_exhausted_pool_answers_503(self):
+        try:
+            with connections['default'].wrap_database_errors:
+                raise PoolTimeout('no connection')
+        except OperationalError as error:
+            exhausted = error
+
+        client = APIClient()
+        client.force_authenticate(self.create_user())
+        with mock.patch.object(TagViewSet, 'list', side_effect=exhausted):
+            response = client.get(reverse('producttag-list'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_backend_returns_connections(self):
+        pool = connections['default'].connection_pool
+        self.assertIsNotNone(pool)
+        self.assertEqual(pool.stats()['in_use'], 1)
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertIn(b'db_pool_connections{', response.content)
+
+
+class CartTotalsTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.get(user=self.user)
+        self.products = self.create_products(20, tags=[ProductTag.objects.create(name='sale')])
+        ProductImage.objects.bulk_create([
+            ProductImage(product=self.products[0], image='products/first.webp'),
+            ProductImage(product=self.products[0], image='products/second.webp'),
+        ])
+
+    def add_items(self, products):
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product=product, quantity=index + 1, price_at_time_of_addition=product.price)
+            for index, product in enumerate(products)
+        ])
+
+    def test_totals_and_summary(self):
+        self.add_items(self.products[:3])
+        cart = self.client.get(reverse('cart-list')).data[0]
+        # 1 * 1 + 2 * 2 + 3 * 3
+        self.assertEqual(cart['total'], Decimal('14.00'))
+        self.assertEqual(cart['totals'], {'gel': Decimal('14.00')})
+        self.assertEqual([item['total_price'] for item in cart['items']], [Decimal('1.00'), Decimal('4.00'), Decimal('9.00')])
+
+        product = cart['items'][0]['product']
+        self.assertEqual(set(product), {'id', 'name', 'price', 'price_currency', 'primary_image'})
+        self.assertEqual(product['price_currency'], 'gel')
+        self.assertEqual(product['primary_image'], 'http://testserver/media/products/first.webp')
+        self.assertIsNone(cart['items'][1]['product']['primary_image'])
+
+    def test_totals_per_currency(self):
+        Product.objects.filter(id__in=[self.products[1].id, self.products[3].id]).update(currency='usd')
+        self.add_items(self.products[:4])
+        # 1 * 1 + 3 * 3 in gel, 2 * 2 + 4 * 4 in usd
+        expected = {'gel': Decimal('10.00'), 'usd': Decimal('20.00')}
+        cart = self.client.get(reverse('cart-list')).data[0]
+        self.assertEqual(cart['totals'], expected)
+        self.assertEqual([item['product']['price_currency'] for item in cart['items']], ['gel', 'usd', 'gel', 'usd'])
+        self.assertEqual(CartSerializer(self.cart).data['totals'], expected)
+        # 20 USD at the seeded 2.70
+        self.assertEqual(cart['total'], Decimal('64.00'))
+        self.assertEqual(CartSerializer(self.cart).data['total'], Decimal('64.00'))
+
+    def test_total_follows_rates(self):
+        Product.objects.filter(id=self.products[1].id).update(currency='usd')
+        self.add_items(self.products[:2])
+        url = reverse('cart-list')
+        response = self.client.get(url)
+        # 1 GEL + 4 USD * 2.70
+        self.assertEqual(response.data[0]['total'], Decimal('11.80'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rate = FxRate.objects.get(currency='usd')
+            rate.rate = Decimal('3')
+            rate.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['total'], Decimal('13.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FxRate.objects.get(currency='usd').delete()
+        cart = self.client.get(url).data[0]
+        self.assertIsNone(cart['total'])
+        self.assertEqual(cart['totals'], {'gel': Decimal('1.00'), 'usd': Decimal('4.00')})
+
+    def test_empty_cart(self):
+        cart = self.client.get(reverse('cart-list')).data[0]
+        self.assertEqual((cart['total'], cart['totals']), (0, {}))
+
+    def test_queries_do_not_grow_with_items(self):
+        # cached between rate changes
+        get_rates()
+        for start, end in [(0, 1), (1, 5), (5, 20)]:
+            self.add_items(self.products[start:end])
+            with self.subTest(items=end):
+                # validators, carts with totals, items, product summaries
+                response = self.assertQueryBudget(4, self.client.get, reverse('cart-list'))
+                self.assertEqual(len(response.data[0]['items']), end)
+
+    def test_writes_return_fresh_totals(self):
+        response = self.client.post(reverse('cart-items-list'), {'product_id': self.products[1].id, 'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_price'], Decimal('4.00'))
+
+        url = reverse('cart-items-detail', args=[response.data['id']])
+        response = self.client.patch(url, {'quantity': 5}, format='json')
+        self.assertEqual(response.data['total_price'], Decimal('10.00'))
+        self.assertEqual(response.data['product']['primary_image'], None)
+
+    def test_etag_follows_primary_image(self):
+        self.add_items(self.products[:1])
+        url = reverse('cart-list')
+        etag = self.client.get(url)['ETag']
+        ProductImage.objects.filter(image='products/first.webp').delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['items'][0]['product']['primary_image'], 'http://testserver/media/products/second.webp')
+
+
+@override_settings(CART_STORE_ENABLED=True)
+class CartStoreTest(ProductTestMixin, QueryBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cart_store._redis().flushdb()
+        self.client = APIClient()
+        self.user = self.create_user()
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.get(user=self.user)
+        self.products = self.create_products(3)
+
+    def add(self, product, quantity=1, client=None):
+        response = (client or self.client).post(
+            reverse('cart-items-list'), {'product_id': product.id, 'quantity': quantity}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def test_writes_stay_in_redis_until_flushed(self):
+        first = self.add(self.products[0], 2)
+        second = self.add(self.products[1])
+        url = reverse('cart-items-detail', args=[first])
+        response = self.client.patch(url, {'quantity': 5}, format='json')
+        self.assertEqual(response.data['total_price'], Decimal('5.00'))
+        self.client.delete(reverse('cart-items-detail', args=[second]))
+        self.assertFalse(CartItem.objects.exists())
+
+        self.assertEqual(flush_carts(), 1)
+        item = CartItem.objects.get()
+        self.assertEqual((item.id, item.cart_id, item.quantity), (first, self.cart.id, 5))
+        self.assertEqual(flush_carts(), 0)
+
+    def test_reads_persist_first(self):
+        item_id = self.add(self.products[2], 2)
+        cart = self.client.get(reverse('cart-list')).data[0]
+        self.assertEqual([item['id'] for item in cart['items']], [item_id])
+        self.assertEqual(cart['total'], Decimal('6.00'))
+        self.assertEqual(cart['totals'], {'gel': Decimal('6.00')})
+        self.assertTrue(CartItem.objects.filter(id=item_id).exists())
+
+    def test_rebuilt_from_postgres(self):
+        item = CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1, price_at_time_of_addition=1)
+        url = reverse('cart-items-detail', args=[item.id])
+        self.client.patch(url, {'quantity': 4}, format='json')
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 1)
+
+        self.client.get(reverse('cart-list'))
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 4)
+        # someone else's item is not in this user's hash
+        other = APIClient()
+        other.force_authenticate(self.create_user('other@example.com', 'other', '556'))
+        self.assertEqual(other.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_flush_batches(self):
+        clients = []
+        for index in range(3):
+            client = APIClient()
+            client.force_authenticate(self.create_user(f'user{index}@example.com', f'user{index}', f'60{index}'))
+            clients.append(client)
+            self.add(self.products[index], client=client)
+        self.assertEqual(cart_store.flush_carts(batch_size=2), 3)
+        self.assertEqual(CartItem.objects.count(), 3)
+
+    def test_mutations_skip_postgres(self):
+        item_id = self.add(self.products[0])
+        url = reverse('cart-items-detail', args=[item_id])
+        # the product for its summary and primary image, nothing written
+        response = self.assertQueryBudget(2, self.client.patch, url, {'quantity': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.client.delete(url)
+        self.assertFalse([query for query in queries if not query['sql'].startswith('SELECT')])
+
+    def test_patch_without_quantity_keeps_it(self):
+        item_id = self.add(self.products[0], 2)
+        response = self.client.patch(reverse('cart-items-detail', args=[item_id]), {}, format='json')
+        self.assertEqual(response.data['quantity'], 2)
+        self.assertEqual(flush_carts(), 1)
+        self.assertEqual(CartItem.objects.get().quantity, 2)
+
+    def test_bad_cart_does_not_block_others(self):
+        other = APIClient()
+        other_user = self.create_user('other@example.com', 'other', '556')
+        other.force_authenticate(other_user)
+        self.add(self.products[0])
+        item_id = self.add(self.products[1], client=other)
+        # written before items were checked
+        cart_store._redis().hset(
+            f'cart:{other_user.id}', f'item:{item_id}', json.dumps({'product_id': self.products[1].id, 'quantity': None, 'price': '2'}),
+        )
+        with self.assertLogs('products.cart_store', 'ERROR'):
+            self.assertEqual(flush_carts(), 1)
+        self.assertEqual(list(CartItem.objects.values_list('cart__user', flat=True)), [self.user.id])
+        self.assertEqual(cart_store._redis().smembers('cart:dirty'), {str(other_user.id).encode()})
+
+    def test_survives_cache_clear(self):
+        item_id = self.add(self.products[0])
+        cache.clear()
+        cart = self.client.get(reverse('cart-list')).data[0]
+        self.assertEqual([item['id'] for item in cart['items']], [item_id])
+
+
+@override_settings(CART_STORE_ENABLED=True)
+class CartStoreLockTest(ProductTestMixin, TransactionTestCase):
+    def test_flushes_of_one_cart_take_turns(self):
+        cart_store._redis().flushdb()
+        user = self.create_user()
+        item = cart_store.add_item(user, self.create_products(1)[0], 1)
+        writing, resume = threading.Event(), threading.Event()
+        write_carts = cart_store._write_carts
+
+        def slow_write(carts):
+            if not writing.is_set():
+                writing.set()
+                resume.wait(5)
+            write_carts(carts)
+
+        def run(target):
+            try:
+                target()
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(cart_store, '_write_carts', slow_write):
+            beat = threading.Thread(target=run, args=[cart_store.flush_carts])
+            beat.start()
+            writing.wait(5)
+            # changed and read while the beat writes the older snapshot
+            item.quantity = 5
+            cart_store.update_item(user, item)
+            read = threading.Thread(target=run, args=[lambda: cart_store.persist_cart(user)])
+            read.start()
+            time.sleep(0.3)
+            resume.set()
+            beat.join()
+            read.join()
+        self.assertEqual(CartItem.objects.get().quantity, 5)
+
+
+class TestRunnerTest(TestCase):
+    def test_redis_databases_are_the_tests_own(self):
+        self.assertTrue(settings.CACHES['default']['LOCATION'].endswith(f"/{TEST_REDIS_DBS['cache']}"))
+        self.assertTrue(settings.CART_STORE_REDIS_URL.endswith(f"/{TEST_REDIS_DBS['cart_store']}"))
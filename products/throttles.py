@@ -0,0 +1,6 @@
+from rest_framework.throttling import UserRateThrottle
+
+class AutocompleteRateThrottle(UserRateThrottle):
+    # the search box calls autocomplete on every keystroke, so it gets its own
+    # bucket instead of spending the daily 'user' quota
+    scope = 'autocomplete'
@@ -5,6 +5,7 @@ from products.views import (ProductViewSet,
                             FavoriteProductViewSet,
                             ProductImageViewSet, CartItemViewSet)
 
+from products import async_views
 from rest_framework_nested import routers
 from rest_framework.routers import SimpleRouter, DefaultRouter
 
@@ -32,6 +33,9 @@ products_router.register('reviews', ReviewViewSet, basename='product-reviews')
 urlpatterns = [
     path('', include(router.urls)),
     path('', include(products_router.urls)),
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/tags/', async_views.tag_list, name='async-tag-list'),
 ]
 
 
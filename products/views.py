@@ -1,28 +1,74 @@
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
 from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from rest_framework.mixins import CreateModelMixin, ListModelMixin, UpdateModelMixin, RetrieveModelMixin, DestroyModelMixin
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter
+from django.db import transaction
+from django.conf import settings
+from django.http import Http404
+from rest_framework import status
 from django.core.exceptions import PermissionDenied
-from products.filters import ProductFilter
+from rest_framework.exceptions import ValidationError
+from products.filters import ProductFilter, ProductFullTextSearchFilter, ProductOrderingFilter
 from rest_framework.throttling import AnonRateThrottle, UserRateThrottle, ScopedRateThrottle
-from .pagination import ProductPagination
+from .pagination import ProductPagination, ProductCursorPagination, ReviewCursorPagination, CursorPaginationMixin
 from products.models import Product, Review, Cart, ProductImage, ProductTag, FavoriteProduct, CartItem
-from products.serializers import ProductSerializer, ProductImageSerializer, ReviewSerializer, CartSerializer, ProductTagSerializer, FavoriteProductSerializer, CartItemSerializer
+from products.serializers import ProductSerializer, ProductBulkSerializer, ProductBulkDeleteSerializer, ProductImageSerializer, ReviewSerializer, CartSerializer, ProductTagSerializer, FavoriteProductSerializer, CartItemSerializer
 from rest_framework.decorators import action
+from rest_framework.response import Response
 from products.permissions import IsObjectOwnerOrReadOnly
+from config.utils.response_cache import CachedResponseMixin
+from config.utils.conditional import ConditionalGetMixin
+from django.db.models import Count, Max
+from products.throttles import AutocompleteRateThrottle
+from products.querysets import product_queryset, product_aliases, shape_queryset
+from products.export import EXPORT_FORMATS, export_response
+from products.search import autocomplete
+from products.facets import product_facets
+from products.fx import get_rates
+from products.cart_store import PersistCartMixin, cart_store_enabled, get_item, remove_item
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, CursorPaginationMixin, ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    filter_backends = [DjangoFilterBackend, SearchFilter, ProductFullTextSearchFilter, ProductOrderingFilter]
     pagination_class = ProductPagination
+    cursor_pagination_class = ProductCursorPagination
     filterset_class = ProductFilter
     search_fields = ['name', 'description']
+    ordering_fields = ['price', 'created_at', 'name', 'review_count', 'rating_average']
+    ordering = ['-created_at']
+    # ?ordering=price sorts across currencies
+    ordering_aliases = {'price': 'price_in_base'}
+    cache_namespace = 'products'
+    cached_actions = ('list', 'retrieve', 'facets')
     throttle_classes = [UserRateThrottle]
 
+    def get_queryset(self):
+        return product_queryset(self.queryset, self.get_serializer())
+
+    # ?expand= relation -> its lookup from Product
+    expanded_relations = {'images': 'images', 'reviews': 'review', 'categories': 'categories'}
+
+    def get_validator_aggregates(self):
+        aggregates = super().get_validator_aggregates()
+        fields = self.get_serializer().fields
+        for name, relation in self.expanded_relations.items():
+            if name in fields:
+                # the joins repeat products, so counts are distinct
+                aggregates['count'] = Count('pk', distinct=True)
+                aggregates[f'{name}_updated_at'] = Max(f'{relation}__updated_at')
+                aggregates[f'{name}_count'] = Count(relation, distinct=True)
+        return aggregates
+
+    def get_validator_values(self):
+        values = super().get_validator_values()
+        # nested tags are part of every product body
+        values['tags_updated_at'] = ProductTag.objects.aggregate(Max('updated_at'))['updated_at__max']
+        return values
+
     def perform_update(self, serializer):
         product = self.get_object()
         if product.user != self.request.user:
@@ -31,7 +77,7 @@ class ProductViewSet(ModelViewSet):
 
     @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated])
     def my_products(self, request):
-        user_products = Product.objects.filter(user=request.user)
+        user_products = self.filter_queryset(product_queryset(Product.objects.filter(user=request.user), self.get_serializer()))
         page = self.paginate_queryset(user_products)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -39,13 +85,94 @@ class ProductViewSet(ModelViewSet):
         serializer = self.get_serializer(user_products, many=True)
         return Response(serializer.data) 
 
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        return self.export_response(request, self.queryset, 'products')
+
+    @action(detail=False, methods=['GET'], url_path='my_products/export', url_name='my-products-export')
+    def my_products_export(self, request):
+        return self.export_response(request, Product.objects.filter(user=request.user), 'my_products')
+
+    def export_response(self, request, queryset, filename):
+        """
+        Streams every matching product as NDJSON (default) or CSV with
+        ?export_format=, gzip-compressed with ?compress=gzip. The list filters
+        and ?q= apply, rows come in id order.
+        """
+        export_format = request.query_params.get('export_format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': [f'Choose one of: {", ".join(EXPORT_FORMATS)}.']})
+        compress = request.query_params.get('compress') == 'gzip'
+        queryset = self.filter_queryset(product_aliases(queryset))
+        return export_response(queryset, export_format, compress, filename)
+
+    @action(detail=False, methods=['POST', 'PATCH', 'DELETE'])
+    def bulk(self, request):
+        """
+        Creates (POST), partially updates (PATCH, items carry their id) or
+        deletes (DELETE {"ids": [...]}) up to PRODUCT_BULK_MAX_ITEMS of the
+        user's products in one transaction. Any invalid item rejects the whole
+        batch with errors aligned to the input.
+        """
+        if request.method == 'DELETE':
+            return self.bulk_destroy(request)
+
+        with transaction.atomic():
+            instance = None
+            if request.method == 'PATCH':
+                items = request.data if isinstance(request.data, list) else []
+                ids = [int(item['id']) for item in items if isinstance(item, dict) and str(item.get('id')).isdigit()]
+                # locked in id order until the batch is written, so they cannot go away in between
+                owned = Product.objects.filter(user=request.user, id__in=ids).order_by('id').select_for_update()
+                instance = {product.id: product for product in owned}
+
+            serializer = ProductBulkSerializer(
+                instance,
+                data=request.data,
+                many=True,
+                partial=instance is not None,
+                max_length=settings.PRODUCT_BULK_MAX_ITEMS,
+                context=self.get_serializer_context(),
+            )
+            serializer.is_valid(raise_exception=True)
+            products = serializer.save()
+
+        ids = [product.id for product in products]
+        # re-read for trigger-maintained columns and the nested tags
+        fresh = product_queryset(Product.objects.all(), self.get_serializer()).in_bulk(ids)
+        data = self.get_serializer([fresh[pk] for pk in ids], many=True).data
+        return Response(data, status=status.HTTP_200_OK if instance is not None else status.HTTP_201_CREATED)
 
+    def bulk_destroy(self, request):
+        serializer = ProductBulkDeleteSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            Product.objects.filter(user=request.user, id__in=serializer.validated_data['ids']).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-class ReviewViewSet(ModelViewSet):
+    @action(detail=False, methods=['GET'])
+    def facets(self, request):
+        return self.cached_response(self.get_facets, request)
+
+    def get_facets(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(product_facets(queryset))
+
+    @action(detail=False, methods=['GET'], throttle_classes=[AutocompleteRateThrottle])
+    def autocomplete(self, request):
+        term = request.query_params.get('q', '').strip()
+        if len(term) < 2:
+            return Response({'products': [], 'tags': [], 'suggestions': []})
+        return Response(autocomplete(term[:100]))
+
+
+
+class ReviewViewSet(CursorPaginationMixin, ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
     permission_classes = [IsAuthenticated, IsObjectOwnerOrReadOnly]
     filter_backends = [DjangoFilterBackend]
+    cursor_pagination_class = ReviewCursorPagination
     filterset_fields = ['rating']
 
     def get_queryset(self):
@@ -60,11 +187,13 @@ class ReviewViewSet(ModelViewSet):
     def perform_destroy(self, instance):
         if instance.user != self.request.user:
             raise PermissionDenied('you do not have permission to delete this review')
-        instance.delete()
+        with transaction.atomic():
+            instance.delete()
+            Product.apply_rating_change(instance.product_id, old_rating=instance.rating)
 
 
 
-class TagViewSet(ListModelMixin, GenericViewSet):
+class TagViewSet(ConditionalGetMixin, ListModelMixin, GenericViewSet):
     queryset = ProductTag.objects.all()
     serializer_class = ProductTagSerializer
     permission_classes = [IsAuthenticated]
@@ -95,18 +224,38 @@ class ProductImageViewSet(ListModelMixin, CreateModelMixin, RetrieveModelMixin,
 
 
 
-class CartItemViewSet(ModelViewSet):
+class CartItemViewSet(PersistCartMixin, ConditionalGetMixin, ModelViewSet):
     queryset = CartItem.objects.all()
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return self.queryset.filter(cart__user=self.request.user)
+        return shape_queryset(self.queryset.filter(cart__user=self.request.user), self.get_serializer())
+
+    def get_validator_aggregates(self):
+        return {
+            **super().get_validator_aggregates(),
+            'products_updated_at': Max('product__updated_at'),
+            'images_updated_at': Max('product__images__updated_at'),
+            'image_count': Count('product__images', distinct=True),
+        }
+
+    def get_object(self):
+        if not cart_store_enabled() or self.request.method in SAFE_METHODS:
+            return super().get_object()
+        # writes go to the user's hash, which only holds their own items
+        item = get_item(self.request.user, self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if item is None:
+            raise Http404
+        return item
     
     def perform_destroy(self, instance):
         if instance.cart.user != self.request.user:
             raise PermissionDenied('you do not have permission to delete this item')
-        instance.delete()
+        if cart_store_enabled():
+            remove_item(self.request.user, instance)
+        else:
+            instance.delete()
 
     def perform_update(self, serializer):
         instance = self.get_object()
@@ -118,11 +267,27 @@ class CartItemViewSet(ModelViewSet):
             
 
 
-class CartViewSet(ListModelMixin, CreateModelMixin, GenericViewSet):
+class CartViewSet(PersistCartMixin, ConditionalGetMixin, ListModelMixin, CreateModelMixin, GenericViewSet):
     queryset = Cart.objects.all()
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self, *args, **kwargs):
-        queryset = self.queryset.filter(user=self.request.user)
+        queryset = shape_queryset(self.queryset.filter(user=self.request.user), self.get_serializer())
         return queryset
+
+    def get_validator_aggregates(self):
+        return {
+            **super().get_validator_aggregates(),
+            'items_updated_at': Max('items__updated_at'),
+            'item_count': Count('items', distinct=True),
+            'products_updated_at': Max('items__product__updated_at'),
+            'images_updated_at': Max('items__product__images__updated_at'),
+            'image_count': Count('items__product__images', distinct=True),
+        }
+
+    def get_validator_values(self):
+        values = super().get_validator_values()
+        # the total is converted at the current rates
+        values['fx_rates'] = sorted(get_rates().items())
+        return values